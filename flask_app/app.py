@@ -1,24 +1,128 @@
+import atexit
+import functools
+import hashlib
+import hmac
 import os
+import time
+from typing import Optional
 
+import tracing
 from database import (
+    FOLLOW_PAGE_DEFAULT_LIMIT,
+    FOLLOW_PAGE_MAX_LIMIT,
+    TIMELINE_DEFAULT_LIMIT,
+    TIMELINE_MAX_LIMIT,
+    UNAVAILABLE_ERRORS,
     any_profile,
+    auth_cache_stats,
+    batch_likes,
     check_followers,
     check_likes,
+    decode_cursor,
     deleting,
+    follow_graph_stats,
+    get_follow_page,
     get_tweets,
+    get_tweets_page,
+    get_users_params,
+    job_stats,
+    like_buffer_stats,
+    likes_degraded,
     media,
     my_profile,
+    pool_stats,
     post_tweets,
+    post_tweets_bulk,
+    profile_cache_stats,
+    profile_version,
+    release_connection,
+    stream_timeline,
+    timeline_version,
 )
 from flasgger import Swagger
-from flask import Flask, jsonify, render_template, request
+from flask import Flask, g, jsonify, request, send_file, stream_with_context
+from jobs import JOB_WORKERS, JobWorker
+from profiler import RequestProfiler, list_profiles, profile_path, profile_text
+from slow_queries import slow_log
+from static_assets import StaticAssets
+from statements import prepared_stats
+from uploads import (
+    MAX_UPLOAD_SIZE,
+    UPLOAD_TEMP_FOLDER,
+    HashingUpload,
+    UploadRequest,
+    store_upload,
+)
 
 UPLOAD_FOLDER = "static/uploads"
 
 app = Flask(__name__)
+app.request_class = UploadRequest
 app.config["UPLOAD_FOLDER"] = UPLOAD_FOLDER
+app.config["UPLOAD_TEMP_FOLDER"] = UPLOAD_TEMP_FOLDER
+app.config["MAX_UPLOAD_SIZE"] = MAX_UPLOAD_SIZE
+# Запрос с заведомо слишком большим телом отклоняется до чтения
+app.config["MAX_CONTENT_LENGTH"] = MAX_UPLOAD_SIZE + 64 * 1024
+app.config["ADMIN_TOKEN"] = os.environ.get("ADMIN_TOKEN")
+# Вся лента по умолчанию отдаётся потоком (иначе — только с ?stream=1)
+app.config["TIMELINE_STREAM"] = os.environ.get("TIMELINE_STREAM", "0") == "1"
+app.wsgi_app = RequestProfiler(app.wsgi_app, app)
 
 Swagger(app)
+static_assets = StaticAssets(app)
+
+app.teardown_appcontext(release_connection)
+
+
+def service_unavailable(e):
+    """БД не ответила вовремя: клиент может повторить запрос"""
+    app.logger.warning("%s %s: %s: %s", request.method, request.path, type(e).__name__, e)
+    response = jsonify({"result": False, "error": "Сервис временно недоступен"})
+    response.headers["Retry-After"] = "1"
+    return response, 503
+
+
+for error in UNAVAILABLE_ERRORS:
+    app.register_error_handler(error, service_unavailable)
+
+
+# Фоновые задачи (обработка медиа, удаление файлов) в потоках этого процесса;
+# без JOB_WORKERS их выполняет отдельный процесс python manage.py jobs
+if JOB_WORKERS > 0:
+    job_worker = JobWorker(JOB_WORKERS)
+    job_worker.start()
+    atexit.register(job_worker.stop)
+
+
+@app.before_request
+def start_trace():
+    if tracing.ENABLED:
+        tracing.current_trace.set(tracing.RequestTrace())
+
+
+@app.after_request
+def finish_trace(response):
+    """Заголовок Server-Timing и длительность запроса в метриках маршрута"""
+    trace = tracing.current_trace.get()
+    if trace is not None:
+        response.headers["Server-Timing"] = tracing.server_timing(trace)
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        tracing.metrics.observe_route(
+            request.method,
+            route,
+            str(response.status_code),
+            time.perf_counter() - trace.started,
+        )
+    return response
+
+
+@app.teardown_request
+def discard_unsaved_uploads(exc=None):
+    """Удаляет временные файлы загрузок, не попавшие в хранилище"""
+    if "files" in request.__dict__:
+        for file in request.files.values():
+            if isinstance(file.stream, HashingUpload):
+                file.stream.discard()
 
 
 @app.route("/", methods=["GET"])
@@ -32,7 +136,7 @@ def index():
       200:
         description: Главная HTML-страница приложения.
     """
-    return render_template("index.html")
+    return static_assets.send_index()
 
 
 @app.route("/api/tweets", methods=["POST"])
@@ -88,7 +192,137 @@ def tweets_post():
     return jsonify({"result": True, "tweet_id": tweet_id}), 201
 
 
+# Сколько твитов можно загрузить одним запросом
+BULK_MAX_TWEETS = 10000
+
+
+@app.route("/api/tweets/bulk", methods=["POST"])
+def tweets_bulk():
+    """
+    Загрузить много твитов за один запрос (импорт архива)
+    ---
+    tags:
+      - Tweets
+    parameters:
+      - in: header
+        name: api-key
+        default: test
+        type: string
+        required: true
+        description: API ключ текущего пользователя.
+      - in: body
+        name: body
+        required: true
+        schema:
+          type: object
+          properties:
+            tweets:
+              type: array
+              description: Твиты (до 10000) в формате POST /api/tweets
+              items:
+                type: object
+                properties:
+                  tweet_data:
+                    type: string
+                  tweet_media_ids:
+                    type: array
+                    items:
+                      type: integer
+    responses:
+      201:
+        description: result = true, tweet_ids — id твитов в порядке запроса
+      400:
+        description: Некорректный список твитов
+      404:
+        description: Пользователь с таким api-key не найден
+    """
+    api_key = request.headers.get("api-key")
+    payload = request.get_json(silent=True) or {}
+    tweets = payload.get("tweets")
+    valid = (
+        isinstance(tweets, list)
+        and len(tweets) <= BULK_MAX_TWEETS
+        and all(
+            isinstance(tweet, dict)
+            and isinstance(tweet.get("tweet_data"), str)
+            and isinstance(tweet.get("tweet_media_ids", []), list)
+            and all(isinstance(m, int) for m in tweet.get("tweet_media_ids", []))
+            for tweet in tweets
+        )
+    )
+    if not valid:
+        return jsonify({"result": False, "error": "Некорректный список твитов"}), 400
+
+    tweet_ids = post_tweets_bulk(api_key, tweets)
+    if tweet_ids is False:
+        return jsonify({"error": "Пользователь с таким api-key не найден"}), 404
+    return jsonify({"result": True, "tweet_ids": tweet_ids}), 201
+
+
+def conditional(etag_for):
+    """
+    Условный GET по версиям изменений из БД. etag_for получает аргументы
+    маршрута и возвращает ETag (или None — ответ не кэшируется); он
+    вызывается до обработчика, поэтому при совпадении If-None-Match
+    ответ 304 отдаётся без запросов ленты или профиля. Ответ без
+    списков лайкнувших (likes_degraded) и потоковый ответ, про который
+    это заранее неизвестно, ETag не получают
+    """
+
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            etag = etag_for(*args, **kwargs)
+            if etag is not None and request.if_none_match.contains(etag):
+                response = app.response_class(status=304)
+            else:
+                g.pop("likes_degraded", None)
+                response = app.make_response(view(*args, **kwargs))
+                if (
+                    response.status_code != 200
+                    or response.is_streamed
+                    or likes_degraded()
+                ):
+                    return response
+            if etag is not None:
+                response.set_etag(etag)
+                response.headers["Cache-Control"] = "private, no-cache"
+            return response
+
+        return wrapper
+
+    return decorator
+
+
+def timeline_etag() -> Optional[str]:
+    """ETag ленты: пользователь, версия ленты и параметры страницы"""
+    user = get_users_params(request.headers.get("api-key", ""))
+    if user is None:
+        return None
+    query = hashlib.md5(request.query_string).hexdigest()[:8]
+    return f"tl-{user['id']}-{timeline_version(user['id'])}-{query}"
+
+
+def profile_etag(id=None) -> Optional[str]:
+    """ETag профиля по id (или текущего пользователя) и его версии"""
+    if id is None:
+        user = get_users_params(request.headers.get("api-key", ""))
+        if user is None:
+            return None
+        prefix, user_id = "me", user["id"]
+    else:
+        try:
+            prefix, user_id = "u", int(id)
+        except ValueError:
+            return None
+    version = profile_version(user_id)
+    if version is None:
+        return None
+    return f"{prefix}-{user_id}-{version}"
+
+
 @app.route("/api/tweets", methods=["GET"])
+@conditional(timeline_etag)
 def tweets_get():
     """
     Посмотреть все твиты
@@ -103,9 +337,39 @@ def tweets_get():
         type: string
         required: true
         description: API ключ текущего пользователя.
+      - in: query
+        name: limit
+        type: integer
+        required: false
+        description: Размер страницы (до 100). Без limit и cursor возвращается вся лента
+      - in: query
+        name: cursor
+        type: string
+        required: false
+        description: Курсор следующей страницы из поля next_cursor предыдущего ответа
+      - in: query
+        name: stream
+        type: integer
+        enum: [0, 1]
+        required: false
+        description: >
+          1 — вся лента отдаётся потоком по мере чтения из БД (память сервера
+          не растёт с размером ленты); likes_degraded в этом случае идёт после tweets.
+          По умолчанию — настройка TIMELINE_STREAM
+      - in: header
+        name: If-None-Match
+        type: string
+        required: false
+        description: ETag предыдущего ответа
     responses:
       200:
-        description: Все твиты для пользователя
+        description: >
+          Все твиты для пользователя (или страница и next_cursor).
+          likes_degraded = true, если списки лайкнувших не успели загрузиться
+      304:
+        description: Лента не изменилась с ответа с этим ETag
+      400:
+        description: Некорректные limit или cursor
       500:
         description: result = False
         schema:
@@ -115,14 +379,68 @@ def tweets_get():
               type: boolean
     """
     api_key = request.headers.get("api-key")
+    limit = request.args.get("limit")
+    cursor = request.args.get("cursor")
+    # offset присылает встроенный SPA; такие запросы обслуживаются как раньше
+    if (limit is not None or cursor is not None) and "offset" not in request.args:
+        return tweets_page(api_key, limit, cursor)
+    stream = request.args.get("stream", "1" if app.config["TIMELINE_STREAM"] else "0")
+    if stream == "1":
+        return tweets_stream(api_key)
+
     all_tweets = get_tweets(api_key)
     if all_tweets:
         result = {"result": True, "tweets": all_tweets}
+        if likes_degraded():
+            result["likes_degraded"] = True
         return result, 200
     else:
         return jsonify({"error": "Пользователь с таким api-key не найден"}), 404
 
 
+def tweets_page(api_key: str, limit: str, cursor: str):
+    """Страница ленты для GET /api/tweets с параметрами limit и cursor"""
+    try:
+        limit = TIMELINE_DEFAULT_LIMIT if limit is None else int(limit)
+        after = decode_cursor(cursor) if cursor else None
+    except ValueError:
+        return jsonify({"result": False, "error": "Некорректные limit или cursor"}), 400
+    if not 1 <= limit <= TIMELINE_MAX_LIMIT:
+        return jsonify({"result": False, "error": "Некорректные limit или cursor"}), 400
+
+    page = get_tweets_page(api_key, limit, after)
+    if page is False:
+        return jsonify({"error": "Пользователь с таким api-key не найден"}), 404
+    tweets, next_cursor = page
+    result = {"result": True, "tweets": tweets, "next_cursor": next_cursor}
+    if likes_degraded():
+        result["likes_degraded"] = True
+    return result, 200
+
+
+def tweets_stream(api_key: str):
+    """
+    Вся лента для GET /api/tweets?stream=1: JSON собирается по частям
+    из пачек stream_timeline и отправляется клиенту по мере готовности
+    """
+    user = get_users_params(api_key)
+    if user is None:
+        return jsonify({"error": "Пользователь с таким api-key не найден"}), 404
+
+    def generate():
+        yield '{"result": true, "tweets": ['
+        separator = ""
+        for batch in stream_timeline(user["id"]):
+            if batch:
+                yield separator + ",".join(app.json.dumps(tweet) for tweet in batch)
+                separator = ","
+        yield '], "likes_degraded": true}' if likes_degraded() else "]}"
+
+    return app.response_class(
+        stream_with_context(generate()), mimetype="application/json"
+    )
+
+
 @app.route("/api/medias", methods=["POST"])
 def medias():
     """
@@ -143,6 +461,10 @@ def medias():
         required: true
         description: Медиафайл для загрузки
     responses:
+      413:
+        description: Файл больше MAX_UPLOAD_SIZE
+      415:
+        description: Тип файла не поддерживается (разрешены JPEG, PNG, GIF, WebP)
       201:
         description: Медиафайл успешно загружен
         content:
@@ -161,11 +483,12 @@ def medias():
     file = request.files["file"]
 
     if file:
-        filename = file.filename
-        file_path = os.path.join(app.config["UPLOAD_FOLDER"], filename)
-        file.save(file_path)
-
-        media_id = media(file_path, api_key)
+        stored = store_upload(
+            file, app.config["UPLOAD_FOLDER"], app.config["UPLOAD_TEMP_FOLDER"]
+        )
+        media_id = media(
+            stored.file_path, api_key, stored.sha256, stored.size, stored.mime_type
+        )
         return jsonify({"result": True, "media_id": media_id}), 201
 
 
@@ -212,7 +535,7 @@ def delete_tweet(tweet_id):
 @app.route("/api/tweets/<id>/likes", methods=["POST", "DELETE"])
 def likes(id):
     """
-    Поставить лайк
+    Поставить лайк (POST) или снять его (DELETE)
     ---
     tags:
       - Likes
@@ -239,7 +562,70 @@ def likes(id):
               type: boolean
     """
     api_key = request.headers.get("api-key")
-    result = check_likes(api_key, id)
+    result = check_likes(api_key, id, like=request.method == "POST")
+    return result, 200
+
+
+# Сколько операций можно передать в одном пакете лайков
+LIKES_BATCH_MAX = 1000
+
+
+@app.route("/api/likes/batch", methods=["POST"])
+def likes_batch():
+    """
+    Поставить и снять несколько лайков в одной транзакции
+    ---
+    tags:
+      - Likes
+    parameters:
+      - in: header
+        name: api-key
+        default: test
+        type: string
+        required: true
+        description: API ключ текущего пользователя.
+      - in: body
+        name: body
+        required: true
+        schema:
+          type: object
+          properties:
+            operations:
+              type: array
+              description: Операции по порядку; для твита действует последняя
+              items:
+                type: object
+                properties:
+                  tweet_id:
+                    type: integer
+                  action:
+                    type: string
+                    enum: [like, unlike]
+    responses:
+      200:
+        description: result = true, changed — id твитов, где лайк поставлен или снят
+      400:
+        description: Некорректный список операций
+      404:
+        description: Пользователь с таким api-key не найден
+    """
+    api_key = request.headers.get("api-key")
+    payload = request.get_json(silent=True) or {}
+    operations = payload.get("operations")
+    try:
+        if not isinstance(operations, list) or len(operations) > LIKES_BATCH_MAX:
+            raise ValueError
+        parsed = []
+        for operation in operations:
+            if operation["action"] not in ("like", "unlike"):
+                raise ValueError
+            parsed.append((int(operation["tweet_id"]), operation["action"] == "like"))
+    except (KeyError, TypeError, ValueError):
+        return jsonify({"result": False, "error": "Некорректный список операций"}), 400
+
+    result = batch_likes(api_key, parsed)
+    if result is False:
+        return jsonify({"error": "Пользователь с таким api-key не найден"}), 404
     return result, 200
 
 
@@ -284,6 +670,7 @@ def follow(id):
 
 
 @app.route("/api/users/me", methods=["GET"])
+@conditional(profile_etag)
 def me():
     """
     Получить информацию о текущем пользователе
@@ -297,7 +684,14 @@ def me():
         default: test
         required: true
         description: API ключ текущего пользователя.
+      - in: header
+        name: If-None-Match
+        type: string
+        required: false
+        description: ETag предыдущего ответа
     responses:
+      304:
+        description: Профиль не изменился с ответа с этим ETag
       200:
         description: Информация о текущем пользователе
         content:
@@ -318,6 +712,22 @@ def me():
                                 name:
                                     type: string
                                     description: Имя пользователя
+                                followers_count:
+                                    type: integer
+                                    description: Число подписчиков
+                                following_count:
+                                    type: integer
+                                    description: Число подписок
+                                followers:
+                                    type: array
+                                    description: >
+                                        Первые подписчики (id и имя), остальные —
+                                        GET /api/users/{id}/followers
+                                following:
+                                    type: array
+                                    description: >
+                                        Первые подписки (id и имя), остальные —
+                                        GET /api/users/{id}/following
     """
     api_key = request.headers.get("api-key")
     user = my_profile(api_key)
@@ -326,6 +736,7 @@ def me():
 
 
 @app.route("/api/users/<id>", methods=["GET"])
+@conditional(profile_etag)
 def get_user(id):
     """
     Получить информацию о пользователе по ID
@@ -339,7 +750,14 @@ def get_user(id):
         default: 1
         required: true
         description: ID пользователя
+      - in: header
+        name: If-None-Match
+        type: string
+        required: false
+        description: ETag предыдущего ответа
     responses:
+      304:
+        description: Профиль не изменился с ответа с этим ETag
       200:
         description: Информация о пользователе
         content:
@@ -360,6 +778,22 @@ def get_user(id):
                                 name:
                                     type: string
                                     description: Имя пользователя
+                                followers_count:
+                                    type: integer
+                                    description: Число подписчиков
+                                following_count:
+                                    type: integer
+                                    description: Число подписок
+                                followers:
+                                    type: array
+                                    description: >
+                                        Первые подписчики (id и имя), остальные —
+                                        GET /api/users/{id}/followers
+                                following:
+                                    type: array
+                                    description: >
+                                        Первые подписки (id и имя), остальные —
+                                        GET /api/users/{id}/following
       404:
         description: Нет такого пользователя
 
@@ -371,5 +805,296 @@ def get_user(id):
     return jsonify({"result": False, "message": "User not found"}), 404
 
 
+def follow_page(user_id: int, relation: str):
+    """Страница подписчиков или подписок с параметрами limit и cursor"""
+    limit, cursor = request.args.get("limit"), request.args.get("cursor")
+    try:
+        limit = FOLLOW_PAGE_DEFAULT_LIMIT if limit is None else int(limit)
+        after = int(cursor) if cursor else None
+    except ValueError:
+        return jsonify({"result": False, "error": "Некорректные limit или cursor"}), 400
+    if not 1 <= limit <= FOLLOW_PAGE_MAX_LIMIT:
+        return jsonify({"result": False, "error": "Некорректные limit или cursor"}), 400
+
+    page = get_follow_page(user_id, relation, limit, after)
+    if page is None:
+        return jsonify({"result": False, "message": "User not found"}), 404
+    users, next_cursor = page
+    return jsonify({"result": True, relation: users, "next_cursor": next_cursor}), 200
+
+
+@app.route("/api/users/<int:user_id>/followers", methods=["GET"])
+def user_followers(user_id):
+    """
+    Подписчики пользователя постранично
+    ---
+    tags:
+      - Users
+    parameters:
+      - in: path
+        name: user_id
+        type: integer
+        default: 1
+        required: true
+        description: ID пользователя
+      - in: query
+        name: limit
+        type: integer
+        required: false
+        description: Размер страницы (по умолчанию 50, не больше 500)
+      - in: query
+        name: cursor
+        type: string
+        required: false
+        description: Курсор следующей страницы из поля next_cursor предыдущего ответа
+    responses:
+      200:
+        description: Подписчики (id и имя) в порядке id и next_cursor (null на последней странице)
+      400:
+        description: Некорректные limit или cursor
+      404:
+        description: Нет такого пользователя
+    """
+    return follow_page(user_id, "followers")
+
+
+@app.route("/api/users/<int:user_id>/following", methods=["GET"])
+def user_following(user_id):
+    """
+    Подписки пользователя постранично
+    ---
+    tags:
+      - Users
+    parameters:
+      - in: path
+        name: user_id
+        type: integer
+        default: 1
+        required: true
+        description: ID пользователя
+      - in: query
+        name: limit
+        type: integer
+        required: false
+        description: Размер страницы (по умолчанию 50, не больше 500)
+      - in: query
+        name: cursor
+        type: string
+        required: false
+        description: Курсор следующей страницы из поля next_cursor предыдущего ответа
+    responses:
+      200:
+        description: Подписки (id и имя) в порядке id и next_cursor (null на последней странице)
+      400:
+        description: Некорректные limit или cursor
+      404:
+        description: Нет такого пользователя
+    """
+    return follow_page(user_id, "following")
+
+
+@app.route("/api/stats/pool", methods=["GET"])
+def stats_pool():
+    """
+    Статистика пула соединений с БД
+    ---
+    tags:
+      - Monitoring
+    responses:
+      200:
+        description: Размер пула, число занятых и свободных соединений, ожиданий и таймаутов
+        schema:
+          type: object
+          properties:
+            result:
+              type: boolean
+            pool:
+              type: object
+    """
+    return jsonify({"result": True, "pool": pool_stats()}), 200
+
+
+@app.route("/api/stats/auth-cache", methods=["GET"])
+def stats_auth_cache():
+    """
+    Статистика кэша api-key → пользователь
+    ---
+    tags:
+      - Monitoring
+    responses:
+      200:
+        description: Попадания, промахи, вытеснения и текущий размер кэша
+        schema:
+          type: object
+          properties:
+            result:
+              type: boolean
+            auth_cache:
+              type: object
+    """
+    return jsonify({"result": True, "auth_cache": auth_cache_stats()}), 200
+
+
+@app.route("/metrics", methods=["GET"])
+def prometheus_metrics():
+    """
+    Метрики для Prometheus
+    ---
+    tags:
+      - Monitoring
+    produces:
+      - text/plain
+    responses:
+      200:
+        description: >
+          Гистограммы длительности по маршрутам и по SQL-запросам
+          (query_id — отпечаток запроса, текст в db_query_info),
+          ожидание соединения из пула, статистика пула, кэша авторизации,
+          кэша профилей, графа подписок, подготовленных запросов,
+          буфера отложенных лайков и очереди фоновых задач
+    """
+    body = tracing.render_metrics(
+        {
+            "db_pool": pool_stats(),
+            "auth_cache": auth_cache_stats(),
+            "profile_cache": profile_cache_stats(),
+            "follow_graph": follow_graph_stats(),
+            "prepared_statements": prepared_stats(),
+            "like_buffer": like_buffer_stats(),
+            "jobs": job_stats(),
+        }
+    )
+    return body, 200, {"Content-Type": "text/plain; version=0.0.4; charset=utf-8"}
+
+
+def admin_required(view):
+    """
+    Доступ только с заголовком X-Admin-Token, равным ADMIN_TOKEN.
+    Без ADMIN_TOKEN служебные маршруты отключены
+    """
+
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        expected = app.config["ADMIN_TOKEN"]
+        token = request.headers.get("X-Admin-Token", "")
+        if not expected or not hmac.compare_digest(token, expected):
+            return jsonify({"result": False, "error": "Доступ запрещён"}), 403
+        return view(*args, **kwargs)
+
+    return wrapper
+
+
+@app.route("/api/admin/slow-queries", methods=["GET"])
+@admin_required
+def admin_slow_queries():
+    """
+    Журнал медленных SQL-запросов с планами выполнения
+    ---
+    tags:
+      - Monitoring
+    parameters:
+      - in: header
+        name: X-Admin-Token
+        type: string
+        required: true
+        description: Значение переменной окружения ADMIN_TOKEN
+      - in: query
+        name: limit
+        type: integer
+        required: false
+        description: Сколько последних записей вернуть (по умолчанию 50)
+      - in: query
+        name: query_id
+        type: string
+        required: false
+        description: Только записи запроса с этим отпечатком (query_id из /metrics)
+    responses:
+      200:
+        description: Записи (новые первыми) и статистика журнала
+      403:
+        description: Нет или неверный X-Admin-Token
+    """
+    limit = request.args.get("limit", 50, type=int)
+    entries = slow_log.entries(limit, request.args.get("query_id"))
+    return jsonify({"result": True, "slow_queries": entries, "stats": slow_log.stats()}), 200
+
+
+@app.route("/api/admin/profiles", methods=["GET"])
+@admin_required
+def admin_profiles():
+    """
+    Список сохранённых профилей запросов
+    ---
+    tags:
+      - Monitoring
+    parameters:
+      - in: header
+        name: X-Admin-Token
+        type: string
+        required: true
+        description: Значение переменной окружения ADMIN_TOKEN
+      - in: query
+        name: route
+        type: string
+        required: false
+        description: Только профили этого маршрута (например, /api/tweets)
+    responses:
+      200:
+        description: >
+          Профили (новые первыми): id, маршрут, метод, путь, X-Request-Id,
+          статус и длительность запроса
+      403:
+        description: Нет или неверный X-Admin-Token
+    """
+    profiles = list_profiles(app.config["PROFILE_DIR"], request.args.get("route"))
+    return jsonify({"result": True, "profiles": profiles}), 200
+
+
+@app.route("/api/admin/profiles/<profile_id>", methods=["GET"])
+@admin_required
+def admin_profile(profile_id):
+    """
+    Скачать профиль запроса
+    ---
+    tags:
+      - Monitoring
+    parameters:
+      - in: header
+        name: X-Admin-Token
+        type: string
+        required: true
+        description: Значение переменной окружения ADMIN_TOKEN
+      - in: path
+        name: profile_id
+        type: string
+        required: true
+        description: id профиля из заголовка X-Profile-Id или из списка профилей
+      - in: query
+        name: format
+        type: string
+        enum: [prof, text]
+        required: false
+        description: prof — файл pstats (по умолчанию), text — сводка по cumulative
+    responses:
+      200:
+        description: Файл профиля или текстовая сводка
+      403:
+        description: Нет или неверный X-Admin-Token
+      404:
+        description: Профиль не найден
+    """
+    path = profile_path(app.config["PROFILE_DIR"], profile_id)
+    if path is None:
+        return jsonify({"result": False, "error": "Профиль не найден"}), 404
+    if request.args.get("format") == "text":
+        return profile_text(path), 200, {"Content-Type": "text/plain; charset=utf-8"}
+    return send_file(
+        os.path.abspath(path),
+        mimetype="application/octet-stream",
+        as_attachment=True,
+        download_name=f"{profile_id}.prof",
+    )
+
+
 # if __name__ == "__main__":
 #     app.run(host="0.0.0.0", debug=True, port=8080)
@@ -0,0 +1,363 @@
+"""
+Нагрузочные замеры функций database.py на данных разного размера.
+
+Для каждого масштаба создаётся отдельная БД, к ней применяются миграции
+и загружаются синтетические данные (seed.py). Затем каждая функция
+вызывается --iterations раз для случайных пользователей. Считаются
+перцентили задержки, число обращений к БД и строк, полученных из БД,
+на один вызов. С --statements adhoc,prepared каждая функция замеряется
+с подготовленными запросами и без них, и печатается выигрыш от отказа
+от разбора и планирования. Результат пишется в JSON; с --baseline результаты
+сравниваются с прошлым прогоном, и при замедлении больше --threshold
+команда завершается с кодом 1.
+
+Запускается из каталога flask_app, отдельно от pytest:
+
+    python -m benchmarks.run --scales 1000,10000 --output bench.json
+    python -m benchmarks.run --baseline bench.json --threshold 0.2
+    python -m benchmarks.run --statements adhoc,prepared
+"""
+import argparse
+import datetime
+import functools
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+import database
+import psycopg2
+import psycopg2.extensions
+from migrate import upgrade
+from seed import SeedConfig, api_key, id_base, load
+from statements import registry
+
+DB_HOST = os.environ.get("BENCH_DB_HOST", "postgres")
+DB_NAME = os.environ.get("BENCH_DB_NAME", "bench_postgres")
+
+# Метрики, по которым ищутся регрессии (больше — хуже)
+REGRESSION_METRICS = ("p95_ms", "round_trips", "rows")
+
+
+class QueryCounter:
+    """Число обращений к БД и полученных строк (общее для всех потоков)"""
+
+    def __init__(self):
+        self.round_trips = 0
+        self.rows = 0
+        self._lock = threading.Lock()
+
+    def add(self, rows: int) -> None:
+        with self._lock:
+            self.round_trips += 1
+            self.rows += max(rows, 0)
+
+    def reset(self) -> None:
+        with self._lock:
+            self.round_trips = self.rows = 0
+
+
+counter = QueryCounter()
+
+
+class CountingCursor(psycopg2.extensions.cursor):
+    def execute(self, query, vars=None):
+        try:
+            return super().execute(query, vars)
+        finally:
+            counter.add(self.rowcount if self.description is not None else 0)
+
+    def execute_untraced(self, query):
+        # PREPARE и DEALLOCATE реестра подготовленных запросов — тоже обращения к БД
+        return self.execute(query)
+
+    def executemany(self, query, vars_list):
+        try:
+            return super().executemany(query, vars_list)
+        finally:
+            counter.add(0)
+
+    def copy_expert(self, sql, file, size=8192):
+        try:
+            return super().copy_expert(sql, file, size)
+        finally:
+            counter.add(0)
+
+
+def connect(dbname: str = DB_NAME, **kwargs):
+    return psycopg2.connect(
+        dbname=dbname,
+        user="postgres",
+        password="postgres",
+        host=DB_HOST,
+        port="5432",
+        **kwargs,
+    )
+
+
+def recreate_database() -> None:
+    conn = connect("postgres")
+    conn.autocommit = True
+    with conn.cursor() as cursor:
+        cursor.execute(f"DROP DATABASE IF EXISTS {DB_NAME}")
+        cursor.execute(f"CREATE DATABASE {DB_NAME}")
+    conn.close()
+
+
+def prepare(scale: int, seed: int) -> Dict[str, int]:
+    """Новая БД с миграциями и синтетическими данными на scale пользователей"""
+    database.close_pool()
+    recreate_database()
+    conn = connect()
+    try:
+        upgrade(conn)
+        loaded = load(conn, SeedConfig(users=scale, seed=seed))
+        with conn.cursor() as cursor:
+            cursor.execute("ANALYZE")
+        conn.commit()
+    finally:
+        conn.close()
+    database.set_database(functools.partial(connect, cursor_factory=CountingCursor))
+    database.reconcile_like_counts()
+    database.reconcile_follow_counts()
+    return loaded
+
+
+class Scenario:
+    """Вызов функции database.py для случайного пользователя или твита"""
+
+    def __init__(self, rng: random.Random, seed: int, users: int, tweets: int):
+        self.rng = rng
+        self.seed = seed
+        self.users = users
+        self.tweets = tweets
+
+    def user(self) -> int:
+        return self.rng.randint(1, self.users)
+
+    def key(self) -> str:
+        return api_key(self.seed, self.user())
+
+    def tweet(self) -> int:
+        return self.rng.randint(1, self.tweets)
+
+    def get_tweets(self) -> Callable:
+        key = self.key()
+        return lambda: database.get_tweets(key)
+
+    def my_profile(self) -> Callable:
+        key = self.key()
+        return lambda: database.my_profile(key)
+
+    def any_profile(self) -> Callable:
+        user_id = self.user()
+        return lambda: database.any_profile(user_id)
+
+    def check_likes(self) -> Callable:
+        key, tweet_id, like = self.key(), self.tweet(), self.rng.random() < 0.5
+        return lambda: database.check_likes(key, tweet_id, like)
+
+    def check_followers(self) -> Callable:
+        key, user_id = self.key(), self.user()
+        method = "POST" if self.rng.random() < 0.5 else "DELETE"
+        return lambda: database.check_followers(user_id, key, method)
+
+
+FUNCTIONS = ("get_tweets", "my_profile", "any_profile", "check_likes", "check_followers")
+
+
+def percentile(values: List[float], q: float) -> float:
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(q * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def measure(scenario: Scenario, name: str, iterations: int, warmup: int) -> Dict:
+    for _ in range(warmup):
+        getattr(scenario, name)()()
+    latencies = []
+    counter.reset()
+    for _ in range(iterations):
+        call = getattr(scenario, name)()
+        started = time.perf_counter()
+        call()
+        latencies.append((time.perf_counter() - started) * 1000)
+    return {
+        "function": name,
+        "calls": iterations,
+        "mean_ms": round(statistics.fmean(latencies), 3),
+        "p50_ms": round(percentile(latencies, 0.50), 3),
+        "p95_ms": round(percentile(latencies, 0.95), 3),
+        "p99_ms": round(percentile(latencies, 0.99), 3),
+        "max_ms": round(max(latencies), 3),
+        "round_trips": round(counter.round_trips / iterations, 2),
+        "rows": round(counter.rows / iterations, 2),
+    }
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+STATEMENT_MODES = ("adhoc", "prepared")
+
+
+def run(
+    scales: List[int],
+    iterations: int,
+    warmup: int,
+    seed: int,
+    statements: List[str] = ("prepared",),
+) -> Dict:
+    results = []
+    enabled = registry.enabled
+    for scale in scales:
+        loaded = prepare(scale, seed)
+        with database.connection() as conn, conn.cursor() as cursor:
+            base = id_base(cursor)
+        print(f"Масштаб {scale}: {loaded}", file=sys.stderr)
+        for mode in statements:
+            registry.enabled = mode == "prepared"
+            # Кэши процесса не должны переходить из одного режима в другой
+            database.invalidate_user()
+            database.profile_cache.clear()
+            # Одинаковые вызовы в обоих режимах
+            scenario = Scenario(random.Random(seed), seed, base.user, base.tweet)
+            for name in FUNCTIONS:
+                result = measure(scenario, name, iterations, warmup)
+                result.update({"scale": scale, "statements": mode, "rows_loaded": loaded})
+                results.append(result)
+                print(
+                    f"  {name} [{mode}]: p50 {result['p50_ms']} мс, "
+                    f"p95 {result['p95_ms']} мс, "
+                    f"{result['round_trips']} запросов, {result['rows']} строк",
+                    file=sys.stderr,
+                )
+    registry.enabled = enabled
+    database.close_pool()
+    return {
+        "meta": {
+            "commit": git_commit(),
+            "created_at": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            "iterations": iterations,
+            "seed": seed,
+            "hydration": database.HYDRATION_MODE,
+        },
+        "results": results,
+        "prepared_savings": prepared_savings(results),
+    }
+
+
+def prepared_savings(results: List[Dict]) -> List[Dict]:
+    """
+    Выигрыш подготовленных запросов: разница средней и медианной задержки
+    между режимами adhoc и prepared для каждой пары (масштаб, функция).
+    Запросы EXECUTE не разбираются и не планируются заново, поэтому
+    разница — это в основном время разбора и планирования
+    """
+    by_mode = {(r["scale"], r["function"], r.get("statements")): r for r in results}
+    savings = []
+    for (scale, function, mode), adhoc in by_mode.items():
+        prepared = by_mode.get((scale, function, "prepared"))
+        if mode != "adhoc" or prepared is None:
+            continue
+        savings.append(
+            {
+                "scale": scale,
+                "function": function,
+                "mean_ms": round(adhoc["mean_ms"] - prepared["mean_ms"], 3),
+                "p50_ms": round(adhoc["p50_ms"] - prepared["p50_ms"], 3),
+            }
+        )
+    return savings
+
+
+def compare(current: Dict, baseline: Dict, threshold: float) -> List[str]:
+    """
+    Регрессии относительно прошлого прогона: метрика выросла больше чем
+    в (1 + threshold) раз. Сравниваются только пары (масштаб, функция),
+    которые есть в обоих прогонах (и в одном режиме выполнения запросов)
+    """
+
+    def key(r: Dict):
+        return r["scale"], r["function"], r.get("statements", "prepared")
+
+    previous = {key(r): r for r in baseline["results"]}
+    regressions = []
+    for result in current["results"]:
+        old = previous.get(key(result))
+        if old is None:
+            continue
+        mode = " [adhoc]" if result.get("statements") == "adhoc" else ""
+        for metric in REGRESSION_METRICS:
+            if result[metric] > old[metric] * (1 + threshold) and result[metric] > 0:
+                regressions.append(
+                    f"{result['function']}{mode} @ {result['scale']}: {metric} "
+                    f"{old[metric]} -> {result[metric]}"
+                )
+    return regressions
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Замеры функций database.py")
+    parser.add_argument(
+        "--scales", default="1000,10000", help="числа пользователей через запятую"
+    )
+    parser.add_argument("--iterations", type=int, default=200)
+    parser.add_argument("--warmup", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument(
+        "--statements",
+        default="prepared",
+        help="режимы выполнения запросов через запятую: adhoc, prepared",
+    )
+    parser.add_argument("--output", help="куда записать JSON (по умолчанию stdout)")
+    parser.add_argument("--baseline", help="JSON прошлого прогона для сравнения")
+    parser.add_argument(
+        "--threshold", type=float, default=0.2, help="допустимый рост метрик (0.2 = 20%%)"
+    )
+    args = parser.parse_args(argv)
+
+    scales = [int(scale) for scale in args.scales.split(",")]
+    statements = args.statements.split(",")
+    if not set(statements) <= set(STATEMENT_MODES):
+        parser.error(f"--statements: допустимы {', '.join(STATEMENT_MODES)}")
+    report = run(scales, args.iterations, args.warmup, args.seed, statements)
+    for saving in report["prepared_savings"]:
+        print(
+            f"Подготовленные запросы, {saving['function']} @ {saving['scale']}: "
+            f"быстрее на {saving['mean_ms']} мс в среднем, {saving['p50_ms']} мс по p50",
+            file=sys.stderr,
+        )
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(report, json.load(f), args.threshold)
+        for regression in regressions:
+            print(f"Регрессия: {regression}", file=sys.stderr)
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,82 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Tuple
+
+# Значение, сохранённое в кэше для «ключ не найден» (отрицательное кэширование)
+MISSING = object()
+
+
+class TTLCache:
+    """
+    Потокобезопасный кэш в памяти процесса с ограниченным размером:
+    записи живут ttl секунд (отрицательные — negative_ttl),
+    при переполнении вытесняется давно не использовавшаяся запись (LRU).
+    """
+
+    def __init__(self, maxsize: int = 10000, ttl: float = 60, negative_ttl: float = 5):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self._data: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {
+            "hits": 0,
+            "negative_hits": 0,
+            "misses": 0,
+            "evictions": 0,
+            "expirations": 0,
+            "invalidations": 0,
+        }
+
+    def get(self, key: Hashable) -> Tuple[bool, Any]:
+        """
+        Возвращает (найдено, значение). Для отрицательной записи
+        значение — MISSING
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and entry[0] <= now:
+                del self._data[key]
+                self._stats["expirations"] += 1
+                entry = None
+            if entry is None:
+                self._stats["misses"] += 1
+                return False, None
+            self._data.move_to_end(key)
+            if entry[1] is MISSING:
+                self._stats["negative_hits"] += 1
+            else:
+                self._stats["hits"] += 1
+            return True, entry[1]
+
+    def set(self, key: Hashable, value: Any) -> None:
+        """Сохраняет значение; MISSING сохраняется на negative_ttl"""
+        ttl = self.negative_ttl if value is MISSING else self.ttl
+        if ttl <= 0 or self.maxsize <= 0:
+            return
+        with self._lock:
+            self._data[key] = (time.monotonic() + ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self._stats["evictions"] += 1
+
+    def invalidate(self, key: Hashable) -> None:
+        with self._lock:
+            if self._data.pop(key, None) is not None:
+                self._stats["invalidations"] += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._stats["invalidations"] += len(self._data)
+            self._data.clear()
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            result = dict(self._stats)
+            result.update(
+                {"size": len(self._data), "maxsize": self.maxsize, "ttl": self.ttl}
+            )
+        return result
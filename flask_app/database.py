@@ -1,9 +1,101 @@
+import atexit
+import base64
+import json
+import os
+import time
 from collections import defaultdict
-from typing import DefaultDict, Dict, List, Tuple, Union
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeout
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import (
+    Callable,
+    DefaultDict,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Set,
+    Tuple,
+    Union,
+)
 
 import psycopg2
+import psycopg2.errors
+from psycopg2.extras import execute_values
+from cache import MISSING, TTLCache
+from flask import g, has_app_context
+from follow_graph import FollowGraph, FollowGraphIndex, load_edges
+from like_buffer import LikeBuffer
+from pool import ConnectionPool, PoolTimeout
+from slow_queries import slow_log
+from statements import execute_prepared
+from timeline_cache import TimelineStore, create_store
+from tracing import RequestTrace, current_trace, record_acquire, traced
+
+POOL_MINCONN = int(os.environ.get("DB_POOL_MINCONN", 1))
+POOL_MAXCONN = int(os.environ.get("DB_POOL_MAXCONN", 10))
+POOL_TIMEOUT = float(os.environ.get("DB_POOL_TIMEOUT", 5))
+POOL_CHECK_INTERVAL = float(os.environ.get("DB_POOL_CHECK_INTERVAL", 30))
+
+AUTH_CACHE_SIZE = int(os.environ.get("AUTH_CACHE_SIZE", 10000))
+AUTH_CACHE_TTL = float(os.environ.get("AUTH_CACHE_TTL", 60))
+AUTH_CACHE_NEGATIVE_TTL = float(os.environ.get("AUTH_CACHE_NEGATIVE_TTL", 5))
+
+# Кэш профилей (счётчики подписок и первые записи списков) по id пользователя
+PROFILE_CACHE_SIZE = int(os.environ.get("PROFILE_CACHE_SIZE", 10000))
+PROFILE_CACHE_TTL = float(os.environ.get("PROFILE_CACHE_TTL", 30))
+# Сколько подписчиков и подписок показывается в профиле, остальные — постранично
+PROFILE_PREVIEW_SIZE = int(os.environ.get("PROFILE_PREVIEW_SIZE", 20))
+
+# Граф подписок в памяти процесса (follow_graph.py): FOLLOW_GRAPH=1 включает,
+# FOLLOW_GRAPH_REFRESH — раз во сколько секунд он перечитывается из БД
+FOLLOW_GRAPH = os.environ.get("FOLLOW_GRAPH", "0") == "1"
+FOLLOW_GRAPH_REFRESH = float(os.environ.get("FOLLOW_GRAPH_REFRESH", 300))
+
+# Отложенная запись лайков (like_buffer.py): LIKE_BUFFER=1 включает,
+# пачка пишется через LIKE_BUFFER_INTERVAL_MS после первого лайка
+# или сразу, когда набралось LIKE_BUFFER_MAX_OPS пар (пользователь, твит)
+LIKE_BUFFER = os.environ.get("LIKE_BUFFER", "0") == "1"
+LIKE_BUFFER_INTERVAL_MS = float(os.environ.get("LIKE_BUFFER_INTERVAL_MS", 5))
+LIKE_BUFFER_MAX_OPS = int(os.environ.get("LIKE_BUFFER_MAX_OPS", 500))
+
+# Сколько раз фоновая задача (jobs.py) запускается, прежде чем стать failed
+JOB_MAX_ATTEMPTS = int(os.environ.get("JOB_MAX_ATTEMPTS", 5))
+
+# Авторы с большим числом подписчиков: их твиты не раскладываются по лентам
+FANOUT_MAX_FOLLOWERS = int(os.environ.get("FANOUT_MAX_FOLLOWERS", 10000))
+
+# Сколько строк в одном многострочном INSERT при массовой загрузке твитов
+BULK_BATCH_SIZE = int(os.environ.get("BULK_BATCH_SIZE", 1000))
+
+# Сборка ленты: "sql" — одним запросом, "parallel" — страница твитов,
+# затем вложения, авторы и лайки параллельно отдельными соединениями пула
+HYDRATION_MODE = os.environ.get("TIMELINE_HYDRATION", "sql")
+HYDRATION_WORKERS = int(os.environ.get("HYDRATION_WORKERS", 6))
+# Таймауты в секундах: без вложений и авторов ленты нет, без лайков — можно
+HYDRATION_TIMEOUT = float(os.environ.get("HYDRATION_TIMEOUT", 2))
+HYDRATION_LIKES_TIMEOUT = float(os.environ.get("HYDRATION_LIKES_TIMEOUT", 0.5))
+
+# Потоковая выдача ленты: сколько твитов читается из курсора за раз
+TIMELINE_STREAM_BATCH = int(os.environ.get("TIMELINE_STREAM_BATCH", 500))
 
 current_connection_function = None
+_pool: Optional[ConnectionPool] = None
+auth_cache = TTLCache(AUTH_CACHE_SIZE, AUTH_CACHE_TTL, AUTH_CACHE_NEGATIVE_TTL)
+profile_cache = TTLCache(PROFILE_CACHE_SIZE, PROFILE_CACHE_TTL, AUTH_CACHE_NEGATIVE_TTL)
+_timeline_store: Optional[TimelineStore] = create_store(os.environ.get("TIMELINE_STORE"))
+_hydration_executor: Optional[ThreadPoolExecutor] = None
+_follow_graph: Optional[FollowGraphIndex] = None
+_like_buffer: Optional[LikeBuffer] = None
+# Временные сбои: statement_timeout, пул без свободных соединений, таймаут догрузки.
+# Функции ленты их не глушат, маршрут отвечает 503
+UNAVAILABLE_ERRORS = (psycopg2.errors.QueryCanceled, PoolTimeout, FutureTimeout)
+# statement_timeout (мс) для соединений, которые берутся вне контекста Flask
+_statement_timeout: ContextVar[Optional[int]] = ContextVar(
+    "statement_timeout", default=None
+)
 
 
 def main_connection():
@@ -40,18 +132,192 @@ current_connection_function = main_connection
 def set_database(conn_func):
     """Декоратор меняет переменную,
     которая отвечает за подключение к БД
-    (тестовой или основной)"""
+    (тестовой или основной). Пул старой БД закрывается,
+    новый создаётся при первом обращении"""
     global current_connection_function
+    if _like_buffer is not None:
+        # Отложенные лайки дописываются в ту БД, где их поставили
+        _like_buffer.flush()
     current_connection_function = conn_func
+    close_pool()
+    invalidate_user()
+    if _follow_graph is not None:
+        enable_follow_graph()
+
+
+def get_pool() -> ConnectionPool:
+    """Пул соединений к текущей БД (создаётся лениво)"""
+    global _pool
+    if _pool is None:
+        _pool = ConnectionPool(
+            traced(current_connection_function),
+            minconn=POOL_MINCONN,
+            maxconn=POOL_MAXCONN,
+            timeout=POOL_TIMEOUT,
+            check_interval=POOL_CHECK_INTERVAL,
+        )
+    return _pool
+
+
+def close_pool() -> None:
+    """Закрывает пул соединений текущей БД"""
+    global _pool
+    if _pool is not None:
+        _pool.closeall()
+        _pool = None
+
+
+def load_follow_graph() -> FollowGraph:
+    """
+    Граф подписок из таблицы followers текущей БД. Читается на отдельном
+    соединении пула, а не на соединении HTTP-запроса
+    """
+    pool = get_pool()
+    conn = pool.getconn()
+    try:
+        return load_edges(conn)
+    finally:
+        pool.putconn(conn)
+
+
+def enable_follow_graph(enabled: bool = True) -> None:
+    """
+    Включает граф подписок в памяти процесса (загружается при первом
+    обращении) или выключает его — тогда подписки читаются запросами к БД
+    """
+    global _follow_graph
+    _follow_graph = (
+        FollowGraphIndex(load_follow_graph, FOLLOW_GRAPH_REFRESH) if enabled else None
+    )
+
+
+enable_follow_graph(FOLLOW_GRAPH)
+
+
+def follow_graph() -> Optional[FollowGraph]:
+    """Граф подписок процесса или None, если он выключен"""
+    return _follow_graph.get() if _follow_graph is not None else None
+
+
+def follow_graph_stats() -> Dict[str, float]:
+    """Размер графа подписок и число изменений после загрузки"""
+    if _follow_graph is None:
+        return {"loaded": 0}
+    return _follow_graph.stats()
+
+
+def enable_like_buffer(enabled: bool = True) -> None:
+    """
+    Включает отложенную запись лайков (check_likes только запоминает
+    намерение) или выключает её; накопленное перед этим дописывается
+    """
+    global _like_buffer
+    if _like_buffer is not None:
+        _like_buffer.close()
+    _like_buffer = (
+        LikeBuffer(write_likes, LIKE_BUFFER_INTERVAL_MS / 1000, LIKE_BUFFER_MAX_OPS)
+        if enabled
+        else None
+    )
+
+
+def close_like_buffer() -> None:
+    """Дописывает отложенные лайки при завершении процесса"""
+    if _like_buffer is not None:
+        _like_buffer.close()
+
+
+atexit.register(close_like_buffer)
+
+
+def flush_pending_likes(user_id: int) -> None:
+    """
+    Дописывает отложенные лайки пользователя перед его чтениями,
+    чтобы он сразу видел свои лайки
+    """
+    if _like_buffer is not None and _like_buffer.has_pending(user_id):
+        _like_buffer.flush(user_id)
+
+
+def like_buffer_stats() -> Dict[str, float]:
+    """Намерения в буфере, схлопнутые переключения и записанные пачки"""
+    if _like_buffer is None:
+        return {"enabled": 0}
+    result = _like_buffer.stats()
+    result["enabled"] = 1
+    return result
+
+
+def pool_stats() -> Dict[str, float]:
+    """Статистика пула соединений для мониторинга"""
+    return get_pool().stats()
+
+
+@contextmanager
+def connection():
+    """
+    Соединение с БД из пула.
+    Внутри контекста приложения Flask одно соединение берётся на весь запрос
+    и возвращается в пул в release_connection; вне его — на время блока with.
+    При ошибке незавершённая транзакция откатывается.
+    """
+    if has_app_context():
+        conn = g.get("db_conn")
+        if conn is None:
+            g.db_pool = get_pool()
+            started = time.perf_counter()
+            conn = g.db_conn = g.db_pool.getconn()
+            record_acquire(time.perf_counter() - started)
+        try:
+            yield conn
+        except Exception:
+            if not conn.closed:
+                conn.rollback()
+            raise
+        return
+
+    pool = get_pool()
+    started = time.perf_counter()
+    conn = pool.getconn()
+    record_acquire(time.perf_counter() - started)
+    try:
+        timeout = _statement_timeout.get()
+        if timeout is not None:
+            with conn.cursor() as cursor:
+                # SET LOCAL действует до конца транзакции, putconn её откатит
+                cursor.execute("SET LOCAL statement_timeout = %s", (timeout,))
+        yield conn
+    finally:
+        pool.putconn(conn)
+
+
+# Планы медленных запросов снимаются на отдельных соединениях из пула
+slow_log.connection_factory = connection
+
+
+def release_connection(exc: Optional[BaseException] = None) -> None:
+    """Возвращает соединение запроса в пул (вызывается при teardown)"""
+    conn = g.pop("db_conn", None)
+    pool = g.pop("db_pool", None)
+    if conn is not None:
+        pool.putconn(conn)
 
 
 def get_users_params(api_key: str):
-    """Функция для получения имени и ID юзера по его уникальному api_key"""
-    conn = current_connection_function()
-    with conn.cursor() as cursor:
+    """Функция для получения имени и ID юзера по его уникальному api_key.
+    Результат (в том числе «не найден») кэшируется в auth_cache"""
+    found, cached = auth_cache.get(api_key)
+    if found:
+        if cached is MISSING:
+            print(f"Нет юзера с таким api-key: {api_key}")
+            return None
+        return dict(cached)
+
+    with connection() as conn, conn.cursor() as cursor:
         try:
             user = {}
-            cursor.execute(
+            execute_prepared(
+                cursor,
                 """
             SELECT id, name
             FROM users
@@ -67,94 +333,212 @@ def get_users_params(api_key: str):
                     result[1],
                     api_key,
                 )
+                auth_cache.set(api_key, dict(user))
                 return user
             else:
+                auth_cache.set(api_key, MISSING)
                 print(f"Нет юзера с таким api-key: {api_key}")
                 return None
         except Exception as e:
+            conn.rollback()
             print(f"Ошибка: {e}")
             return None
 
 
-def post_tweets(api_key: str, tweet_data: str, tweet_media_ids: str) -> str:
+def invalidate_user(api_key: Optional[str] = None) -> None:
     """
-    Функция для публикации поста
+    Сбрасывает кэш пользователя по api_key (без аргумента — весь кэш).
+    Вызывать после изменения строки в таблице users
     """
-    conn = current_connection_function()
-    with conn.cursor() as cursor:
-        if tweet_media_ids:
-            media_ids_string = ",".join(map(str, tweet_media_ids))
-            cursor.execute(
-                """
-                INSERT INTO tweets
-                (tweet_data, tweet_media_ids, api_key)
-                VALUES (%s, %s, %s)
-                RETURNING tweet_id
-                """,
-                (tweet_data, media_ids_string, api_key),
+    if api_key is None:
+        auth_cache.clear()
+    else:
+        auth_cache.invalidate(api_key)
+
+
+def auth_cache_stats() -> Dict[str, float]:
+    """Статистика кэша api-key → пользователь для мониторинга"""
+    return auth_cache.stats()
+
+
+# Новая версия изменений пользователей (см. timeline_version, profile_version)
+BUMP_VERSIONS_QUERY = """
+    UPDATE users
+    SET change_version = nextval('change_version_seq')
+    WHERE id = ANY(%s)
+"""
+
+
+def bump_versions(cursor, user_ids: Iterable[int]) -> None:
+    """
+    Сдвигает версии изменений пользователей в текущей транзакции:
+    их лента и профиль и ленты их подписчиков перестают совпадать с ETag
+    """
+    user_ids = sorted({int(user_id) for user_id in user_ids if user_id is not None})
+    if user_ids:
+        cursor.execute(BUMP_VERSIONS_QUERY, (user_ids,))
+
+
+def timeline_version(user_id: int) -> int:
+    """
+    Версия ленты пользователя: наибольшая версия среди него самого и тех,
+    на кого он подписан. Меняется при новом или удалённом твите, лайке
+    на твит этих авторов и при подписке или отписке пользователя
+    """
+    flush_pending_likes(user_id)
+    graph = follow_graph()
+    with connection() as conn, conn.cursor() as cursor:
+        if graph is not None:
+            execute_prepared(
+                cursor,
+                "SELECT MAX(change_version) FROM users WHERE id = ANY(%s)",
+                ([user_id] + graph.following(user_id),),
             )
-            tweet_id = cursor.fetchone()[0]
         else:
-            cursor.execute(
+            execute_prepared(
+                cursor,
                 """
-                INSERT INTO tweets
-                (tweet_data, api_key)
-                VALUES (%s, %s)
-                RETURNING tweet_id
+                SELECT MAX(u.change_version)
+                FROM users u
+                WHERE u.id = %(user_id)s
+                   OR u.id IN (
+                       SELECT f.followed_id FROM followers f
+                       WHERE f.follower_id = %(user_id)s
+                   )
                 """,
-                (tweet_data, api_key),
+                {"user_id": user_id},
             )
-            tweet_id = cursor.fetchone()[0]
-        conn.commit()
-    return tweet_id
+        return cursor.fetchone()[0] or 0
 
 
-def get_tweets_data(
-    user_id: int,
-) -> Tuple[List[Dict[str, Union[str, List[str]]]], List[int]]:
+def profile_version(user_id: int) -> Optional[int]:
+    """Версия профиля пользователя или None, если его нет"""
+    with connection() as conn, conn.cursor() as cursor:
+        execute_prepared(
+            cursor, "SELECT change_version FROM users WHERE id = %s", (user_id,)
+        )
+        row = cursor.fetchone()
+    return row[0] if row else None
+
+
+def post_tweets(api_key: str, tweet_data: str, tweet_media_ids: List[int]) -> str:
     """
-    Получение основной информации о твитах для указанного пользователя
+    Функция для публикации поста.
+    Твит и его вложения записываются одним запросом; порядок вложений
+    сохраняется, чужие и несуществующие медиафайлы пропускаются
     """
-    with current_connection_function().cursor() as cursor:
-        query = """
-            WITH LikesCount AS (
-                SELECT tweet_id, COUNT(*) as num_likes
-                FROM likes
-                GROUP BY tweet_id
+    with connection() as conn, conn.cursor() as cursor:
+        cursor.execute(
+            """
+            WITH new_tweet AS (
+                INSERT INTO tweets (tweet_data, api_key, author_id)
+                VALUES (
+                    %(tweet_data)s,
+                    %(api_key)s,
+                    (SELECT id FROM users WHERE api_key = %(api_key)s)
+                )
+                RETURNING tweet_id, author_id
+            ), attachments AS (
+                INSERT INTO tweet_media (tweet_id, position, media_id)
+                SELECT nt.tweet_id, a.ord - 1, m.id
+                FROM new_tweet nt
+                CROSS JOIN unnest(%(media_ids)s::integer[]) WITH ORDINALITY a(media_id, ord)
+                JOIN media m ON m.id = a.media_id AND m.api_key = %(api_key)s
             )
-            SELECT t.tweet_id, t.tweet_data, t.tweet_media_ids, t.api_key
-            FROM tweets t
-            JOIN users u ON t.api_key = u.api_key
-            LEFT JOIN followers f ON u.id = f.followed_id
-            LEFT JOIN LikesCount lc ON t.tweet_id = lc.tweet_id
-            WHERE f.follower_id = %s OR u.id = %s
-            ORDER BY COALESCE(lc.num_likes, 0) DESC;
-        """
-        cursor.execute(query, (user_id, user_id))
-        all_tweets = [
+            SELECT tweet_id, author_id FROM new_tweet
+            """,
             {
-                "id": str(row[0]),
-                "content": row[1],
-                "attachments": row[2],
-                "api_key": row[3],
-            }
-            for row in cursor.fetchall()
-        ]
-        tweet_ids = [int(tweet["id"]) for tweet in all_tweets]
-    return all_tweets, tweet_ids
+                "tweet_data": tweet_data,
+                "api_key": api_key,
+                "media_ids": [int(media_id) for media_id in tweet_media_ids or []],
+            },
+        )
+        tweet_id, author_id = cursor.fetchone()
+        bump_versions(cursor, [author_id])
+        conn.commit()
+    fan_out_tweet(author_id, tweet_id)
+    return tweet_id
+
+
+def post_tweets_bulk(
+    api_key: str, tweets: List[Dict[str, Union[str, List[int]]]]
+) -> Union[List[int], bool]:
+    """
+    Массовая публикация твитов (импорт архива, перенос данных) в одной
+    транзакции. id выделяются заранее из последовательности, строки твитов
+    и вложений пишутся многострочными INSERT пачками по BULK_BATCH_SIZE.
+    Возвращает id твитов в порядке входного списка или False,
+    если пользователь не найден
+    """
+    user = get_users_params(api_key)
+    if user is None:
+        return False
+    if not tweets:
+        return []
+    with connection() as conn, conn.cursor() as cursor:
+        cursor.execute(
+            """
+            SELECT nextval(pg_get_serial_sequence('tweets', 'tweet_id'))
+            FROM generate_series(1, %s)
+            """,
+            (len(tweets),),
+        )
+        tweet_ids = [row[0] for row in cursor.fetchall()]
+
+        requested = {
+            int(media_id)
+            for tweet in tweets
+            for media_id in tweet.get("tweet_media_ids") or []
+        }
+        cursor.execute(
+            "SELECT id FROM media WHERE api_key = %s AND id = ANY(%s)",
+            (api_key, list(requested)),
+        )
+        owned = {row[0] for row in cursor.fetchall()}
+
+        attachments = []
+        for tweet_id, tweet in zip(tweet_ids, tweets):
+            media_ids = [int(m) for m in tweet.get("tweet_media_ids") or []]
+            position = 0
+            for media_id in media_ids:
+                if media_id in owned:
+                    attachments.append((tweet_id, position, media_id))
+                    position += 1
+
+        execute_values(
+            cursor,
+            "INSERT INTO tweets (tweet_id, tweet_data, api_key, author_id) VALUES %s",
+            [
+                (tweet_id, tweet["tweet_data"], api_key, user["id"])
+                for tweet_id, tweet in zip(tweet_ids, tweets)
+            ],
+            page_size=BULK_BATCH_SIZE,
+        )
+        execute_values(
+            cursor,
+            "INSERT INTO tweet_media (tweet_id, position, media_id) VALUES %s",
+            attachments,
+            page_size=BULK_BATCH_SIZE,
+        )
+        bump_versions(cursor, [user["id"]])
+        conn.commit()
+    fan_out_tweets(user["id"], tweet_ids)
+    return tweet_ids
 
 
 def get_media_data(tweet_ids: List[int]) -> DefaultDict[int, List[str]]:
     """
     Получение информации о file_path для каждой загруженной картинки у твита
     """
-    with current_connection_function().cursor() as cursor:
-        cursor.execute(
+    with connection() as conn, conn.cursor() as cursor:
+        execute_prepared(
+            cursor,
             """
-            SELECT t.tweet_id, m.file_path
-            FROM media m
-            JOIN tweets t ON m.id = t.tweet_media_ids
-            WHERE t.tweet_id = ANY(%s)
+            SELECT tm.tweet_id, m.file_path
+            FROM tweet_media tm
+            JOIN media m ON m.id = tm.media_id
+            WHERE tm.tweet_id = ANY(%s)
+            ORDER BY tm.tweet_id, tm.position
         """,
             (tweet_ids,),
         )
@@ -168,8 +552,9 @@ def get_likes_data(tweet_ids: List[int]) -> DefaultDict[int, List[Dict[str, str]
     """
     Получение основной информации о лайках на твитах
     """
-    with current_connection_function().cursor() as cursor:
-        cursor.execute(
+    with connection() as conn, conn.cursor() as cursor:
+        execute_prepared(
+            cursor,
             """
             SELECT l.tweet_id, l.user_id, u.name
             FROM likes l
@@ -188,12 +573,13 @@ def get_authors_data(tweet_ids: List[int]) -> Dict[int, Dict[str, Union[str, int
     """
     Получение основной информации об авторе твита
     """
-    with current_connection_function().cursor() as cursor:
-        cursor.execute(
+    with connection() as conn, conn.cursor() as cursor:
+        execute_prepared(
+            cursor,
             """
             SELECT t.tweet_id, u.name, u.id
             FROM users u
-            JOIN tweets t ON u.api_key = t.api_key
+            JOIN tweets t ON u.id = t.author_id
             WHERE t.tweet_id = ANY(%s)
         """,
             (tweet_ids,),
@@ -205,6 +591,411 @@ def get_authors_data(tweet_ids: List[int]) -> Dict[int, Dict[str, Union[str, int
     return author_map
 
 
+# Твиты пользователя и его подписок
+VISIBLE_BY_FOLLOWERS = """
+        SELECT t.tweet_id, t.like_count AS score
+        FROM tweets t
+        WHERE t.author_id = %(user_id)s
+           OR EXISTS (
+               SELECT 1 FROM followers f
+               WHERE f.follower_id = %(user_id)s AND f.followed_id = t.author_id
+           )
+"""
+
+# Твиты пользователя и его подписок, список авторов взят из графа подписок
+VISIBLE_BY_AUTHORS = """
+        SELECT t.tweet_id, t.like_count AS score
+        FROM tweets t
+        WHERE t.author_id = ANY(%(authors)s)
+"""
+
+# Твиты из подготовленной ленты и твиты «знаменитостей», на которых подписан пользователь
+VISIBLE_BY_IDS = """
+        SELECT t.tweet_id, t.like_count AS score
+        FROM tweets t
+        WHERE t.tweet_id = ANY(%(tweet_ids)s)
+        UNION
+        SELECT t.tweet_id, t.like_count AS score
+        FROM tweets t
+        JOIN followers f ON f.followed_id = t.author_id AND f.follower_id = %(user_id)s
+        WHERE t.author_id = ANY(%(celebrities)s)
+"""
+
+# Страница ленты читается индексом tweets_rank_idx (like_count DESC, tweet_id DESC)
+# от позиции курсора до LIMIT видимых твитов; строки не из ленты отбрасываются
+# фильтром, поэтому при редких подписках индекс читается дальше страницы
+TIMELINE_PAGE = """
+    WITH visible AS ({visible}), page AS (
+        SELECT tweet_id, score
+        FROM visible
+        WHERE %(after_score)s::integer IS NULL
+           OR (score, tweet_id) < (%(after_score)s, %(after_id)s)
+        ORDER BY score DESC, tweet_id DESC
+        LIMIT %(limit)s
+    )"""
+
+TIMELINE_TEMPLATE = TIMELINE_PAGE + """, attachments AS (
+        SELECT tm.tweet_id, json_agg(m.file_path ORDER BY tm.position) AS attachments
+        FROM tweet_media tm
+        JOIN media m ON m.id = tm.media_id
+        WHERE tm.tweet_id IN (SELECT tweet_id FROM page)
+        GROUP BY tm.tweet_id
+    )
+    SELECT json_build_object(
+        'id', t.tweet_id::text,
+        'content', t.tweet_data,
+        'api_key', t.api_key,
+        'attachments', COALESCE(tm.attachments, '[]'::json),
+        'author', json_build_object('name', u.name, 'id', u.id),
+        'likes', COALESCE(tl.likes, '[]'::json)
+    ), p.score, p.tweet_id
+    FROM page p
+    JOIN tweets t ON t.tweet_id = p.tweet_id
+    JOIN users u ON u.id = t.author_id
+    LEFT JOIN attachments tm ON tm.tweet_id = t.tweet_id
+    LEFT JOIN LATERAL (
+        SELECT json_agg(
+                   json_build_object('user_id', l.user_id::text, 'name', lu.name)
+               ) AS likes
+        FROM likes l
+        JOIN users lu ON lu.id = l.user_id
+        WHERE l.tweet_id = t.tweet_id
+    ) tl ON TRUE
+    ORDER BY p.score DESC, p.tweet_id DESC
+"""
+
+# Только сами твиты страницы: автор, вложения и лайки догружаются параллельно
+PAGE_ROWS_TEMPLATE = TIMELINE_PAGE + """
+    SELECT p.tweet_id, p.score, t.tweet_data, t.api_key
+    FROM page p
+    JOIN tweets t ON t.tweet_id = p.tweet_id
+    ORDER BY p.score DESC, p.tweet_id DESC
+"""
+
+TIMELINE_QUERY = TIMELINE_TEMPLATE.format(visible=VISIBLE_BY_FOLLOWERS)
+CACHED_TIMELINE_QUERY = TIMELINE_TEMPLATE.format(visible=VISIBLE_BY_IDS)
+PAGE_ROWS_QUERY = PAGE_ROWS_TEMPLATE.format(visible=VISIBLE_BY_FOLLOWERS)
+GRAPH_TIMELINE_QUERY = TIMELINE_TEMPLATE.format(visible=VISIBLE_BY_AUTHORS)
+GRAPH_PAGE_ROWS_QUERY = PAGE_ROWS_TEMPLATE.format(visible=VISIBLE_BY_AUTHORS)
+CACHED_PAGE_ROWS_QUERY = PAGE_ROWS_TEMPLATE.format(visible=VISIBLE_BY_IDS)
+
+TIMELINE_DEFAULT_LIMIT = 20
+TIMELINE_MAX_LIMIT = 100
+
+
+def encode_cursor(score: int, tweet_id: int) -> str:
+    """Непрозрачный курсор страницы ленты: позиция последнего твита"""
+    raw = json.dumps([score, tweet_id]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[int, int]:
+    """Разбирает курсор страницы ленты, ValueError — если он испорчен"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        score, tweet_id = json.loads(raw)
+    except (TypeError, ValueError) as e:
+        raise ValueError(f"Некорректный курсор: {cursor}") from e
+    if not isinstance(score, int) or not isinstance(tweet_id, int):
+        raise ValueError(f"Некорректный курсор: {cursor}")
+    return score, tweet_id
+
+
+def get_timeline(
+    user_id: int,
+    limit: Optional[int] = None,
+    after: Optional[Tuple[int, int]] = None,
+) -> Tuple[List[Dict], Optional[Tuple[int, int]]]:
+    """
+    Собирает ленту пользователя одним запросом: автор, вложения и лайки
+    агрегируются на стороне PostgreSQL, в Python приходят готовые твиты.
+    Твиты упорядочены по (числу лайков, tweet_id); limit и after задают
+    keyset-страницу, которую PostgreSQL читает по индексу порядка ленты
+    (миграция 0011), а с хранилищем лент — сортировкой его кандидатов
+    (не больше TIMELINE_LENGTH). Возвращает твиты и позицию последней
+    строки страницы, если запрос вернул limit строк (иначе None). Позиция берётся из строк
+    запроса, а не из достроенных твитов: твит, выпавший при догрузке,
+    не обрывает ленту и не сдвигает следующую страницу.
+    Если подключено хранилище лент, кандидаты берутся из подготовленной ленты.
+    При TIMELINE_HYDRATION=parallel запрос выбирает только страницу твитов,
+    а остальное догружает hydrate_parallel. С графом подписок в памяти
+    авторы ленты передаются в запрос списком вместо соединения с followers
+    """
+    query, params, parallel = timeline_query(user_id, limit, after)
+    if has_app_context():
+        g.likes_degraded = False
+    if parallel:
+        with connection() as conn, conn.cursor() as cursor:
+            execute_prepared(cursor, query, params)
+            rows = cursor.fetchall()
+        tweets, last = hydrate_parallel(rows)
+        count = len(rows)
+    else:
+        with connection() as conn, conn.cursor() as cursor:
+            execute_prepared(cursor, query, params)
+            tweets, last = [], None
+            for tweet, score, tweet_id in cursor:
+                tweets.append(tweet)
+                last = (score, tweet_id)
+        count = len(tweets)
+    if limit is None or count < limit:
+        last = None
+    return tweets, last
+
+
+def timeline_query(
+    user_id: int,
+    limit: Optional[int] = None,
+    after: Optional[Tuple[int, int]] = None,
+) -> Tuple[str, Dict, bool]:
+    """
+    Запрос ленты и его параметры под текущие настройки (хранилище лент,
+    граф подписок, режим догрузки). Третий элемент — True, если запрос
+    выбирает только строки твитов и их нужно достроить hydrate_parallel
+    """
+    flush_pending_likes(user_id)
+    after_score, after_id = after if after else (None, None)
+    params = {
+        "user_id": user_id,
+        "after_score": after_score,
+        "after_id": after_id,
+        "limit": limit,
+    }
+    parallel = HYDRATION_MODE == "parallel"
+    graph = follow_graph()
+    if graph is not None:
+        params["authors"] = [user_id] + graph.following(user_id)
+        query = GRAPH_PAGE_ROWS_QUERY if parallel else GRAPH_TIMELINE_QUERY
+    elif parallel:
+        query = PAGE_ROWS_QUERY
+    else:
+        query = TIMELINE_QUERY
+    store = _timeline_store
+    if store is not None:
+        params["tweet_ids"] = get_timeline_ids(user_id)
+        params["celebrities"] = list(store.celebrities())
+        query = CACHED_PAGE_ROWS_QUERY if parallel else CACHED_TIMELINE_QUERY
+    return query, params, parallel
+
+
+def stream_timeline(
+    user_id: int, batch_size: Optional[int] = None
+) -> Iterator[List[Dict]]:
+    """
+    Вся лента пользователя пачками по batch_size твитов (по умолчанию
+    TIMELINE_STREAM_BATCH): строки читаются именованным (серверным) курсором,
+    каждая пачка достраивается и отдаётся сразу, так что в памяти процесса
+    одновременно не больше одной пачки. Курсор живёт на отдельном соединении
+    пула, которое занято, пока генератор не дочитан или не закрыт
+    """
+    batch_size = batch_size or TIMELINE_STREAM_BATCH
+    query, params, parallel = timeline_query(user_id)
+    if has_app_context():
+        g.likes_degraded = False
+    pool = get_pool()
+    conn = pool.getconn()
+    try:
+        with conn.cursor(name="timeline_stream") as cursor:
+            cursor.itersize = batch_size
+            cursor.execute(query, params)
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                if parallel:
+                    yield hydrate_parallel(rows)[0]
+                else:
+                    yield [row[0] for row in rows]
+        conn.rollback()
+    finally:
+        pool.putconn(conn)
+
+
+def get_hydration_executor() -> ThreadPoolExecutor:
+    global _hydration_executor
+    if _hydration_executor is None:
+        _hydration_executor = ThreadPoolExecutor(
+            max_workers=HYDRATION_WORKERS, thread_name_prefix="hydration"
+        )
+    return _hydration_executor
+
+
+def run_with_timeout(
+    func: Callable,
+    tweet_ids: List[int],
+    timeout: float,
+    trace: Optional[RequestTrace] = None,
+):
+    """
+    Выполняет запрос догрузки в потоке пула: соединение берётся из пула
+    отдельно от соединения запроса, statement_timeout ограничивает запрос
+    на стороне PostgreSQL, чтобы соединение не было занято после таймаута.
+    Запросы попадают в трассу trace HTTP-запроса, который ждёт результат
+    """
+    timeout_token = _statement_timeout.set(max(1, int(timeout * 1000)))
+    trace_token = current_trace.set(trace)
+    try:
+        return func(tweet_ids)
+    finally:
+        current_trace.reset(trace_token)
+        _statement_timeout.reset(timeout_token)
+
+
+def hydrate_parallel(
+    rows: List[Tuple[int, int, str, str]]
+) -> Tuple[List[Dict], Optional[Tuple[int, int]]]:
+    """
+    Достраивает твиты страницы: вложения, авторы и лайки запрашиваются
+    одновременно, поэтому задержка равна самому медленному из трёх запросов.
+    Без вложений и авторов лента не отдаётся (исключение уходит выше);
+    если не успели лайки, твиты отдаются с пустыми likes, а g.likes_degraded
+    становится True
+    """
+    if not rows:
+        return [], None
+    tweet_ids = [row[0] for row in rows]
+    executor = get_hydration_executor()
+    started = time.monotonic()
+    trace = current_trace.get()
+
+    def submit(func: Callable, timeout: float):
+        return executor.submit(run_with_timeout, func, tweet_ids, timeout, trace)
+
+    media_future = submit(get_media_data, HYDRATION_TIMEOUT)
+    authors_future = submit(get_authors_data, HYDRATION_TIMEOUT)
+    likes_future = submit(get_likes_data, HYDRATION_LIKES_TIMEOUT)
+
+    def remaining(timeout: float) -> float:
+        return max(0.0, started + timeout - time.monotonic())
+
+    media_map = media_future.result(timeout=remaining(HYDRATION_TIMEOUT))
+    author_map = authors_future.result(timeout=remaining(HYDRATION_TIMEOUT))
+    try:
+        likes_map = likes_future.result(timeout=remaining(HYDRATION_LIKES_TIMEOUT))
+    except Exception as e:
+        print(f"Лайки не загружены: {e!r}")
+        likes_map = {}
+        if has_app_context():
+            g.likes_degraded = True
+
+    tweets = []
+    for tweet_id, score, content, api_key in rows:
+        author = author_map.get(tweet_id)
+        if author is None:
+            continue
+        tweets.append(
+            {
+                "id": str(tweet_id),
+                "content": content,
+                "api_key": api_key,
+                "attachments": media_map.get(tweet_id, []),
+                "author": author,
+                "likes": likes_map.get(tweet_id, []),
+            }
+        )
+    last = (rows[-1][1], rows[-1][0])
+    return tweets, last
+
+
+def likes_degraded() -> bool:
+    """Была ли последняя лента запроса отдана без списков лайкнувших"""
+    return has_app_context() and g.get("likes_degraded", False)
+
+
+def set_timeline_store(store: Optional[TimelineStore]) -> None:
+    """Подключает хранилище подготовленных лент (None — собирать ленту из БД)"""
+    global _timeline_store
+    _timeline_store = store
+
+
+def get_timeline_ids(user_id: int) -> List[int]:
+    """
+    Подготовленная лента пользователя из хранилища.
+    Если её ещё нет, собирается из БД (последние TIMELINE_LENGTH твитов)
+    """
+    tweet_ids = _timeline_store.get(user_id)
+    if tweet_ids is not None:
+        return tweet_ids
+
+    params = {"user_id": user_id, "limit": _timeline_store.length}
+    visible = VISIBLE_BY_FOLLOWERS
+    graph = follow_graph()
+    if graph is not None:
+        params["authors"] = [user_id] + graph.following(user_id)
+        visible = VISIBLE_BY_AUTHORS
+    with connection() as conn, conn.cursor() as cursor:
+        cursor.execute(
+            f"""
+            SELECT tweet_id FROM ({visible}) v
+            ORDER BY tweet_id DESC
+            LIMIT %(limit)s
+            """,
+            params,
+        )
+        tweet_ids = [row[0] for row in cursor]
+    _timeline_store.load(user_id, tweet_ids)
+    return tweet_ids
+
+
+def fan_out_tweet(author_id: Optional[int], tweet_id: int) -> None:
+    """
+    Раскладывает новый твит по лентам автора и его подписчиков.
+    Твиты авторов с числом подписчиков больше FANOUT_MAX_FOLLOWERS
+    не раскладываются, а подмешиваются в ленту при чтении
+    """
+    fan_out_tweets(author_id, [tweet_id])
+
+
+def fan_out_tweets(author_id: Optional[int], tweet_ids: List[int]) -> None:
+    """Раскладывает несколько твитов одного автора: подписчики читаются один раз"""
+    if _timeline_store is None or author_id is None or not tweet_ids:
+        return
+    recipients = timeline_recipients(author_id, FANOUT_MAX_FOLLOWERS + 1)
+    if len(recipients) > FANOUT_MAX_FOLLOWERS + 1:
+        _timeline_store.add_celebrity(recipients[0])
+        recipients = recipients[:1]
+    _timeline_store.push(recipients, tweet_ids)
+
+
+def timeline_recipients(author_id: int, limit: Optional[int] = None) -> List[int]:
+    """Автор (первым в списке) и его подписчики — владельцы лент с его твитами"""
+    graph = follow_graph()
+    if graph is not None:
+        return [author_id] + graph.followers(author_id)[:limit]
+    with connection() as conn, conn.cursor() as cursor:
+        cursor.execute(
+            "SELECT follower_id FROM followers WHERE followed_id = %s LIMIT %s",
+            (author_id, limit),
+        )
+        return [author_id] + [row[0] for row in cursor]
+
+
+def retract_tweet(author_id: Optional[int], tweet_id: int) -> None:
+    """Убирает удалённый твит из лент автора и его подписчиков"""
+    if _timeline_store is None or author_id is None:
+        return
+    _timeline_store.remove(timeline_recipients(author_id), [tweet_id])
+
+
+def backfill_timeline(user_id: int, followed_id: int) -> None:
+    """Добавляет в ленту подписчика последние твиты нового автора"""
+    if _timeline_store is None or _timeline_store.get(user_id) is None:
+        return
+    with connection() as conn, conn.cursor() as cursor:
+        cursor.execute(
+            """
+            SELECT t.tweet_id
+            FROM tweets t
+            WHERE t.author_id = %s
+            ORDER BY t.tweet_id DESC
+            LIMIT %s
+            """,
+            (followed_id, _timeline_store.length),
+        )
+        tweet_ids = [row[0] for row in cursor]
+    _timeline_store.push([user_id], tweet_ids)
+
+
 def get_tweets(api_key: str) -> Union[List[dict], bool]:
     """
     Функция для вывода всех твитов пользователя и его подписок на экран.
@@ -212,195 +1003,727 @@ def get_tweets(api_key: str) -> Union[List[dict], bool]:
     """
     user = get_users_params(api_key)
     try:
-        all_tweets, tweet_ids = get_tweets_data(user["id"])
-        media_map = get_media_data(tweet_ids)
-        author_map = get_authors_data(tweet_ids)
-        likes_map = get_likes_data(tweet_ids)
+        all_tweets, _ = get_timeline(user["id"])
+        return all_tweets
+
+    except UNAVAILABLE_ERRORS:
+        raise
+    except Exception as e:
+        print(e)
+        return False
 
-        for tweet in all_tweets:
-            tweet["attachments"] = media_map.get(int(tweet["id"]), [])
-            tweet["author"] = author_map.get(int(tweet["id"]))
-            tweet["likes"] = likes_map.get(int(tweet["id"]), [])
 
-        return all_tweets
+def get_tweets_page(
+    api_key: str, limit: int, after: Optional[Tuple[int, int]] = None
+) -> Union[Tuple[List[dict], Optional[str]], bool]:
+    """
+    Одна страница ленты пользователя (keyset-пагинация по лайкам и tweet_id).
+    Возвращает твиты и курсор следующей страницы (None, если страница последняя)
+    """
+    user = get_users_params(api_key)
+    try:
+        page, last = get_timeline(user["id"], limit, after)
+        next_cursor = encode_cursor(*last) if last else None
+        return page, next_cursor
 
+    except UNAVAILABLE_ERRORS:
+        raise
     except Exception as e:
         print(e)
         return False
 
 
-def media(file_path: str, api_key: str) -> str:
+def media(
+    file_path: str,
+    api_key: str,
+    sha256: Optional[str] = None,
+    size: Optional[int] = None,
+    mime_type: Optional[str] = None,
+) -> str:
     """
     Добавляет ID загруженных картинок в базу данных
+    вместе с хешем содержимого, размером и MIME-типом файла.
+    В той же транзакции ставится задача media.process: размеры и превью
+    заполняются в фоне
     """
-    conn = current_connection_function()
-    with conn.cursor() as cursor:
+    with connection() as conn, conn.cursor() as cursor:
         cursor.execute(
-            "INSERT INTO media (file_path, api_key) VALUES (%s, %s) RETURNING id",
-            (file_path, api_key),
+            """
+            INSERT INTO media (file_path, api_key, sha256, size_bytes, mime_type)
+            VALUES (%s, %s, %s, %s, %s)
+            RETURNING id
+            """,
+            (file_path, api_key, sha256, size, mime_type),
         )
-        conn.commit()
         media_id = cursor.fetchone()[0]
+        enqueue_job(cursor, "media.process", {"media_id": media_id})
+        conn.commit()
         return media_id
 
 
+def get_media_file(media_id: int) -> Optional[Tuple[str, Optional[str]]]:
+    """Путь и MIME-тип медиафайла или None, если записи уже нет"""
+    with connection() as conn, conn.cursor() as cursor:
+        cursor.execute(
+            "SELECT file_path, mime_type FROM media WHERE id = %s", (media_id,)
+        )
+        return cursor.fetchone()
+
+
+def save_media_info(
+    media_id: int, info: Dict, preview_path: Optional[str] = None
+) -> None:
+    """
+    Записывает в строку media размеры, остальные сведения заголовка
+    (metadata) и путь к превью
+    """
+    metadata = {k: v for k, v in info.items() if k not in ("width", "height")}
+    with connection() as conn, conn.cursor() as cursor:
+        cursor.execute(
+            """
+            UPDATE media
+            SET width = %s, height = %s, metadata = %s,
+                preview_path = %s, processed_at = now()
+            WHERE id = %s
+            """,
+            (
+                info.get("width"),
+                info.get("height"),
+                json.dumps(metadata),
+                preview_path,
+                media_id,
+            ),
+        )
+        conn.commit()
+
+
+def referenced_files(paths: List[str]) -> Set[str]:
+    """Какие из путей ещё записаны в media как оригинал или превью"""
+    with connection() as conn, conn.cursor() as cursor:
+        cursor.execute(
+            """
+            SELECT file_path FROM media WHERE file_path = ANY(%(paths)s)
+            UNION
+            SELECT preview_path FROM media WHERE preview_path = ANY(%(paths)s)
+            """,
+            {"paths": paths},
+        )
+        return {path for (path,) in cursor}
+
+
+def enqueue_job(
+    cursor,
+    kind: str,
+    payload: Dict,
+    delay: float = 0,
+    max_attempts: Optional[int] = None,
+) -> None:
+    """
+    Ставит фоновую задачу в очередь jobs в текущей транзакции курсора:
+    задача появится у воркеров, только если транзакция зафиксирована
+    """
+    cursor.execute(
+        """
+        INSERT INTO jobs (kind, payload, run_at, max_attempts)
+        VALUES (%s, %s, now() + make_interval(secs => %s), %s)
+        """,
+        (kind, json.dumps(payload), delay, max_attempts or JOB_MAX_ATTEMPTS),
+    )
+
+
+# Задачи, у которых истёк тайм-аут видимости на последней попытке
+EXPIRE_JOBS_QUERY = """
+    UPDATE jobs
+    SET status = 'failed', locked_until = NULL,
+        last_error = 'Истёк тайм-аут видимости на последней попытке'
+    WHERE status = 'running' AND locked_until < now() AND attempts >= max_attempts
+"""
+
+# Очередные задачи и задачи с истёкшим тайм-аутом видимости; строки,
+# которые сейчас забирает другой воркер, пропускаются (SKIP LOCKED)
+CLAIM_JOBS_QUERY = """
+    UPDATE jobs j
+    SET status = 'running',
+        attempts = j.attempts + 1,
+        locked_until = now() + make_interval(secs => %(visibility)s)
+    FROM (
+        SELECT id
+        FROM jobs
+        WHERE status IN ('queued', 'running')
+          AND CASE WHEN status = 'queued' THEN run_at <= now()
+                   ELSE locked_until < now() END
+          AND attempts < max_attempts
+          AND (%(kinds)s::text[] IS NULL OR kind = ANY(%(kinds)s::text[]))
+        ORDER BY run_at, id
+        LIMIT %(limit)s
+        FOR UPDATE SKIP LOCKED
+    ) c
+    WHERE j.id = c.id
+    RETURNING j.id, j.kind, j.payload, j.attempts
+"""
+
+
+def claim_jobs(
+    limit: int, visibility: float, kinds: Optional[List[str]] = None
+) -> List[Tuple[int, str, Dict, int]]:
+    """
+    Забирает до limit задач на visibility секунд. Возвращает
+    (id, kind, payload, attempt); attempt — номер попытки, с ним задача
+    завершается в complete_job и fail_job
+    """
+    with connection() as conn, conn.cursor() as cursor:
+        cursor.execute(EXPIRE_JOBS_QUERY)
+        cursor.execute(
+            CLAIM_JOBS_QUERY,
+            {"limit": limit, "visibility": visibility, "kinds": kinds},
+        )
+        jobs = cursor.fetchall()
+        conn.commit()
+    return jobs
+
+
+def complete_job(job_id: int, attempt: int) -> None:
+    """
+    Удаляет выполненную задачу. Если её уже забрал другой воркер
+    (истёк тайм-аут видимости), строка не меняется
+    """
+    with connection() as conn, conn.cursor() as cursor:
+        cursor.execute(
+            """
+            DELETE FROM jobs
+            WHERE id = %s AND attempts = %s AND status = 'running'
+            """,
+            (job_id, attempt),
+        )
+        conn.commit()
+
+
+def fail_job(
+    job_id: int, attempt: int, error: str, retry_delay: float, final: bool = False
+) -> None:
+    """
+    Возвращает задачу в очередь через retry_delay * 2^(attempt-1) секунд
+    или переводит в failed, если попытки кончились (или final=True)
+    """
+    with connection() as conn, conn.cursor() as cursor:
+        cursor.execute(
+            """
+            UPDATE jobs
+            SET status = CASE WHEN %(final)s OR attempts >= max_attempts
+                              THEN 'failed' ELSE 'queued' END,
+                run_at = now() + make_interval(
+                    secs => %(delay)s * power(2, attempts - 1)
+                ),
+                locked_until = NULL,
+                last_error = %(error)s
+            WHERE id = %(id)s AND attempts = %(attempt)s AND status = 'running'
+            """,
+            {
+                "id": job_id,
+                "attempt": attempt,
+                "error": error,
+                "delay": retry_delay,
+                "final": final,
+            },
+        )
+        conn.commit()
+
+
+def retry_failed_jobs(kind: Optional[str] = None) -> int:
+    """Возвращает в очередь задачи в статусе failed с обнулёнными попытками"""
+    with connection() as conn, conn.cursor() as cursor:
+        cursor.execute(
+            """
+            UPDATE jobs
+            SET status = 'queued', attempts = 0, run_at = now()
+            WHERE status = 'failed' AND (%(kind)s::text IS NULL OR kind = %(kind)s)
+            """,
+            {"kind": kind},
+        )
+        conn.commit()
+        return cursor.rowcount
+
+
+def job_stats() -> Dict[str, float]:
+    """Число задач по статусам и возраст самой старой ждущей задачи"""
+    with connection() as conn, conn.cursor() as cursor:
+        cursor.execute(
+            """
+            SELECT
+                COUNT(*) FILTER (WHERE status = 'queued'),
+                COUNT(*) FILTER (WHERE status = 'running'),
+                COUNT(*) FILTER (WHERE status = 'failed'),
+                COALESCE(EXTRACT(EPOCH FROM now() - MIN(run_at) FILTER (
+                    WHERE status = 'queued' AND run_at <= now()
+                )), 0)
+            FROM jobs
+            """
+        )
+        queued, running, failed, oldest = cursor.fetchone()
+    return {
+        "queued": queued,
+        "running": running,
+        "failed": failed,
+        "oldest_queued_seconds": float(oldest),
+    }
+
+
 def deleting(tweet_id: str) -> Union[Dict[str, bool], bool]:
     """
-    Удаляет твит по его ID
+    Удаляет твит по его ID.
+    Лайки твита удаляются каскадно вместе с его счётчиком like_count.
+    Вложения, которые больше ни к одному твиту не прикреплены, удаляются
+    из media, а их файлы — фоновой задачей files.delete
     """
-    conn = current_connection_function()
-    with conn.cursor() as cursor:
-        cursor.execute("DELETE FROM tweets WHERE tweet_id = %s", (tweet_id,))
+    with connection() as conn, conn.cursor() as cursor:
+        cursor.execute(
+            """
+            DELETE FROM media m
+            USING tweet_media tm
+            WHERE tm.tweet_id = %(tweet_id)s
+              AND m.id = tm.media_id
+              AND NOT EXISTS (
+                  SELECT 1 FROM tweet_media other
+                  WHERE other.media_id = m.id AND other.tweet_id <> %(tweet_id)s
+              )
+            RETURNING m.file_path, m.preview_path
+            """,
+            {"tweet_id": tweet_id},
+        )
+        files = sorted({path for row in cursor.fetchall() for path in row if path})
+        cursor.execute(
+            "DELETE FROM tweets WHERE tweet_id = %s RETURNING author_id", (tweet_id,)
+        )
         if cursor.rowcount == 0:
+            conn.rollback()
             return False
         else:
+            author_id = cursor.fetchone()[0]
+            bump_versions(cursor, [author_id])
+            if files:
+                enqueue_job(cursor, "files.delete", {"paths": files})
             conn.commit()
-            return {"result": True}
+    retract_tweet(author_id, int(tweet_id))
+    return {"result": True}
+
+
+# Лайки и снятие лайков одним запросом: тройки (tweet_id, user_id, liked)
+# приходят массивами, счётчики меняются только для твитов, где строка
+# в likes действительно добавилась или удалилась, — один раз на твит,
+# сколько бы пользователей его ни лайкнули. В том же запросе сдвигаются
+# версии изменений авторов (ETag лент их подписчиков)
+APPLY_LIKES_QUERY = """
+    WITH ops AS (
+        SELECT *
+        FROM unnest(
+            %(tweet_ids)s::integer[], %(user_ids)s::integer[], %(liked)s::boolean[]
+        ) AS o(tweet_id, user_id, liked)
+    ), inserted AS (
+        INSERT INTO likes (user_id, tweet_id)
+        SELECT ops.user_id, t.tweet_id
+        FROM ops
+        JOIN tweets t ON t.tweet_id = ops.tweet_id
+        WHERE ops.liked
+        ON CONFLICT DO NOTHING
+        RETURNING tweet_id
+    ), deleted AS (
+        DELETE FROM likes l
+        USING ops
+        WHERE l.user_id = ops.user_id AND l.tweet_id = ops.tweet_id AND NOT ops.liked
+        RETURNING l.tweet_id
+    ), changes AS (
+        SELECT tweet_id, SUM(delta) AS delta
+        FROM (
+            SELECT tweet_id, 1 AS delta FROM inserted
+            UNION ALL
+            SELECT tweet_id, -1 AS delta FROM deleted
+        ) d
+        GROUP BY tweet_id
+    ), updated AS (
+        UPDATE tweets t
+        SET like_count = t.like_count + c.delta
+        FROM changes c
+        WHERE t.tweet_id = c.tweet_id
+        RETURNING t.tweet_id, t.author_id
+    ), bumped AS (
+        UPDATE users
+        SET change_version = nextval('change_version_seq')
+        WHERE id IN (SELECT author_id FROM updated)
+    )
+    SELECT tweet_id FROM updated
+"""
+
+
+def apply_likes(user_id: int, operations: List[Tuple[int, bool]]) -> List[int]:
+    """
+    Применяет операции (tweet_id, True — лайк / False — снять лайк) одного
+    пользователя в одной транзакции одним запросом. Для каждого твита
+    действует последняя операция. Возвращает id твитов, у которых
+    лайк действительно поставлен или снят
+    """
+    final = {int(tweet_id): bool(liked) for tweet_id, liked in operations}
+    flush_pending_likes(user_id)
+    return write_likes(
+        [(tweet_id, user_id, final[tweet_id]) for tweet_id in sorted(final)]
+    )
 
 
-def check_likes(api_key: str, id: int) -> Dict[str, bool]:
+def write_likes(intents: List[Tuple[int, int, bool]]) -> List[int]:
     """
-    Добавляет или удаляет лайк с поста
+    Записывает тройки (tweet_id, user_id, liked) разных пользователей
+    в одной транзакции; пара (tweet_id, user_id) встречается не больше
+    одного раза. Так же пишет пачки LikeBuffer. Возвращает id твитов,
+    у которых что-то изменилось
+    """
+    if not intents:
+        return []
+    with connection() as conn, conn.cursor() as cursor:
+        execute_prepared(
+            cursor,
+            APPLY_LIKES_QUERY,
+            {
+                "tweet_ids": [tweet_id for tweet_id, _, _ in intents],
+                "user_ids": [user_id for _, user_id, _ in intents],
+                "liked": [liked for _, _, liked in intents],
+            },
+        )
+        changed = sorted(tweet_id for (tweet_id,) in cursor)
+        conn.commit()
+    return changed
+
+
+def check_likes(api_key: str, id: int, like: bool = True) -> Dict[str, bool]:
+    """
+    Ставит (like=True) или снимает (like=False) лайк с поста.
+    Повторный лайк и снятие отсутствующего лайка ничего не меняют.
+    С LIKE_BUFFER=1 лайк только запоминается и пишется пачкой чуть позже
     """
     user = get_users_params(api_key)
-    tweet_id = id
-    conn = current_connection_function()
-    with conn.cursor() as cursor:
-        try:
-            cursor.execute(
-                "INSERT INTO likes" "(user_id, tweet_id)" "VALUES(%s, %s)",
-                (user["id"], tweet_id),
-            )
-            conn.commit()
-            return {"result": True}
-        except psycopg2.IntegrityError:
-            conn.rollback()
-            cursor.execute(
-                "DELETE FROM likes " "WHERE user_id = %s AND tweet_id = %s",
-                (user["id"], tweet_id),
-            )
-            conn.commit()
-            return {"result": True}
+    if _like_buffer is not None:
+        _like_buffer.add(user["id"], int(id), like)
+    else:
+        apply_likes(user["id"], [(id, like)])
+    return {"result": True}
+
+
+def batch_likes(
+    api_key: str, operations: List[Tuple[int, bool]]
+) -> Union[Dict[str, Union[bool, List[int]]], bool]:
+    """
+    Пакет лайков и снятий лайков пользователя в одной транзакции.
+    Возвращает id изменившихся твитов или False, если пользователь не найден
+    """
+    user = get_users_params(api_key)
+    if user is None:
+        return False
+    return {"result": True, "changed": apply_likes(user["id"], operations)}
+
+
+enable_like_buffer(LIKE_BUFFER)
+
+
+def reconcile_like_counts() -> int:
+    """
+    Пересчитывает tweets.like_count по таблице likes.
+    Возвращает число исправленных твитов
+    """
+    with connection() as conn, conn.cursor() as cursor:
+        cursor.execute(
+            """
+            UPDATE tweets t
+            SET like_count = c.num_likes
+            FROM (
+                SELECT t2.tweet_id, COUNT(l.tweet_id) AS num_likes
+                FROM tweets t2
+                LEFT JOIN likes l ON l.tweet_id = t2.tweet_id
+                GROUP BY t2.tweet_id
+            ) c
+            WHERE t.tweet_id = c.tweet_id AND t.like_count <> c.num_likes
+            """
+        )
+        fixed = cursor.rowcount
+        conn.commit()
+    return fixed
+
+
+def reconcile_follow_counts() -> int:
+    """
+    Пересчитывает users.followers_count и users.following_count
+    по таблице followers. Возвращает число исправленных пользователей
+    """
+    with connection() as conn, conn.cursor() as cursor:
+        cursor.execute(
+            """
+            UPDATE users u
+            SET followers_count = c.num_followers, following_count = c.num_following
+            FROM (
+                SELECT
+                    u2.id,
+                    (SELECT COUNT(*) FROM followers f
+                     WHERE f.followed_id = u2.id AND f.follower_id <> u2.id) AS num_followers,
+                    (SELECT COUNT(*) FROM followers f
+                     WHERE f.follower_id = u2.id AND f.followed_id <> u2.id) AS num_following
+                FROM users u2
+            ) c
+            WHERE u.id = c.id
+              AND (u.followers_count <> c.num_followers
+                   OR u.following_count <> c.num_following)
+            """
+        )
+        fixed = cursor.rowcount
+        conn.commit()
+    profile_cache.clear()
+    return fixed
+
+
+# Меняет счётчики подписчика и автора одним запросом (delta = 1 или -1)
+# и сдвигает версии изменений обоих
+UPDATE_FOLLOW_COUNTS_QUERY = """
+    UPDATE users
+    SET following_count = following_count
+            + CASE WHEN id = %(follower_id)s THEN %(delta)s ELSE 0 END,
+        followers_count = followers_count
+            + CASE WHEN id = %(followed_id)s THEN %(delta)s ELSE 0 END,
+        change_version = nextval('change_version_seq')
+    WHERE id IN (%(follower_id)s, %(followed_id)s)
+"""
 
 
 def check_followers(
     id: int, api_key: str, request_method: str
 ) -> Union[Dict[str, bool], bool]:
     """
-    Оформляет или отменяет подписку на пользователя
+    Оформляет или отменяет подписку на пользователя.
+    Счётчики подписок меняются в той же транзакции
     """
     try:
-        conn = current_connection_function()
         user = get_users_params(api_key)
-        with conn.cursor() as cursor:
+        followed_id = int(id)
+        with connection() as conn, conn.cursor() as cursor:
             if request_method == "POST":
                 cursor.execute(
                     "INSERT INTO followers "
                     "(follower_id, followed_id) "
                     "VALUES(%s, %s)",
-                    (user["id"], id),
+                    (user["id"], followed_id),
                 )
-                conn.commit()
-                return {"result": True}
-
+                delta = 1
             elif request_method == "DELETE":
                 cursor.execute(
                     "DELETE FROM followers "
                     "WHERE follower_id = %s AND followed_id = %s",
-                    (user["id"], id),
+                    (user["id"], followed_id),
+                )
+                delta = -cursor.rowcount
+            else:
+                return False
+            if delta and user["id"] != followed_id:
+                cursor.execute(
+                    UPDATE_FOLLOW_COUNTS_QUERY,
+                    {
+                        "follower_id": user["id"],
+                        "followed_id": followed_id,
+                        "delta": delta,
+                    },
                 )
-                conn.commit()
-                return {"result": True}
+            conn.commit()
+
+        profile_cache.invalidate(user["id"])
+        profile_cache.invalidate(followed_id)
+        if _follow_graph is not None:
+            if request_method == "POST":
+                _follow_graph.follow(user["id"], followed_id)
+            else:
+                _follow_graph.unfollow(user["id"], followed_id)
+        if request_method == "POST":
+            backfill_timeline(user["id"], followed_id)
+        elif _timeline_store is not None:
+            _timeline_store.evict(user["id"])
+        return {"result": True}
 
     except Exception as e:
-        conn = current_connection_function()
-        conn.rollback()
         print(f"Error: {e}")
         return False
 
 
+# Профиль одним запросом: счётчики и первые записи обоих списков.
+# Подписка на себя в списках не показывается
+PROFILE_QUERY = """
+    SELECT
+        u.id,
+        u.name,
+        u.followers_count,
+        u.following_count,
+        ARRAY(
+            SELECT ARRAY[f.follower_id::text, fu.name]
+            FROM followers f
+            JOIN users fu ON fu.id = f.follower_id
+            WHERE f.followed_id = u.id AND f.follower_id <> u.id
+            ORDER BY f.follower_id
+            LIMIT %(preview)s
+        ),
+        ARRAY(
+            SELECT ARRAY[f.followed_id::text, fu.name]
+            FROM followers f
+            JOIN users fu ON fu.id = f.followed_id
+            WHERE f.follower_id = u.id AND f.followed_id <> u.id
+            ORDER BY f.followed_id
+            LIMIT %(preview)s
+        )
+    FROM users u
+    WHERE u.id = %(user_id)s
+"""
+
+
+# То же по спискам id из графа подписок: из БД читаются только имена
+GRAPH_PROFILE_QUERY = """
+    SELECT
+        u.id,
+        u.name,
+        u.followers_count,
+        u.following_count,
+        ARRAY(
+            SELECT ARRAY[fu.id::text, fu.name]
+            FROM users fu
+            WHERE fu.id = ANY(%(followers)s)
+            ORDER BY fu.id
+        ),
+        ARRAY(
+            SELECT ARRAY[fu.id::text, fu.name]
+            FROM users fu
+            WHERE fu.id = ANY(%(following)s)
+            ORDER BY fu.id
+        )
+    FROM users u
+    WHERE u.id = %(user_id)s
+"""
+
+
+def get_profile(user_id: int) -> Optional[Dict]:
+    """
+    Профиль пользователя: id, имя, счётчики подписчиков и подписок и первые
+    PROFILE_PREVIEW_SIZE записей каждого списка (остальные —
+    get_follow_page). Результат кэшируется в profile_cache до изменения
+    подписок пользователя. None, если пользователя нет
+    """
+    found, cached = profile_cache.get(user_id)
+    if found:
+        return None if cached is MISSING else copy_profile(cached)
+
+    query = PROFILE_QUERY
+    params = {"user_id": user_id, "preview": PROFILE_PREVIEW_SIZE}
+    graph = follow_graph()
+    if graph is not None:
+        query = GRAPH_PROFILE_QUERY
+        for relation in ("followers", "following"):
+            params[relation] = graph.page(user_id, relation, None, PROFILE_PREVIEW_SIZE)
+    with connection() as conn, conn.cursor() as cursor:
+        execute_prepared(cursor, query, params)
+        row = cursor.fetchone()
+    if row is None:
+        profile_cache.set(user_id, MISSING)
+        return None
+    profile = {
+        "id": row[0],
+        "name": row[1],
+        "followers_count": row[2],
+        "following_count": row[3],
+        "followers": [{"id": id, "name": name} for id, name in row[4]],
+        "following": [{"id": id, "name": name} for id, name in row[5]],
+    }
+    profile_cache.set(user_id, profile)
+    return copy_profile(profile)
+
+
+def copy_profile(profile: Dict) -> Dict:
+    """Копия профиля из кэша, которую вызывающий код может менять"""
+    result = dict(profile)
+    result["followers"] = list(profile["followers"])
+    result["following"] = list(profile["following"])
+    return result
+
+
 def my_profile(api_key: str) -> Dict:
     """
-    Показывает всю информацию о профиле авторизованного пользователя
+    Показывает профиль авторизованного пользователя
     """
     try:
         user = get_users_params(api_key)
-        conn = current_connection_function()
-        with conn.cursor() as cursor:
-            cursor.execute(
-                """SELECT f.followed_id, u.name
-                              FROM followers f
-                              JOIN users u ON u.id = f.followed_id
-                              WHERE f.follower_id = %s AND f.followed_id != %s""",
-                (user["id"], user["id"]),
-            )
+        profile = get_profile(user["id"])
+        profile["api_key"] = api_key
+        return profile
 
-            following = [
-                {"id": str(row[0]), "name": str(row[1])} for row in cursor.fetchall()
-            ]
-            user["following"] = following
-
-            cursor.execute(
-                """SELECT f.follower_id, u.name
-                              FROM followers f
-                              JOIN users u ON u.id = f.follower_id
-                              WHERE f.followed_id = %s""",
-                (user["id"],),
-            )
+    except Exception as e:
+        print(f"Error: {e}")
 
-            followers = [
-                {"id": str(row[0]), "name": str(row[1])} for row in cursor.fetchall()
-            ]
-            user["followers"] = followers
 
-        return user
+def any_profile(user_id: int) -> Dict:
+    """
+    Показывает профиль пользователя по ID
+    """
+    try:
+        return get_profile(int(user_id))
 
     except Exception as e:
-        conn = current_connection_function()
-        conn.rollback()
         print(f"Error: {e}")
 
 
-def any_profile(user_id: int) -> Dict:
+FOLLOW_PAGE_DEFAULT_LIMIT = 50
+FOLLOW_PAGE_MAX_LIMIT = 500
+
+FOLLOW_PAGE_QUERIES = {
+    "followers": """
+        SELECT f.follower_id, u.name
+        FROM followers f
+        JOIN users u ON u.id = f.follower_id
+        WHERE f.followed_id = %(user_id)s AND f.follower_id <> %(user_id)s
+          AND f.follower_id > %(after)s
+        ORDER BY f.follower_id
+        LIMIT %(limit)s
+    """,
+    "following": """
+        SELECT f.followed_id, u.name
+        FROM followers f
+        JOIN users u ON u.id = f.followed_id
+        WHERE f.follower_id = %(user_id)s AND f.followed_id <> %(user_id)s
+          AND f.followed_id > %(after)s
+        ORDER BY f.followed_id
+        LIMIT %(limit)s
+    """,
+}
+
+
+def get_follow_page(
+    user_id: int, relation: str, limit: int, after: Optional[int] = None
+) -> Optional[Tuple[List[Dict[str, str]], Optional[str]]]:
     """
-    Показывает всю информацию о профиле пользователя по ID
+    Страница подписчиков (relation="followers") или подписок ("following")
+    в порядке id. after — id последней записи предыдущей страницы.
+    Возвращает (записи, курсор следующей страницы) или None, если
+    пользователя нет. С графом подписок в памяти из БД читаются только имена
     """
-    user = {}
-    conn = current_connection_function()
-    try:
-        with conn.cursor() as cursor:
-            cursor.execute("SELECT id, name FROM users " "WHERE id = %s", (user_id,))
-            profile = cursor.fetchone()
-            user["id"] = profile[0]
-            user["name"] = profile[1]
-
-            cursor.execute(
-                """SELECT f.followed_id, u.name
-                              FROM followers f
-                              JOIN users u ON u.id = f.followed_id
-                              WHERE f.follower_id = %s AND f.followed_id != %s""",
-                (user["id"], user["id"]),
+    if get_profile(user_id) is None:
+        return None
+    graph = follow_graph()
+    with connection() as conn, conn.cursor() as cursor:
+        if graph is not None:
+            execute_prepared(
+                cursor,
+                "SELECT id, name FROM users WHERE id = ANY(%s) ORDER BY id",
+                (graph.page(user_id, relation, after, limit),),
             )
-
-            following = [
-                {"id": str(row[0]), "name": str(row[1])} for row in cursor.fetchall()
-            ]
-            user["following"] = following
-
-            cursor.execute(
-                """SELECT f.follower_id, u.name
-                              FROM followers f
-                              JOIN users u ON u.id = f.follower_id
-                              WHERE f.followed_id = %s""",
-                (user["id"],),
+        else:
+            execute_prepared(
+                cursor,
+                FOLLOW_PAGE_QUERIES[relation],
+                {"user_id": user_id, "after": after or 0, "limit": limit},
             )
+        rows = cursor.fetchall()
+    entries = [{"id": str(row[0]), "name": row[1]} for row in rows]
+    next_cursor = str(rows[-1][0]) if len(rows) == limit else None
+    return entries, next_cursor
 
-            followers = [
-                {"id": str(row[0]), "name": str(row[1])} for row in cursor.fetchall()
-            ]
-            user["followers"] = followers
-        return user
 
-    except Exception as e:
-        conn.rollback()
-        print(f"Error: {e}")
+def profile_cache_stats() -> Dict[str, float]:
+    """Статистика кэша профилей для мониторинга"""
+    return profile_cache.stats()
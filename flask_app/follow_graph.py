@@ -0,0 +1,374 @@
+"""
+Граф подписок в памяти процесса.
+
+Рёбра хранятся в формате CSR: для каждого направления (подписки и
+подписчики) — массив смещений по id пользователя и общий массив соседей
+int32, соседи каждого пользователя отсортированы. Это около 8 байт
+на подписку (по 4 в каждом направлении) плюс 16 байт на пользователя
+(смещение int64 в каждом направлении). Подписки и отписки после загрузки
+копятся в небольшом наложении (множества добавленных и удалённых рёбер),
+которое вливается в массивы, когда вырастает больше compact_threshold;
+новые массивы строятся без блокировки, чтение в это время не ждёт.
+
+Граф согласован только в пределах одного процесса-воркера: изменения,
+сделанные другими воркерами, появляются после перезагрузки из БД
+(FollowGraphIndex, раз в refresh секунд). Подписка на себя не хранится.
+"""
+import threading
+import time
+from array import array
+from bisect import bisect_right
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+# Сколько изменений копится в наложении до пересборки массивов
+COMPACT_THRESHOLD = 10_000
+
+
+class Adjacency:
+    """Списки соседей одного направления в формате CSR"""
+
+    __slots__ = ("offsets", "targets")
+
+    def __init__(self, offsets: array, targets: array):
+        self.offsets = offsets
+        self.targets = targets
+
+    def neighbors(self, node: int) -> array:
+        if node + 1 >= len(self.offsets):
+            return array("i")
+        return self.targets[self.offsets[node] : self.offsets[node + 1]]
+
+    def span(self, node: int) -> Tuple[int, int]:
+        if node + 1 >= len(self.offsets):
+            return 0, 0
+        return self.offsets[node], self.offsets[node + 1]
+
+    @property
+    def nbytes(self) -> int:
+        return (
+            len(self.offsets) * self.offsets.itemsize
+            + len(self.targets) * self.targets.itemsize
+        )
+
+
+def build_csr(sources: array, targets: array, size: int) -> Adjacency:
+    """
+    CSR по рёбрам (sources[i] -> targets[i]) подсчётом (counting sort).
+    Сортировка устойчива: если рёбра шли по возрастанию targets внутри
+    sources или по возрастанию sources, соседи получатся упорядоченными
+    """
+    offsets = array("q", bytes(8 * (size + 1)))
+    for source in sources:
+        offsets[source + 1] += 1
+    for node in range(size):
+        offsets[node + 1] += offsets[node]
+    position = array("q", offsets[:-1])
+    result = array("i", bytes(4 * len(targets)))
+    for source, target in zip(sources, targets):
+        result[position[source]] = target
+        position[source] += 1
+    return Adjacency(offsets, result)
+
+
+class FollowGraph:
+    """Подписки (follower -> followed) в обоих направлениях"""
+
+    def __init__(
+        self,
+        followers: Iterable[int] = (),
+        followed: Iterable[int] = (),
+        compact_threshold: int = COMPACT_THRESHOLD,
+    ):
+        """
+        followers и followed — концы рёбер по порядку, отсортированные
+        по (follower, followed), как их читает load_edges
+        """
+        sources = array("i", followers)
+        targets = array("i", followed)
+        size = max(max(sources, default=0), max(targets, default=0)) + 1
+        self._out = build_csr(sources, targets, size)
+        self._in = build_csr(targets, sources, size)
+        self.compact_threshold = compact_threshold
+        self._added: Dict[Tuple[int, int], None] = {}
+        self._removed: Set[Tuple[int, int]] = set()
+        self._out_delta: Dict[int, Set[int]] = {}
+        self._in_delta: Dict[int, Set[int]] = {}
+        # Рёбра, изменённые во время пересборки массивов (None — её нет)
+        self._compacting: Optional[Set[Tuple[int, int]]] = None
+        self._lock = threading.Lock()
+
+    def _in_base(self, follower: int, followed: int) -> bool:
+        start, end = self._out.span(follower)
+        targets = self._out.targets
+        index = bisect_right(targets, followed, start, end) - 1
+        return index >= start and targets[index] == followed
+
+    def is_following(self, follower: int, followed: int) -> bool:
+        with self._lock:
+            return self._has_edge(follower, followed)
+
+    def follow(self, follower: int, followed: int) -> None:
+        if follower == followed:
+            return
+        edge = (follower, followed)
+        with self._lock:
+            if edge in self._removed:
+                self._removed.discard(edge)
+            elif not self._in_base(follower, followed):
+                self._added[edge] = None
+            else:
+                return
+            self._touch(follower, followed)
+            compact = self._needs_compact()
+        if compact:
+            self._compact()
+
+    def unfollow(self, follower: int, followed: int) -> None:
+        edge = (follower, followed)
+        with self._lock:
+            if edge in self._added:
+                del self._added[edge]
+            elif self._in_base(follower, followed):
+                self._removed.add(edge)
+            else:
+                return
+            self._touch(follower, followed)
+            compact = self._needs_compact()
+        if compact:
+            self._compact()
+
+    def _touch(self, follower: int, followed: int) -> None:
+        """Помечает пользователей, у которых список отличается от массивов"""
+        self._out_delta.setdefault(follower, set()).add(followed)
+        self._in_delta.setdefault(followed, set()).add(follower)
+        if self._compacting is not None:
+            self._compacting.add((follower, followed))
+
+    def _neighbors(self, node: int, outgoing: bool) -> List[int]:
+        adjacency = self._out if outgoing else self._in
+        delta = (self._out_delta if outgoing else self._in_delta).get(node)
+        base = adjacency.neighbors(node)
+        if not delta:
+            return base.tolist()
+        result = set(base)
+        for other in delta:
+            edge = (node, other) if outgoing else (other, node)
+            if edge in self._added:
+                result.add(other)
+            elif edge in self._removed:
+                result.discard(other)
+        return sorted(result)
+
+    def following(self, user_id: int) -> List[int]:
+        """На кого подписан пользователь (по возрастанию id)"""
+        with self._lock:
+            return self._neighbors(user_id, outgoing=True)
+
+    def followers(self, user_id: int) -> List[int]:
+        """Кто подписан на пользователя (по возрастанию id)"""
+        with self._lock:
+            return self._neighbors(user_id, outgoing=False)
+
+    def page(
+        self, user_id: int, relation: str, after: Optional[int], limit: int
+    ) -> List[int]:
+        """
+        Страница подписчиков (relation="followers") или подписок
+        ("following"): id больше after, не больше limit штук
+        """
+        outgoing = relation == "following"
+        with self._lock:
+            delta = (self._out_delta if outgoing else self._in_delta).get(user_id)
+            if delta:
+                ids = self._neighbors(user_id, outgoing)
+                start = bisect_right(ids, after) if after is not None else 0
+                return ids[start : start + limit]
+            adjacency = self._out if outgoing else self._in
+            begin, end = adjacency.span(user_id)
+            if after is not None:
+                begin = bisect_right(adjacency.targets, after, begin, end)
+            return adjacency.targets[begin : min(end, begin + limit)].tolist()
+
+    def count(self, user_id: int, relation: str) -> int:
+        outgoing = relation == "following"
+        with self._lock:
+            if (self._out_delta if outgoing else self._in_delta).get(user_id):
+                return len(self._neighbors(user_id, outgoing))
+            begin, end = (self._out if outgoing else self._in).span(user_id)
+            return end - begin
+
+    def _needs_compact(self) -> bool:
+        pending = len(self._added) + len(self._removed)
+        return self._compacting is None and pending > self.compact_threshold
+
+    def _compact(self) -> None:
+        """
+        Вливает наложение в массивы. Под блокировкой снимается снимок
+        наложения, массивы строятся без неё; рёбра, изменённые за это время,
+        после подмены массивов остаются в наложении
+        """
+        with self._lock:
+            if self._compacting is not None:
+                return
+            self._compacting = set()
+            base = self._out
+            added = list(self._added)
+            removed = list(self._removed)
+        try:
+            changes: Dict[int, Tuple[Set[int], Set[int]]] = {}
+            size = len(base.offsets) - 1
+            for follower, followed in added:
+                changes.setdefault(follower, (set(), set()))[0].add(followed)
+                size = max(size, follower + 1, followed + 1)
+            for follower, followed in removed:
+                changes.setdefault(follower, (set(), set()))[1].add(followed)
+            sources, targets = array("i"), array("i")
+            for node in range(size):
+                neighbors = base.neighbors(node)
+                change = changes.get(node)
+                if change is not None:
+                    neighbors = sorted(set(neighbors) - change[1] | change[0])
+                sources.extend([node] * len(neighbors))
+                targets.extend(neighbors)
+            out = build_csr(sources, targets, size)
+            incoming = build_csr(targets, sources, size)
+        except BaseException:
+            with self._lock:
+                self._compacting = None
+            raise
+
+        with self._lock:
+            touched = {edge: self._has_edge(*edge) for edge in self._compacting}
+            self._compacting = None
+            self._out, self._in = out, incoming
+            self._added.clear()
+            self._removed.clear()
+            self._out_delta.clear()
+            self._in_delta.clear()
+            for edge, present in touched.items():
+                if present != self._in_base(*edge):
+                    if present:
+                        self._added[edge] = None
+                    else:
+                        self._removed.add(edge)
+                    self._touch(*edge)
+
+    def _has_edge(self, follower: int, followed: int) -> bool:
+        """Есть ли ребро с учётом наложения (вызывается под блокировкой)"""
+        edge = (follower, followed)
+        if edge in self._added:
+            return True
+        if edge in self._removed:
+            return False
+        return self._in_base(follower, followed)
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            return {
+                "users": len(self._out.offsets) - 1,
+                "edges": len(self._out.targets) + len(self._added) - len(self._removed),
+                "bytes": self._out.nbytes + self._in.nbytes,
+                "pending_changes": len(self._added) + len(self._removed),
+            }
+
+
+def load_edges(conn, batch_size: int = 100_000) -> FollowGraph:
+    """
+    Читает таблицу followers серверным курсором пакетами по batch_size
+    строк и строит граф; в памяти Python не держится список всех рёбер
+    """
+    followers, followed = array("i"), array("i")
+    with conn.cursor(name="follow_graph_load") as cursor:
+        cursor.itersize = batch_size
+        cursor.execute(
+            """
+            SELECT follower_id, followed_id
+            FROM followers
+            WHERE follower_id <> followed_id
+            ORDER BY follower_id, followed_id
+            """
+        )
+        for follower, target in cursor:
+            followers.append(follower)
+            followed.append(target)
+    conn.rollback()
+    return FollowGraph(followers, followed)
+
+
+class FollowGraphIndex:
+    """
+    Текущий граф процесса: загружается при первом обращении и
+    перезагружается в фоне раз в refresh секунд (старый граф отвечает,
+    пока строится новый). Подписки, сделанные во время перезагрузки,
+    повторяются на новом графе
+    """
+
+    def __init__(self, loader: Callable[[], FollowGraph], refresh: float = 300):
+        self.loader = loader
+        self.refresh = refresh
+        self._graph: Optional[FollowGraph] = None
+        self._loaded_at = 0.0
+        self._journal: Optional[List[Tuple[bool, int, int]]] = None
+        self._lock = threading.Lock()
+
+    def get(self) -> FollowGraph:
+        graph = self._graph
+        if graph is None:
+            with self._lock:
+                if self._graph is None:
+                    self._graph = self.loader()
+                    self._loaded_at = time.monotonic()
+                return self._graph
+        if self.refresh > 0 and time.monotonic() - self._loaded_at > self.refresh:
+            self._start_reload()
+        return graph
+
+    def _start_reload(self) -> None:
+        with self._lock:
+            if self._journal is not None:
+                return
+            self._journal = []
+            self._loaded_at = time.monotonic()
+        threading.Thread(target=self._reload, name="follow-graph-reload", daemon=True).start()
+
+    def _reload(self) -> None:
+        try:
+            graph = self.loader()
+        except Exception as e:
+            print(f"Не удалось перезагрузить граф подписок: {e}")
+            with self._lock:
+                self._journal = None
+            return
+        with self._lock:
+            for followed, follower, target in self._journal:
+                if followed:
+                    graph.follow(follower, target)
+                else:
+                    graph.unfollow(follower, target)
+            self._graph = graph
+            self._journal = None
+
+    def follow(self, follower: int, followed: int) -> None:
+        self._apply(True, follower, followed)
+
+    def unfollow(self, follower: int, followed: int) -> None:
+        self._apply(False, follower, followed)
+
+    def _apply(self, followed: bool, follower: int, target: int) -> None:
+        with self._lock:
+            graph = self._graph
+            if graph is None:
+                return
+            if self._journal is not None:
+                self._journal.append((followed, follower, target))
+        if followed:
+            graph.follow(follower, target)
+        else:
+            graph.unfollow(follower, target)
+
+    def stats(self) -> Dict[str, float]:
+        graph = self._graph
+        result = graph.stats() if graph is not None else {}
+        result["loaded"] = int(graph is not None)
+        result["age_seconds"] = time.monotonic() - self._loaded_at if graph else 0
+        return result
@@ -0,0 +1,201 @@
+"""
+Фоновые задачи на очереди в PostgreSQL (таблица jobs).
+
+Задача ставится enqueue_job в той же транзакции, что и изменение, ради
+которого она нужна, поэтому не теряется и не выполняется для отменённой
+транзакции. JobWorker забирает задачи пачками (FOR UPDATE SKIP LOCKED,
+несколько воркеров не мешают друг другу) и выполняет их в пуле потоков.
+Забранная задача невидима для других воркеров JOB_VISIBILITY_TIMEOUT
+секунд: если процесс упал, задачу после этого заберёт другой. Ошибка
+возвращает задачу в очередь с экспоненциальной задержкой от
+JOB_RETRY_DELAY; после max_attempts попыток задача остаётся в статусе
+failed. Обработчики должны быть идемпотентны: после тайм-аута видимости
+задача может выполниться дважды.
+
+Воркер запускается отдельным процессом (python manage.py jobs) или
+потоками внутри процесса приложения (JOB_WORKERS > 0).
+"""
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional
+
+from database import (
+    claim_jobs,
+    complete_job,
+    fail_job,
+    get_media_file,
+    referenced_files,
+    save_media_info,
+)
+from media_processing import image_info, make_preview
+
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", 0))
+JOB_VISIBILITY_TIMEOUT = float(os.environ.get("JOB_VISIBILITY_TIMEOUT", 60))
+JOB_POLL_INTERVAL = float(os.environ.get("JOB_POLL_INTERVAL", 1))
+JOB_RETRY_DELAY = float(os.environ.get("JOB_RETRY_DELAY", 5))
+# Файл, который использовали позже этого числа секунд назад, files.delete не трогает
+FILE_DELETE_GRACE = float(os.environ.get("FILE_DELETE_GRACE", 300))
+
+# Обработчики по виду задачи: kind -> функция от payload
+handlers: Dict[str, Callable[[Dict], None]] = {}
+
+
+def handler(kind: str) -> Callable:
+    """Регистрирует функцию как обработчик задач вида kind"""
+
+    def register(function: Callable[[Dict], None]) -> Callable[[Dict], None]:
+        handlers[kind] = function
+        return function
+
+    return register
+
+
+class PermanentError(Exception):
+    """Ошибка, после которой повторять задачу бессмысленно"""
+
+
+class JobWorker:
+    def __init__(
+        self,
+        workers: int = 4,
+        kinds: Optional[List[str]] = None,
+        visibility: float = JOB_VISIBILITY_TIMEOUT,
+        poll_interval: float = JOB_POLL_INTERVAL,
+        retry_delay: float = JOB_RETRY_DELAY,
+    ):
+        self.workers = workers
+        self.kinds = kinds
+        self.visibility = visibility
+        self.poll_interval = poll_interval
+        self.retry_delay = retry_delay
+        self._executor = ThreadPoolExecutor(workers, thread_name_prefix="job")
+        self._slots = threading.Semaphore(workers)
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def execute(self, job_id: int, kind: str, payload: Dict, attempt: int) -> bool:
+        """Выполняет одну забранную задачу; True — если успешно"""
+        function = handlers.get(kind)
+        try:
+            if function is None:
+                raise PermanentError(f"Нет обработчика задач {kind}")
+            function(payload)
+        except Exception as e:
+            print(f"Задача {job_id} ({kind}), попытка {attempt}: {e}")
+            fail_job(
+                job_id,
+                attempt,
+                f"{type(e).__name__}: {e}",
+                self.retry_delay,
+                final=isinstance(e, PermanentError),
+            )
+            return False
+        complete_job(job_id, attempt)
+        return True
+
+    def run_once(self) -> int:
+        """
+        Забирает до workers задач, выполняет их и ждёт завершения.
+        Возвращает число забранных задач
+        """
+        jobs = claim_jobs(self.workers, self.visibility, self.kinds)
+        futures = [self._executor.submit(self.execute, *job) for job in jobs]
+        for future in futures:
+            future.result()
+        return len(jobs)
+
+    def start(self) -> None:
+        """Запускает цикл опроса очереди в фоновом потоке"""
+        if self._thread is None:
+            self._thread = threading.Thread(
+                target=self._run, name="job-poller", daemon=True
+            )
+            self._thread.start()
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            # Забирается столько задач, сколько свободных потоков
+            if not self._slots.acquire(timeout=self.poll_interval):
+                continue
+            free = 1
+            while free < self.workers and self._slots.acquire(blocking=False):
+                free += 1
+            try:
+                jobs = claim_jobs(free, self.visibility, self.kinds)
+            except Exception as e:
+                print(f"Не удалось забрать задачи: {e}")
+                jobs = []
+            for _ in range(free - len(jobs)):
+                self._slots.release()
+            for job in jobs:
+                self._executor.submit(self._execute_slot, job)
+            if not jobs:
+                self._stop.wait(self.poll_interval)
+
+    def _execute_slot(self, job) -> None:
+        try:
+            self.execute(*job)
+        except Exception as e:
+            # Не удалось записать результат: задачу вернёт тайм-аут видимости
+            print(f"Задача {job[0]} ({job[1]}) не завершена: {e}")
+        finally:
+            self._slots.release()
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        """Перестаёт забирать задачи и дожидается уже начатых"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        self._executor.shutdown(wait=True)
+
+
+@handler("media.process")
+def process_media(payload: Dict) -> None:
+    """Размеры и сведения заголовка изображения и превью (media_processing.py)"""
+    media_id = payload["media_id"]
+    row = get_media_file(media_id)
+    if row is None:
+        # Медиафайл удалён раньше, чем до него дошла очередь
+        return
+    path, _ = row
+    try:
+        info = image_info(path)
+    except ValueError as e:
+        save_media_info(media_id, {"error": str(e)})
+        return
+    try:
+        preview = make_preview(path)
+    except ValueError as e:
+        # Заголовок разобран, но само изображение испорчено
+        info["preview_error"] = str(e)
+        preview = None
+    save_media_info(media_id, info, preview)
+
+
+@handler("files.delete")
+def delete_files(payload: Dict) -> None:
+    """
+    Удаляет файлы удалённых вложений. Файл остаётся, если на него снова
+    ссылается строка media или его недавно использовали (store_upload
+    обновляет mtime, когда то же содержимое загружают ещё раз, ещё до
+    записи строки media). Файл сначала переименовывается: загрузка, которая
+    придёт после этого, не найдёт его и положит свою копию, а загрузка,
+    успевшая раньше, видна по mtime — тогда файл возвращается на место
+    """
+    paths = payload["paths"]
+    keep = referenced_files(paths)
+    for path in paths:
+        if path in keep:
+            continue
+        doomed = path + ".deleting"
+        try:
+            os.rename(path, doomed)
+        except FileNotFoundError:
+            continue
+        recent = time.time() - os.stat(doomed).st_mtime < FILE_DELETE_GRACE
+        if recent or referenced_files([path]):
+            os.replace(doomed, path)
+        else:
+            os.unlink(doomed)
@@ -0,0 +1,166 @@
+"""
+Отложенная запись лайков (write-behind).
+
+Лайки и снятия лайков складываются в буфер процесса: для каждой пары
+(пользователь, твит) хранится только последнее намерение, так что частые
+переключения одного пользователя схлопываются. Фоновый поток записывает
+буфер одной транзакцией через interval секунд после первого намерения или
+сразу, когда накопилось max_ops пар; счётчик твита меняется один раз за
+пачку, а не на каждый клик.
+
+Записи идут строго по очереди (одна пачка за раз), поэтому более позднее
+намерение никогда не попадёт в БД раньше более раннего. flush(user_id)
+записывает намерения одного пользователя — его вызывают перед чтениями
+этого пользователя, чтобы он видел свои лайки. close() при завершении
+процесса дописывает всё, что осталось. Пачка, которую не удалось
+записать, возвращается в буфер (если пара не успела измениться)
+и пишется со следующей; намерения, не записавшиеся и во второй раз,
+отбрасываются.
+"""
+import threading
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+# (tweet_id, user_id, liked) — в порядке tweet_id, чтобы блокировки
+# строк брались в одном порядке
+Intent = Tuple[int, int, bool]
+
+
+class LikeBuffer:
+    def __init__(
+        self,
+        write: Callable[[List[Intent]], object],
+        interval: float = 0.005,
+        max_ops: int = 500,
+    ):
+        self.write = write
+        self.interval = interval
+        self.max_ops = max_ops
+        self._pending: Dict[int, Dict[int, bool]] = {}
+        self._size = 0
+        # Пары, которые уже один раз не удалось записать
+        self._failed: Set[Tuple[int, int]] = set()
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._full = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._closed = False
+        self._stats = {
+            "intents": 0,
+            "collapsed": 0,
+            "flushes": 0,
+            "flushed_intents": 0,
+            "errors": 0,
+            "dropped": 0,
+        }
+
+    def add(self, user_id: int, tweet_id: int, liked: bool) -> None:
+        """Запоминает намерение; после close() пишет его сразу"""
+        with self._lock:
+            closed = self._closed
+            if not closed:
+                intents = self._pending.setdefault(user_id, {})
+                self._stats["intents"] += 1
+                if tweet_id in intents:
+                    self._stats["collapsed"] += 1
+                else:
+                    self._size += 1
+                intents[tweet_id] = liked
+                full = self._size >= self.max_ops
+                if self._thread is None:
+                    # Поток запускается при первом лайке, уже в процессе-воркере
+                    self._thread = threading.Thread(
+                        target=self._run, name="like-buffer", daemon=True
+                    )
+                    self._thread.start()
+        if closed:
+            with self._flush_lock:
+                self.write([(tweet_id, user_id, liked)])
+            return
+        self._wakeup.set()
+        if full:
+            self._full.set()
+
+    def has_pending(self, user_id: int) -> bool:
+        return user_id in self._pending
+
+    def flush(self, user_id: Optional[int] = None) -> int:
+        """
+        Записывает намерения пользователя (без аргумента — все).
+        Ждёт, пока допишется пачка, уже начатая фоновым потоком.
+        Возвращает число записанных пар
+        """
+        with self._flush_lock:
+            with self._lock:
+                if user_id is None:
+                    batch, self._pending, self._size = self._pending, {}, 0
+                else:
+                    intents = self._pending.pop(user_id, None)
+                    batch = {user_id: intents} if intents else {}
+                    self._size -= len(intents or ())
+            if not batch:
+                return 0
+            intents = sorted(
+                (tweet_id, user, liked)
+                for user, tweets in batch.items()
+                for tweet_id, liked in tweets.items()
+            )
+            try:
+                self.write(intents)
+            except Exception as e:
+                print(f"Не удалось записать лайки ({len(intents)}): {e}")
+                self._requeue(intents)
+                return 0
+            with self._lock:
+                self._stats["flushes"] += 1
+                self._stats["flushed_intents"] += len(intents)
+                if self._failed:
+                    for tweet_id, user, _ in intents:
+                        self._failed.discard((user, tweet_id))
+            return len(intents)
+
+    def _requeue(self, intents: List[Intent]) -> None:
+        """Возвращает незаписанную пачку; более новые намерения важнее"""
+        with self._lock:
+            self._stats["errors"] += 1
+            for tweet_id, user_id, liked in intents:
+                key = (user_id, tweet_id)
+                if key in self._failed:
+                    self._failed.discard(key)
+                    self._stats["dropped"] += 1
+                    continue
+                pending = self._pending.setdefault(user_id, {})
+                if tweet_id not in pending:
+                    pending[tweet_id] = liked
+                    self._size += 1
+                    self._failed.add(key)
+
+    def _run(self) -> None:
+        while True:
+            self._wakeup.wait()
+            if self._closed:
+                return
+            # Окно сбора пачки: interval секунд или до max_ops пар
+            self._full.wait(self.interval)
+            if self._closed:
+                return
+            self._wakeup.clear()
+            self._full.clear()
+            self.flush()
+
+    def close(self) -> None:
+        """Останавливает фоновый поток и дописывает буфер"""
+        with self._lock:
+            self._closed = True
+            thread = self._thread
+        self._wakeup.set()
+        self._full.set()
+        if thread is not None:
+            thread.join(timeout=5)
+        self.flush()
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            result = dict(self._stats)
+            result["pending"] = self._size
+        return result
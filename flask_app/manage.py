@@ -0,0 +1,132 @@
+"""
+Команды обслуживания приложения:
+
+    python manage.py reconcile-likes
+    python manage.py reconcile-follows
+    python manage.py seed --users 100000 --seed 1
+    python manage.py jobs --workers 4
+"""
+import argparse
+import time
+
+from database import reconcile_follow_counts, reconcile_like_counts, retry_failed_jobs
+from jobs import JobWorker
+from seed import SeedConfig, seed_database
+
+
+def reconcile_likes(args: argparse.Namespace) -> None:
+    """Пересчитать счётчики лайков твитов по таблице likes"""
+    fixed = reconcile_like_counts()
+    print(f"Исправлено счётчиков лайков: {fixed}")
+
+
+def reconcile_follows(args: argparse.Namespace) -> None:
+    """Пересчитать счётчики подписчиков и подписок по таблице followers"""
+    fixed = reconcile_follow_counts()
+    print(f"Исправлено счётчиков подписок: {fixed}")
+
+
+def seed(args: argparse.Namespace) -> None:
+    """Сгенерировать и загрузить синтетические данные"""
+    config = SeedConfig(
+        users=args.users,
+        follows=args.follows,
+        follow_skew=args.follow_skew,
+        tweets=args.tweets,
+        likes=args.likes,
+        like_skew=args.like_skew,
+        media_ratio=args.media_ratio,
+        seed=args.seed,
+    )
+    started = time.monotonic()
+    loaded = seed_database(config, verbose=True)
+    print(f"Загружено за {time.monotonic() - started:.1f} с: {loaded}")
+
+
+def jobs(args: argparse.Namespace) -> None:
+    """Выполнять фоновые задачи из очереди jobs"""
+    if args.retry_failed:
+        print(f"Возвращено в очередь задач: {retry_failed_jobs(args.kind)}")
+        return
+    kinds = [args.kind] if args.kind else None
+    worker = JobWorker(args.workers, kinds)
+    if args.once:
+        # Пока очередь не опустеет (задачи, отложенные на будущее, не ждём)
+        total = 0
+        while True:
+            claimed = worker.run_once()
+            if not claimed:
+                break
+            total += claimed
+        worker.stop()
+        print(f"Выполнено задач: {total}")
+        return
+    worker.start()
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        worker.stop()
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description="Обслуживание twitter-clone")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    command = commands.add_parser("reconcile-likes", help=reconcile_likes.__doc__)
+    command.set_defaults(handler=reconcile_likes)
+
+    command = commands.add_parser("reconcile-follows", help=reconcile_follows.__doc__)
+    command.set_defaults(handler=reconcile_follows)
+
+    defaults = SeedConfig()
+    command = commands.add_parser("seed", help=seed.__doc__)
+    command.add_argument("--users", type=int, default=defaults.users)
+    command.add_argument(
+        "--follows", type=float, default=defaults.follows, help="среднее число подписок"
+    )
+    command.add_argument(
+        "--follow-skew",
+        type=float,
+        default=defaults.follow_skew,
+        help="показатель степенного закона популярности авторов",
+    )
+    command.add_argument(
+        "--tweets", type=float, default=defaults.tweets, help="среднее число твитов"
+    )
+    command.add_argument(
+        "--likes", type=float, default=defaults.likes, help="среднее число лайков"
+    )
+    command.add_argument(
+        "--like-skew",
+        type=float,
+        default=defaults.like_skew,
+        help="показатель степенного закона популярности твитов",
+    )
+    command.add_argument(
+        "--media-ratio", type=float, default=defaults.media_ratio, help="доля твитов с картинкой"
+    )
+    command.add_argument("--seed", type=int, default=defaults.seed)
+    command.set_defaults(handler=seed)
+
+    command = commands.add_parser("jobs", help=jobs.__doc__)
+    command.add_argument("--workers", type=int, default=4, help="число потоков")
+    command.add_argument("--kind", help="только задачи этого вида")
+    command.add_argument(
+        "--once", action="store_true", help="разобрать очередь и завершиться"
+    )
+    command.add_argument(
+        "--retry-failed",
+        action="store_true",
+        help="вернуть задачи в статусе failed в очередь",
+    )
+    command.set_defaults(handler=jobs)
+
+    args = parser.parse_args(argv)
+    args.handler(args)
+
+
+if __name__ == "__main__":
+    main()
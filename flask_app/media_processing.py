@@ -0,0 +1,193 @@
+"""
+Обработка загруженных медиафайлов вне HTTP-запроса (задача media.process).
+
+Размеры и прочие сведения читаются из заголовка файла без декодирования
+изображения: JPEG (маркер SOFn и ориентация из EXIF), PNG (IHDR), GIF
+(логический экран) и WebP (VP8, VP8L, VP8X). Превью строится Pillow
+(есть в requirements.txt): вписывается в квадрат MEDIA_PREVIEW_SIZE точек
+и сохраняется JPEG-файлом рядом с оригиналом. Если Pillow не установлен,
+превью не строится, остальные сведения заполняются.
+"""
+import os
+import struct
+import tempfile
+from typing import BinaryIO, Dict, Optional, Union
+
+MEDIA_PREVIEW_SIZE = int(os.environ.get("MEDIA_PREVIEW_SIZE", 320))
+
+Info = Dict[str, Union[int, str, bool]]
+
+# Маркеры JPEG с размерами кадра: SOF0..SOF15, кроме DHT, JPG и DAC
+_JPEG_SOF = set(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+# Маркеры без сегмента данных (без двух байт длины)
+_JPEG_STANDALONE = set(range(0xD0, 0xDA)) | {0x01}
+
+
+def image_info(path: str) -> Info:
+    """
+    Формат, ширина и высота изображения и сведения заголовка.
+    ValueError — если заголовок не разобран
+    """
+    with open(path, "rb") as f:
+        head = f.read(32)
+        if head.startswith(b"\xff\xd8"):
+            f.seek(2)
+            return _jpeg_info(f)
+        if head.startswith(b"\x89PNG\r\n\x1a\n") and head[12:16] == b"IHDR":
+            width, height, depth, color = struct.unpack(">IIBB", head[16:26])
+            return {
+                "format": "png",
+                "width": width,
+                "height": height,
+                "bit_depth": depth,
+                "alpha": color in (4, 6),
+                "interlaced": bool(head[28]),
+            }
+        if head[:6] in (b"GIF87a", b"GIF89a"):
+            width, height = struct.unpack("<HH", head[6:10])
+            return {"format": "gif", "width": width, "height": height}
+        if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+            return _webp_info(head)
+    raise ValueError("Неизвестный формат изображения")
+
+
+def _jpeg_info(f: BinaryIO) -> Info:
+    """Идёт по сегментам JPEG до первого SOFn"""
+    info: Info = {"format": "jpeg"}
+    while True:
+        byte = f.read(1)
+        if not byte:
+            raise ValueError("В JPEG нет маркера SOF")
+        if byte != b"\xff":
+            continue
+        marker = f.read(1)
+        while marker == b"\xff":
+            marker = f.read(1)
+        if not marker:
+            raise ValueError("В JPEG нет маркера SOF")
+        code = marker[0]
+        if code in _JPEG_STANDALONE or code == 0x00:
+            continue
+        length_bytes = f.read(2)
+        if len(length_bytes) < 2:
+            raise ValueError("Обрезанный сегмент JPEG")
+        length = struct.unpack(">H", length_bytes)[0] - 2
+        if code in _JPEG_SOF:
+            segment = f.read(length)
+            if len(segment) < 6:
+                raise ValueError("Обрезанный сегмент SOF")
+            height, width = struct.unpack(">HH", segment[1:5])
+            info.update(
+                width=width,
+                height=height,
+                components=segment[5],
+                progressive=code in (0xC2, 0xC6, 0xCA, 0xCE),
+            )
+            return info
+        if code == 0xE1 and "orientation" not in info:
+            orientation = _exif_orientation(f.read(length))
+            if orientation:
+                info["orientation"] = orientation
+        else:
+            f.seek(length, os.SEEK_CUR)
+
+
+def _exif_orientation(segment: bytes) -> Optional[int]:
+    """Тег Orientation (0x0112) из нулевого IFD сегмента APP1 Exif"""
+    if not segment.startswith(b"Exif\x00\x00"):
+        return None
+    tiff = segment[6:]
+    if tiff[:2] == b"II":
+        order = "<"
+    elif tiff[:2] == b"MM":
+        order = ">"
+    else:
+        return None
+    try:
+        offset = struct.unpack(order + "I", tiff[4:8])[0]
+        (count,) = struct.unpack(order + "H", tiff[offset : offset + 2])
+        for index in range(count):
+            entry = offset + 2 + index * 12
+            tag, kind = struct.unpack(order + "HH", tiff[entry : entry + 4])
+            if tag == 0x0112 and kind == 3:
+                return struct.unpack(order + "H", tiff[entry + 8 : entry + 10])[0]
+    except struct.error:
+        return None
+    return None
+
+
+def _webp_info(head: bytes) -> Info:
+    chunk = head[12:16]
+    if chunk == b"VP8 " and head[23:26] == b"\x9d\x01\x2a":
+        width, height = struct.unpack("<HH", head[26:30])
+        return {"format": "webp", "width": width & 0x3FFF, "height": height & 0x3FFF}
+    if chunk == b"VP8L" and head[20] == 0x2F:
+        bits = struct.unpack("<I", head[21:25])[0]
+        return {
+            "format": "webp",
+            "width": (bits & 0x3FFF) + 1,
+            "height": ((bits >> 14) & 0x3FFF) + 1,
+            "alpha": bool(bits >> 28 & 1),
+        }
+    if chunk == b"VP8X":
+        flags = head[20]
+        width = int.from_bytes(head[24:27], "little") + 1
+        height = int.from_bytes(head[27:30], "little") + 1
+        return {
+            "format": "webp",
+            "width": width,
+            "height": height,
+            "alpha": bool(flags & 0x10),
+            "animated": bool(flags & 0x02),
+        }
+    raise ValueError("Неизвестный вариант WebP")
+
+
+def preview_path(path: str) -> str:
+    """Путь превью: рядом с оригиналом, <sha256>.preview.jpg"""
+    return os.path.splitext(path)[0] + ".preview.jpg"
+
+
+def make_preview(path: str, size: int = MEDIA_PREVIEW_SIZE) -> Optional[str]:
+    """
+    Уменьшенная копия изображения (первый кадр, с учётом ориентации EXIF).
+    Возвращает путь к превью или None, если Pillow не установлен.
+    ValueError — если Pillow не смог декодировать файл (повтор не поможет)
+    """
+    try:
+        from PIL import Image, ImageOps
+    except ImportError:
+        return None
+
+    target = preview_path(path)
+    try:
+        # Файлы хранятся по хешу содержимого: превью уже построено
+        # (mtime обновляется, как у оригинала при повторной загрузке)
+        os.utime(target)
+        return target
+    except FileNotFoundError:
+        pass
+    try:
+        with Image.open(path) as original:
+            image = ImageOps.exif_transpose(original)
+            image.thumbnail((size, size))
+            if image.mode != "RGB":
+                image = image.convert("RGB")
+    except FileNotFoundError:
+        raise
+    except (OSError, Image.DecompressionBombError) as e:
+        raise ValueError(f"Не удалось декодировать изображение: {e}") from e
+    # Уникальное имя: превью одного файла могут строить несколько потоков
+    fd, temporary = tempfile.mkstemp(
+        dir=os.path.dirname(target), prefix=".preview-", suffix=".tmp"
+    )
+    try:
+        with os.fdopen(fd, "wb") as f:
+            image.save(f, "JPEG", quality=85)
+        os.chmod(temporary, 0o644)
+        os.replace(temporary, target)
+    except BaseException:
+        if os.path.exists(temporary):
+            os.unlink(temporary)
+        raise
+    return target
@@ -0,0 +1,244 @@
+"""
+Версионные миграции схемы БД.
+
+Миграции лежат в каталоге migrations/ в файлах NNNN_описание.py. В каждом
+файле есть функция upgrade(conn) и флаг TRANSACTIONAL. Транзакционная
+миграция выполняется в одной транзакции вместе с записью в schema_migrations.
+Нетранзакционная (CREATE INDEX CONCURRENTLY, пакетное заполнение) работает
+в autocommit и должна быть идемпотентной, чтобы её можно было перезапустить
+после сбоя.
+
+    python migrate.py upgrade [--target N] [--wait 30]
+    python migrate.py current
+    python migrate.py history
+"""
+import argparse
+import importlib.util
+import os
+import re
+import time
+from typing import List, NamedTuple, Optional
+
+import psycopg2
+import psycopg2.errors
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "migrations")
+
+# Ключ advisory lock, чтобы миграции не запускались параллельно из нескольких процессов
+LOCK_KEY = 7_240_001
+
+# Сколько ждать блокировку таблицы для DDL, прежде чем сдаться и повторить
+LOCK_TIMEOUT = "5s"
+# Сколько раз повторять миграцию, не дождавшуюся блокировки, и пауза перед
+# первым повтором (дальше удваивается), секунды
+LOCK_RETRIES = 5
+LOCK_RETRY_DELAY = 1.0
+
+
+class Migration(NamedTuple):
+    version: int
+    name: str
+    module: object
+
+
+def discover(directory: str = MIGRATIONS_DIR) -> List[Migration]:
+    """Список миграций из каталога, упорядоченный по версии"""
+    migrations = []
+    for filename in sorted(os.listdir(directory)):
+        match = re.fullmatch(r"(\d{4})_(\w+)\.py", filename)
+        if not match:
+            continue
+        spec = importlib.util.spec_from_file_location(
+            f"migrations.m{match.group(1)}", os.path.join(directory, filename)
+        )
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        migrations.append(Migration(int(match.group(1)), match.group(2), module))
+    return migrations
+
+
+def ensure_version_table(conn) -> None:
+    with conn.cursor() as cursor:
+        cursor.execute(
+            """
+            CREATE TABLE IF NOT EXISTS schema_migrations
+            (version INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            applied_at TIMESTAMPTZ NOT NULL DEFAULT now())
+            """
+        )
+    conn.commit()
+
+
+def applied_versions(conn) -> List[int]:
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT version FROM schema_migrations ORDER BY version")
+        versions = [row[0] for row in cursor.fetchall()]
+    conn.commit()
+    return versions
+
+
+def current_version(conn) -> int:
+    """Версия схемы БД (0 — миграции не применялись)"""
+    ensure_version_table(conn)
+    versions = applied_versions(conn)
+    return versions[-1] if versions else 0
+
+
+def upgrade(conn, target: Optional[int] = None, verbose: bool = False) -> List[int]:
+    """
+    Применяет недостающие миграции (до версии target включительно).
+    Возвращает список применённых версий
+    """
+    ensure_version_table(conn)
+    autocommit = conn.autocommit
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT pg_advisory_lock(%s)", (LOCK_KEY,))
+    conn.commit()
+    applied = []
+    try:
+        done = set(applied_versions(conn))
+        for migration in discover():
+            if migration.version in done:
+                continue
+            if target is not None and migration.version > target:
+                break
+            if verbose:
+                print(f"Миграция {migration.version:04d} {migration.name}...")
+            for attempt in range(LOCK_RETRIES + 1):
+                try:
+                    apply(conn, migration)
+                    break
+                except psycopg2.errors.LockNotAvailable:
+                    # Транзакционная миграция откатилась целиком,
+                    # нетранзакционная идемпотентна: обе можно повторить
+                    if attempt == LOCK_RETRIES:
+                        raise
+                    delay = LOCK_RETRY_DELAY * 2**attempt
+                    print(
+                        f"Миграция {migration.version:04d} не дождалась блокировки, "
+                        f"повтор через {delay:g} с"
+                    )
+                    time.sleep(delay)
+                finally:
+                    conn.autocommit = autocommit
+            applied.append(migration.version)
+    finally:
+        with conn.cursor() as cursor:
+            cursor.execute("RESET lock_timeout")
+            cursor.execute("SELECT pg_advisory_unlock(%s)", (LOCK_KEY,))
+        conn.commit()
+    return applied
+
+
+def apply(conn, migration: Migration) -> None:
+    """Выполняет одну миграцию и записывает её версию в schema_migrations"""
+    transactional = getattr(migration.module, "TRANSACTIONAL", True)
+    conn.autocommit = not transactional
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("SET lock_timeout = %s", (LOCK_TIMEOUT,))
+        migration.module.upgrade(conn)
+        with conn.cursor() as cursor:
+            cursor.execute(
+                "INSERT INTO schema_migrations (version, name) VALUES (%s, %s)",
+                (migration.version, migration.name),
+            )
+        if transactional:
+            conn.commit()
+    except Exception:
+        if not conn.autocommit:
+            conn.rollback()
+        raise
+
+
+def create_index_concurrently(conn, name: str, definition: str) -> None:
+    """
+    CREATE INDEX CONCURRENTLY без долгой блокировки записи.
+    Невалидный индекс, оставшийся от прерванной попытки, пересоздаётся.
+    Соединение должно быть в режиме autocommit
+    """
+    with conn.cursor() as cursor:
+        cursor.execute(
+            "SELECT indisvalid FROM pg_index WHERE indexrelid = to_regclass(%s)",
+            (name,),
+        )
+        row = cursor.fetchone()
+        if row and row[0]:
+            return
+        if row:
+            cursor.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {name}")
+        cursor.execute(f"CREATE INDEX CONCURRENTLY {name} ON {definition}")
+
+
+def batched_range_update(
+    conn, statement: str, table: str, key: str, batch_size: int = 5000
+) -> int:
+    """
+    Выполняет statement для диапазонов ключа key таблицы table по batch_size
+    значений с коммитом после каждого: [lo, hi] передаются параметрами
+    %(lo)s и %(hi)s, и каждый пакет читает только строки своего диапазона
+    (по индексу), а не всю таблицу. Возвращает общее число изменённых строк
+    """
+    with conn.cursor() as cursor:
+        cursor.execute(f"SELECT MIN({key}), MAX({key}) FROM {table}")
+        low, high = cursor.fetchone()
+    if not conn.autocommit:
+        conn.commit()
+    total = 0
+    if low is None:
+        return total
+    for lo in range(low, high + 1, batch_size):
+        with conn.cursor() as cursor:
+            cursor.execute(statement, {"lo": lo, "hi": lo + batch_size - 1})
+            total += cursor.rowcount
+        if not conn.autocommit:
+            conn.commit()
+    return total
+
+
+def connect_with_retry(conn_func, wait: float):
+    """Подключение к БД с повторами: при старте контейнера PostgreSQL может быть ещё не готов"""
+    deadline = time.monotonic() + wait
+    while True:
+        try:
+            return conn_func()
+        except psycopg2.OperationalError:
+            if time.monotonic() >= deadline:
+                raise
+            time.sleep(1)
+
+
+def main(argv=None) -> None:
+    from database import main_connection
+
+    parser = argparse.ArgumentParser(description="Миграции схемы БД")
+    parser.add_argument(
+        "--wait", type=float, default=0, help="сколько секунд ждать готовности БД"
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+    command = commands.add_parser("upgrade", help="применить недостающие миграции")
+    command.add_argument("--target", type=int, help="последняя применяемая версия")
+    commands.add_parser("current", help="текущая версия схемы")
+    commands.add_parser("history", help="список миграций и их состояние")
+    args = parser.parse_args(argv)
+
+    conn = connect_with_retry(main_connection, args.wait)
+    try:
+        if args.command == "upgrade":
+            applied = upgrade(conn, args.target, verbose=True)
+            print(f"Применено миграций: {len(applied)}, версия схемы: {current_version(conn)}")
+        elif args.command == "current":
+            print(current_version(conn))
+        else:
+            ensure_version_table(conn)
+            done = set(applied_versions(conn))
+            for migration in discover():
+                mark = "x" if migration.version in done else " "
+                print(f"[{mark}] {migration.version:04d} {migration.name}")
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
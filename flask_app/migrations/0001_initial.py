@@ -0,0 +1,57 @@
+"""Исходная схема (как в models.py до появления миграций)"""
+
+TRANSACTIONAL = True
+
+
+def upgrade(conn):
+    with conn.cursor() as cursor:
+        cursor.execute(
+            """
+        CREATE TABLE IF NOT EXISTS users
+        (id SERIAL PRIMARY KEY,
+        name TEXT NOT NULL,
+        api_key TEXT NOT NULL UNIQUE)
+        """
+        )
+
+        cursor.execute(
+            """
+        CREATE TABLE IF NOT EXISTS tweets
+        (tweet_id SERIAL PRIMARY KEY,
+        tweet_data TEXT NOT NULL,
+        tweet_media_ids INTEGER,
+        api_key TEXT NOT NULL)
+        """
+        )
+
+        cursor.execute(
+            """
+        CREATE TABLE IF NOT EXISTS likes (
+        user_id INTEGER NOT NULL,
+        tweet_id INTEGER NOT NULL,
+        PRIMARY KEY(user_id, tweet_id),
+        FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE,
+        FOREIGN KEY (tweet_id) REFERENCES tweets(tweet_id) ON DELETE CASCADE)
+        """
+        )
+
+        cursor.execute(
+            """
+        CREATE TABLE IF NOT EXISTS followers
+        (follower_id INTEGER NOT NULL,
+        followed_id INTEGER NOT NULL,
+        PRIMARY KEY(follower_id, followed_id),
+        FOREIGN KEY (follower_id) REFERENCES users(id) ON DELETE CASCADE,
+        FOREIGN KEY (followed_id) REFERENCES users(id) ON DELETE CASCADE)
+        """
+        )
+
+        cursor.execute(
+            """
+        CREATE TABLE IF NOT EXISTS media
+        (id SERIAL PRIMARY KEY,
+        file_path TEXT NOT NULL,
+        api_key TEXT NOT NULL,
+        FOREIGN KEY (api_key) REFERENCES users(api_key) ON DELETE CASCADE)
+        """
+        )
@@ -0,0 +1,39 @@
+"""
+Счётчик лайков tweets.like_count, заполняется пакетами по диапазонам
+tweet_id: каждый пакет считает лайки только своих твитов. Для этого
+нужен индекс likes (tweet_id) — он строится здесь, до заполнения
+(0003 его уже не пересоздаёт)
+"""
+from migrate import batched_range_update, create_index_concurrently
+
+TRANSACTIONAL = False
+
+
+def upgrade(conn):
+    with conn.cursor() as cursor:
+        cursor.execute(
+            """
+        ALTER TABLE tweets
+        ADD COLUMN IF NOT EXISTS like_count INTEGER NOT NULL DEFAULT 0
+        """
+        )
+    create_index_concurrently(conn, "likes_tweet_id_idx", "likes (tweet_id)")
+
+    batched_range_update(
+        conn,
+        """
+        UPDATE tweets t
+        SET like_count = c.num_likes
+        FROM (
+            SELECT l.tweet_id, COUNT(*) AS num_likes
+            FROM likes l
+            WHERE l.tweet_id BETWEEN %(lo)s AND %(hi)s
+            GROUP BY l.tweet_id
+        ) c
+        WHERE t.tweet_id = c.tweet_id
+          AND t.tweet_id BETWEEN %(lo)s AND %(hi)s
+          AND t.like_count <> c.num_likes
+        """,
+        "tweets",
+        "tweet_id",
+    )
@@ -0,0 +1,16 @@
+"""
+Вторичные индексы для запросов из database.py.
+Первичные ключи likes (user_id, tweet_id) и followers (follower_id, followed_id)
+не помогают при поиске по второму столбцу
+"""
+from migrate import create_index_concurrently
+
+TRANSACTIONAL = False
+
+
+def upgrade(conn):
+    create_index_concurrently(
+        conn, "followers_followed_id_idx", "followers (followed_id, follower_id)"
+    )
+    create_index_concurrently(conn, "likes_tweet_id_idx", "likes (tweet_id)")
+    create_index_concurrently(conn, "media_api_key_idx", "media (api_key)")
@@ -0,0 +1,77 @@
+"""
+Целочисленный внешний ключ tweets.author_id вместо соединения по тексту api_key.
+
+Шаги рассчитаны на заполненную таблицу без долгих эксклюзивных блокировок:
+столбец добавляется без значения по умолчанию, заполняется пакетами,
+внешний ключ создаётся NOT VALID и проверяется отдельно, индекс строится
+CONCURRENTLY. Триггер заполняет author_id у строк, которые вставляет код,
+ещё не знающий о столбце. Индекс tweets (api_key), если его построила
+прежняя версия 0003, больше не нужен и удаляется
+"""
+from migrate import batched_range_update, create_index_concurrently
+
+TRANSACTIONAL = False
+
+
+def upgrade(conn):
+    with conn.cursor() as cursor:
+        cursor.execute("ALTER TABLE tweets ADD COLUMN IF NOT EXISTS author_id INTEGER")
+        cursor.execute(
+            """
+        CREATE OR REPLACE FUNCTION tweets_fill_author_id() RETURNS trigger AS $$
+        BEGIN
+            IF NEW.author_id IS NULL THEN
+                SELECT id INTO NEW.author_id FROM users WHERE api_key = NEW.api_key;
+            END IF;
+            RETURN NEW;
+        END;
+        $$ LANGUAGE plpgsql
+        """
+        )
+        cursor.execute("DROP TRIGGER IF EXISTS tweets_fill_author_id ON tweets")
+        cursor.execute(
+            """
+        CREATE TRIGGER tweets_fill_author_id
+        BEFORE INSERT ON tweets
+        FOR EACH ROW EXECUTE FUNCTION tweets_fill_author_id()
+        """
+        )
+
+    # Пакеты по диапазону tweet_id: каждый читает только свои строки по первичному ключу
+    batched_range_update(
+        conn,
+        """
+        UPDATE tweets t
+        SET author_id = u.id
+        FROM users u
+        WHERE u.api_key = t.api_key
+          AND t.tweet_id BETWEEN %(lo)s AND %(hi)s
+          AND t.author_id IS NULL
+        """,
+        "tweets",
+        "tweet_id",
+    )
+
+    with conn.cursor() as cursor:
+        cursor.execute(
+            """
+        SELECT 1 FROM pg_constraint
+        WHERE conname = 'tweets_author_id_fkey' AND conrelid = 'tweets'::regclass
+        """
+        )
+        if cursor.fetchone() is None:
+            cursor.execute(
+                """
+            ALTER TABLE tweets
+            ADD CONSTRAINT tweets_author_id_fkey
+            FOREIGN KEY (author_id) REFERENCES users(id) ON DELETE CASCADE
+            NOT VALID
+            """
+            )
+        cursor.execute("ALTER TABLE tweets VALIDATE CONSTRAINT tweets_author_id_fkey")
+
+    create_index_concurrently(
+        conn, "tweets_author_id_idx", "tweets (author_id, tweet_id DESC)"
+    )
+    with conn.cursor() as cursor:
+        cursor.execute("DROP INDEX CONCURRENTLY IF EXISTS tweets_api_key_idx")
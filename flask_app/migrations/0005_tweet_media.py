@@ -0,0 +1,43 @@
+"""
+Таблица tweet_media: вложения твита с порядком (position).
+Переносит вложения из tweets.tweet_media_ids и удаляет этот столбец
+"""
+
+TRANSACTIONAL = True
+
+
+def upgrade(conn):
+    with conn.cursor() as cursor:
+        cursor.execute(
+            """
+        CREATE TABLE IF NOT EXISTS tweet_media
+        (tweet_id INTEGER NOT NULL,
+        position SMALLINT NOT NULL,
+        media_id INTEGER NOT NULL,
+        PRIMARY KEY(tweet_id, position),
+        FOREIGN KEY (tweet_id) REFERENCES tweets(tweet_id) ON DELETE CASCADE,
+        FOREIGN KEY (media_id) REFERENCES media(id) ON DELETE CASCADE)
+        """
+        )
+        cursor.execute(
+            "CREATE INDEX IF NOT EXISTS tweet_media_media_id_idx ON tweet_media (media_id)"
+        )
+
+        cursor.execute(
+            """
+        SELECT 1 FROM information_schema.columns
+        WHERE table_schema = current_schema()
+          AND table_name = 'tweets' AND column_name = 'tweet_media_ids'
+        """
+        )
+        if cursor.fetchone():
+            cursor.execute(
+                """
+            INSERT INTO tweet_media (tweet_id, position, media_id)
+            SELECT t.tweet_id, 0, m.id
+            FROM tweets t
+            JOIN media m ON m.id = t.tweet_media_ids
+            ON CONFLICT DO NOTHING
+            """
+            )
+            cursor.execute("ALTER TABLE tweets DROP COLUMN tweet_media_ids")
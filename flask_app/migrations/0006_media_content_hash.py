@@ -0,0 +1,11 @@
+"""Хеш содержимого, размер и MIME-тип загруженных медиафайлов"""
+
+TRANSACTIONAL = True
+
+
+def upgrade(conn):
+    with conn.cursor() as cursor:
+        cursor.execute("ALTER TABLE media ADD COLUMN IF NOT EXISTS sha256 TEXT")
+        cursor.execute("ALTER TABLE media ADD COLUMN IF NOT EXISTS size_bytes BIGINT")
+        cursor.execute("ALTER TABLE media ADD COLUMN IF NOT EXISTS mime_type TEXT")
+        cursor.execute("CREATE INDEX IF NOT EXISTS media_sha256_idx ON media (sha256)")
@@ -0,0 +1,48 @@
+"""
+Счётчики подписок users.followers_count и users.following_count.
+Подписка на себя не считается. Заполняются пакетами по диапазонам users.id,
+дальше их поддерживает check_followers
+"""
+from migrate import batched_range_update
+
+TRANSACTIONAL = False
+
+
+def upgrade(conn):
+    with conn.cursor() as cursor:
+        cursor.execute(
+            """
+        ALTER TABLE users
+        ADD COLUMN IF NOT EXISTS followers_count INTEGER NOT NULL DEFAULT 0,
+        ADD COLUMN IF NOT EXISTS following_count INTEGER NOT NULL DEFAULT 0
+        """
+        )
+
+    # Пакеты по диапазону users.id, счётчики — коррелированными подзапросами
+    # по индексам followers (follower_id, ...) и (followed_id, ...)
+    batched_range_update(
+        conn,
+        """
+        UPDATE users u
+        SET followers_count = c.num_followers, following_count = c.num_following
+        FROM (
+            SELECT
+                u2.id,
+                (
+                    SELECT COUNT(*) FROM followers f
+                    WHERE f.followed_id = u2.id AND f.follower_id <> u2.id
+                ) AS num_followers,
+                (
+                    SELECT COUNT(*) FROM followers f
+                    WHERE f.follower_id = u2.id AND f.followed_id <> u2.id
+                ) AS num_following
+            FROM users u2
+            WHERE u2.id BETWEEN %(lo)s AND %(hi)s
+        ) c
+        WHERE u.id = c.id
+          AND (u.followers_count, u.following_count)
+              <> (c.num_followers, c.num_following)
+        """,
+        "users",
+        "id",
+    )
@@ -0,0 +1,19 @@
+"""
+Версия изменений пользователя users.change_version для условных GET.
+Значения берутся из общей последовательности, поэтому максимум версий
+набора пользователей растёт при любом изменении в этом наборе.
+Столбец с постоянным значением по умолчанию добавляется без перезаписи таблицы
+"""
+
+TRANSACTIONAL = True
+
+
+def upgrade(conn):
+    with conn.cursor() as cursor:
+        cursor.execute("CREATE SEQUENCE IF NOT EXISTS change_version_seq")
+        cursor.execute(
+            """
+        ALTER TABLE users
+        ADD COLUMN IF NOT EXISTS change_version BIGINT NOT NULL DEFAULT 0
+        """
+        )
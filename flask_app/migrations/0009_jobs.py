@@ -0,0 +1,36 @@
+"""
+Очередь фоновых задач jobs (см. jobs.py).
+Задача ждёт в статусе queued до run_at, воркер забирает её через
+FOR UPDATE SKIP LOCKED и держит в running до locked_until (тайм-аут
+видимости); после него задачу может забрать другой воркер.
+Выполненные задачи удаляются, неудачные после max_attempts попыток
+остаются в статусе failed с текстом последней ошибки
+"""
+
+TRANSACTIONAL = True
+
+
+def upgrade(conn):
+    with conn.cursor() as cursor:
+        cursor.execute(
+            """
+        CREATE TABLE IF NOT EXISTS jobs
+        (id BIGSERIAL PRIMARY KEY,
+        kind TEXT NOT NULL,
+        payload JSONB NOT NULL DEFAULT '{}',
+        status TEXT NOT NULL DEFAULT 'queued',
+        attempts INTEGER NOT NULL DEFAULT 0,
+        max_attempts INTEGER NOT NULL DEFAULT 5,
+        run_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+        locked_until TIMESTAMPTZ,
+        last_error TEXT,
+        created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+        CHECK (status IN ('queued', 'running', 'failed')))
+        """
+        )
+        cursor.execute(
+            """
+        CREATE INDEX IF NOT EXISTS jobs_pending_idx ON jobs (run_at, id)
+        WHERE status IN ('queued', 'running')
+        """
+        )
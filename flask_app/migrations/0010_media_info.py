@@ -0,0 +1,20 @@
+"""
+Сведения о медиафайле, которые заполняет фоновая задача media.process:
+размеры изображения, прочие данные заголовка (metadata) и путь к превью
+"""
+
+TRANSACTIONAL = True
+
+
+def upgrade(conn):
+    with conn.cursor() as cursor:
+        cursor.execute(
+            """
+        ALTER TABLE media
+        ADD COLUMN IF NOT EXISTS width INTEGER,
+        ADD COLUMN IF NOT EXISTS height INTEGER,
+        ADD COLUMN IF NOT EXISTS metadata JSONB,
+        ADD COLUMN IF NOT EXISTS preview_path TEXT,
+        ADD COLUMN IF NOT EXISTS processed_at TIMESTAMPTZ
+        """
+        )
@@ -0,0 +1,14 @@
+"""
+Индекс порядка ленты (число лайков, tweet_id). Страница ленты читается
+по нему диапазоном от позиции курсора и останавливается на LIMIT,
+видимость твита проверяется для каждой прочитанной строки
+"""
+from migrate import create_index_concurrently
+
+TRANSACTIONAL = False
+
+
+def upgrade(conn):
+    create_index_concurrently(
+        conn, "tweets_rank_idx", "tweets (like_count DESC, tweet_id DESC)"
+    )
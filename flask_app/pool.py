@@ -0,0 +1,194 @@
+import threading
+import time
+from typing import Callable, Dict, List
+
+import psycopg2
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE
+from psycopg2.pool import PoolError
+
+
+class PoolTimeout(PoolError):
+    """Не удалось получить соединение из пула за отведённое время"""
+
+
+class ConnectionPool:
+    """
+    Потокобезопасный пул соединений с PostgreSQL.
+
+    Держит не меньше minconn и не больше maxconn открытых соединений,
+    ждёт свободное соединение не дольше timeout секунд и перед выдачей
+    проверяет соединения, которые простаивали дольше check_interval.
+    Медленные операции (подключение, проверка) выполняются без блокировки пула.
+    """
+
+    def __init__(
+        self,
+        conn_func: Callable,
+        minconn: int = 1,
+        maxconn: int = 10,
+        timeout: float = 5.0,
+        check_interval: float = 30.0,
+    ):
+        if minconn < 0 or maxconn < 1 or minconn > maxconn:
+            raise ValueError(
+                f"Неверные границы пула: minconn={minconn}, maxconn={maxconn}"
+            )
+        self.conn_func = conn_func
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.check_interval = check_interval
+
+        self._lock = threading.Condition()
+        self._idle: List = []
+        self._last_used: Dict[int, float] = {}
+        self._in_use = set()
+        # Слоты, занятые соединениями, которые сейчас открываются или проверяются
+        self._reserved = 0
+        self._closed = False
+        self._stats = {
+            "created": 0,
+            "discarded": 0,
+            "checkouts": 0,
+            "waits": 0,
+            "timeouts": 0,
+            "health_checks": 0,
+            "max_wait_ms": 0.0,
+        }
+
+        for _ in range(minconn):
+            conn = self.conn_func()
+            self._stats["created"] += 1
+            self._last_used[id(conn)] = time.monotonic()
+            self._idle.append(conn)
+
+    def _discard(self, conn) -> None:
+        self._last_used.pop(id(conn), None)
+        self._stats["discarded"] += 1
+        if not conn.closed:
+            try:
+                conn.close()
+            except psycopg2.Error:
+                pass
+
+    def _needs_check(self, conn) -> bool:
+        idle_for = time.monotonic() - self._last_used.get(id(conn), 0.0)
+        return idle_for >= self.check_interval
+
+    @staticmethod
+    def _ping(conn) -> bool:
+        """Проверка соединения перед выдачей из пула"""
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def _reserve(self, deadline: float, started: float):
+        """
+        Занимает слот пула: возвращает свободное соединение или None,
+        если слот получен под новое соединение
+        """
+        waited = False
+        with self._lock:
+            while True:
+                if self._closed:
+                    raise PoolError("Пул соединений закрыт")
+                if self._idle:
+                    conn = self._idle.pop()
+                    break
+                if len(self._in_use) + self._reserved < self.maxconn:
+                    conn = None
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._stats["timeouts"] += 1
+                    raise PoolTimeout(
+                        f"Нет свободных соединений за {self.timeout:.1f} с "
+                        f"(maxconn={self.maxconn})"
+                    )
+                waited = True
+                self._lock.wait(remaining)
+            self._reserved += 1
+            if waited:
+                self._stats["waits"] += 1
+                wait_ms = (time.monotonic() - started) * 1000
+                self._stats["max_wait_ms"] = max(self._stats["max_wait_ms"], wait_ms)
+        return conn
+
+    def getconn(self):
+        """Выдаёт соединение из пула, при необходимости ждёт освобождения"""
+        started = time.monotonic()
+        deadline = started + self.timeout
+        while True:
+            conn = self._reserve(deadline, started)
+            try:
+                if conn is None:
+                    conn = self.conn_func()
+                    with self._lock:
+                        self._stats["created"] += 1
+                else:
+                    check = not conn.closed and self._needs_check(conn)
+                    healthy = not conn.closed and (not check or self._ping(conn))
+                    with self._lock:
+                        self._stats["health_checks"] += int(check)
+                        if not healthy:
+                            self._discard(conn)
+                            self._reserved -= 1
+                            self._lock.notify()
+                    if not healthy:
+                        continue
+            except BaseException:
+                with self._lock:
+                    self._reserved -= 1
+                    self._lock.notify()
+                raise
+
+            with self._lock:
+                self._reserved -= 1
+                self._in_use.add(id(conn))
+                self._stats["checkouts"] += 1
+            return conn
+
+    def putconn(self, conn, close: bool = False) -> None:
+        """Возвращает соединение в пул, откатывая незавершённую транзакцию"""
+        if not close and not conn.closed:
+            try:
+                if conn.info.transaction_status != TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+            except psycopg2.Error:
+                close = True
+
+        with self._lock:
+            self._in_use.discard(id(conn))
+            if close or conn.closed or self._closed:
+                self._discard(conn)
+            else:
+                self._last_used[id(conn)] = time.monotonic()
+                self._idle.append(conn)
+            self._lock.notify()
+
+    def closeall(self) -> None:
+        """Закрывает свободные соединения; занятые закроются при возврате"""
+        with self._lock:
+            self._closed = True
+            while self._idle:
+                self._discard(self._idle.pop())
+            self._lock.notify_all()
+
+    def stats(self) -> Dict[str, float]:
+        """Статистика пула для мониторинга"""
+        with self._lock:
+            result = dict(self._stats)
+            result.update(
+                {
+                    "minconn": self.minconn,
+                    "maxconn": self.maxconn,
+                    "idle": len(self._idle),
+                    "in_use": len(self._in_use),
+                    "size": len(self._idle) + len(self._in_use) + self._reserved,
+                }
+            )
+        return result
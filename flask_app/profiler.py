@@ -0,0 +1,167 @@
+"""
+Профилирование отдельных запросов по требованию.
+
+Запрос выполняется под cProfile, если пришёл заголовок X-Profile: 1
+вместе с правильным X-Admin-Token, или если он попал в выборку
+PROFILE_SAMPLE_RATE. Профилируется весь WSGI-вызов: SQL, сборка ответа
+в Python и сериализация JSON. Результат сохраняется в PROFILE_DIR
+(<id>.prof, формат pstats), id возвращается в заголовке X-Profile-Id.
+Хранится не больше PROFILE_MAX_FILES последних профилей.
+
+Без заголовка и с нулевой долей выборки обёртка только проверяет
+один ключ в environ и сразу вызывает приложение.
+"""
+import cProfile
+import hmac
+import io
+import json
+import os
+import pstats
+import random
+import re
+import threading
+import time
+import uuid
+from typing import Callable, Dict, List, Optional
+
+PROFILE_SAMPLE_RATE = float(os.environ.get("PROFILE_SAMPLE_RATE", 0))
+PROFILE_DIR = os.environ.get("PROFILE_DIR", "profiles")
+PROFILE_MAX_FILES = int(os.environ.get("PROFILE_MAX_FILES", 50))
+
+PROFILE_ID = re.compile(r"^[0-9a-f]{32}$")
+
+
+class RequestProfiler:
+    """WSGI-обёртка, которая запускает выбранные запросы под cProfile"""
+
+    def __init__(self, wsgi_app: Callable, flask_app):
+        self.wsgi_app = wsgi_app
+        self.flask_app = flask_app
+        flask_app.config.setdefault("PROFILE_SAMPLE_RATE", PROFILE_SAMPLE_RATE)
+        flask_app.config.setdefault("PROFILE_DIR", PROFILE_DIR)
+        flask_app.config.setdefault("PROFILE_MAX_FILES", PROFILE_MAX_FILES)
+        # cProfile не допускает два активных профилировщика одновременно
+        self._active = threading.Lock()
+        self._index_lock = threading.Lock()
+
+    def __call__(self, environ, start_response):
+        if "HTTP_X_PROFILE" in environ:
+            wanted = self._authorized(environ)
+        else:
+            rate = self.flask_app.config["PROFILE_SAMPLE_RATE"]
+            wanted = rate > 0 and random.random() < rate
+        if not wanted or not self._active.acquire(blocking=False):
+            return self.wsgi_app(environ, start_response)
+        try:
+            return self._profile(environ, start_response)
+        finally:
+            self._active.release()
+
+    def _authorized(self, environ) -> bool:
+        expected = self.flask_app.config.get("ADMIN_TOKEN")
+        token = environ.get("HTTP_X_ADMIN_TOKEN", "")
+        return (
+            environ.get("HTTP_X_PROFILE") == "1"
+            and bool(expected)
+            and hmac.compare_digest(token, expected)
+        )
+
+    def _profile(self, environ, start_response):
+        profile_id = uuid.uuid4().hex
+        captured = {}
+
+        def capture_start_response(status, headers, exc_info=None):
+            headers = list(headers) + [("X-Profile-Id", profile_id)]
+            captured["status"] = status
+            return start_response(status, headers, exc_info)
+
+        profile = cProfile.Profile()
+        started = time.perf_counter()
+        profile.enable()
+        try:
+            response = self.wsgi_app(environ, capture_start_response)
+            try:
+                body = list(response)
+            finally:
+                if hasattr(response, "close"):
+                    response.close()
+        finally:
+            profile.disable()
+            duration = time.perf_counter() - started
+            self._save(profile, profile_id, environ, captured.get("status"), duration)
+        return body
+
+    def _route(self, environ) -> str:
+        try:
+            rule, _ = self.flask_app.url_map.bind_to_environ(environ).match(
+                return_rule=True
+            )
+            return rule.rule
+        except Exception:
+            return "unmatched"
+
+    def _save(self, profile, profile_id: str, environ, status, duration: float) -> None:
+        directory = self.flask_app.config["PROFILE_DIR"]
+        meta = {
+            "id": profile_id,
+            "route": self._route(environ),
+            "method": environ.get("REQUEST_METHOD"),
+            "path": environ.get("PATH_INFO"),
+            "request_id": environ.get("HTTP_X_REQUEST_ID"),
+            "status": status,
+            "duration_ms": round(duration * 1000, 3),
+            "created": time.time(),
+        }
+        try:
+            os.makedirs(directory, exist_ok=True)
+            profile.dump_stats(os.path.join(directory, f"{profile_id}.prof"))
+            with open(os.path.join(directory, f"{profile_id}.json"), "w") as f:
+                json.dump(meta, f)
+        except OSError as e:
+            print(f"Не удалось сохранить профиль {profile_id}: {e}")
+            return
+        self._prune(directory)
+
+    def _prune(self, directory: str) -> None:
+        """Удаляет самые старые профили сверх PROFILE_MAX_FILES"""
+        with self._index_lock:
+            profiles = list_profiles(directory)
+            for meta in profiles[self.flask_app.config["PROFILE_MAX_FILES"] :]:
+                for extension in (".prof", ".json"):
+                    path = os.path.join(directory, meta["id"] + extension)
+                    if os.path.exists(path):
+                        os.unlink(path)
+
+
+def list_profiles(directory: str, route: Optional[str] = None) -> List[Dict]:
+    """Сохранённые профили, новые первыми"""
+    profiles = []
+    if not os.path.isdir(directory):
+        return profiles
+    for name in os.listdir(directory):
+        if not name.endswith(".json"):
+            continue
+        try:
+            with open(os.path.join(directory, name)) as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            continue
+        if route is None or meta.get("route") == route:
+            profiles.append(meta)
+    profiles.sort(key=lambda meta: meta["created"], reverse=True)
+    return profiles
+
+
+def profile_path(directory: str, profile_id: str) -> Optional[str]:
+    if not PROFILE_ID.match(profile_id):
+        return None
+    path = os.path.join(directory, f"{profile_id}.prof")
+    return path if os.path.isfile(path) else None
+
+
+def profile_text(path: str, sort: str = "cumulative", limit: int = 50) -> str:
+    """Сводка профиля в текстовом виде (как pstats.print_stats)"""
+    output = io.StringIO()
+    stats = pstats.Stats(path, stream=output)
+    stats.sort_stats(sort).print_stats(limit)
+    return output.getvalue()
@@ -0,0 +1,266 @@
+"""
+Генератор синтетических данных для нагрузочных проверок.
+
+Строит социальный граф заданного размера: число подписок и лайков
+у пользователя случайно, популярность авторов и твитов распределена
+по степенному закону (немногие собирают большую часть подписчиков и лайков).
+Одинаковый seed даёт одинаковые данные. Строки генерируются потоково
+и грузятся через COPY FROM STDIN, весь набор в памяти не хранится.
+
+    python manage.py seed --users 100000 --tweets 20 --seed 1
+"""
+import io
+import math
+import random
+from typing import Dict, Iterable, Iterator, NamedTuple, Set, Tuple
+
+WORDS = (
+    "привет мир flask postgres твит лента подписка лайк кофе утро вечер "
+    "код релиз тест баг фича город море кот погода музыка книга идея"
+).split()
+
+# Шаг перестановки рангов популярности: самые популярные пользователи
+# и твиты разбросаны по диапазону id, а не собраны в его начале
+PERMUTATION_STRIDE = 2654435761
+
+MEDIA_PATH = "static/uploads/seed.jpg"
+
+
+class SeedConfig(NamedTuple):
+    users: int = 1000
+    follows: float = 20  # среднее число подписок пользователя
+    follow_skew: float = 1.2  # показатель степенного закона для популярности авторов
+    tweets: float = 10  # среднее число твитов пользователя
+    likes: float = 30  # среднее число лайков, поставленных пользователем
+    like_skew: float = 1.1  # показатель степенного закона для популярности твитов
+    media_ratio: float = 0.1  # доля твитов с картинкой
+    seed: int = 1
+
+
+class IdBase(NamedTuple):
+    """Последние занятые id: сгенерированные строки идут следом за ними"""
+
+    user: int
+    tweet: int
+    media: int
+
+
+def power_law_rank(rng: random.Random, n: int, skew: float) -> int:
+    """
+    Ранг от 0 до n - 1 с вероятностью, убывающей как rank ** -skew
+    (обратная функция распределения непрерывного степенного закона)
+    """
+    u = rng.random()
+    if abs(skew - 1.0) < 1e-9:
+        x = (n + 1) ** u
+    else:
+        a = 1.0 - skew
+        x = (((n + 1) ** a - 1.0) * u + 1.0) ** (1.0 / a)
+    return min(int(x) - 1, n - 1)
+
+
+def permutation(n: int):
+    """Взаимно однозначное отображение рангов 0..n-1 на индексы 0..n-1"""
+    stride = PERMUTATION_STRIDE % n if n > 1 else 1
+    while math.gcd(stride, n) != 1:
+        stride += 1
+    return lambda rank: (rank * stride) % n
+
+
+def count(rng: random.Random, mean: float) -> int:
+    """Случайное неотрицательное число с заданным средним (экспоненциальное)"""
+    if mean <= 0:
+        return 0
+    return int(rng.expovariate(1.0 / mean))
+
+
+def unit_hash(seed: int, index: int) -> float:
+    """Детерминированное число из [0, 1) для индекса (без хранения состояния)"""
+    x = (index * 0x9E3779B97F4A7C15 + seed * 0xBF58476D1CE4E5B9) & 0xFFFFFFFFFFFFFFFF
+    x ^= x >> 31
+    x = (x * 0x94D049BB133111EB) & 0xFFFFFFFFFFFFFFFF
+    x ^= x >> 29
+    return (x >> 11) / float(1 << 53)
+
+
+def api_key(seed: int, user_id: int) -> str:
+    return f"seed{seed}-{user_id}"
+
+
+def tweet_counts(config: SeedConfig) -> Iterator[int]:
+    """Число твитов каждого пользователя по порядку"""
+    rng = random.Random(f"{config.seed}:tweet-counts")
+    for _ in range(config.users):
+        yield count(rng, config.tweets)
+
+
+def generate_users(config: SeedConfig, base: IdBase) -> Iterator[Tuple]:
+    rng = random.Random(f"{config.seed}:users")
+    for i in range(config.users):
+        user_id = base.user + i + 1
+        name = f"{rng.choice(WORDS)}_{user_id}"
+        yield user_id, name, api_key(config.seed, user_id)
+
+
+def generate_followers(config: SeedConfig, base: IdBase) -> Iterator[Tuple]:
+    rng = random.Random(f"{config.seed}:followers")
+    popular = permutation(config.users)
+    for i in range(config.users):
+        wanted = min(count(rng, config.follows), config.users - 1)
+        followed: Set[int] = set()
+        # Повторы и подписка на себя отбрасываются; попыток ограниченное число
+        for _ in range(wanted * 4):
+            if len(followed) >= wanted:
+                break
+            target = popular(power_law_rank(rng, config.users, config.follow_skew))
+            if target != i:
+                followed.add(target)
+        for target in sorted(followed):
+            yield base.user + i + 1, base.user + target + 1
+
+
+def generate_tweets(config: SeedConfig, base: IdBase) -> Iterator[Tuple]:
+    rng = random.Random(f"{config.seed}:tweets")
+    tweet_id = base.tweet
+    for i, tweets in enumerate(tweet_counts(config)):
+        user_id = base.user + i + 1
+        for _ in range(tweets):
+            tweet_id += 1
+            text = " ".join(rng.choice(WORDS) for _ in range(rng.randint(3, 20)))
+            yield tweet_id, text, api_key(config.seed, user_id), user_id
+
+
+def media_tweets(config: SeedConfig, base: IdBase) -> Iterator[Tuple[int, int]]:
+    """(tweet_id, user_id) твитов с картинкой"""
+    tweet_id = base.tweet
+    for i, tweets in enumerate(tweet_counts(config)):
+        for _ in range(tweets):
+            tweet_id += 1
+            if unit_hash(config.seed, tweet_id - base.tweet) < config.media_ratio:
+                yield tweet_id, base.user + i + 1
+
+
+def generate_media(config: SeedConfig, base: IdBase) -> Iterator[Tuple]:
+    for n, (_, user_id) in enumerate(media_tweets(config, base), start=1):
+        yield base.media + n, MEDIA_PATH, api_key(config.seed, user_id), "image/jpeg"
+
+
+def generate_tweet_media(config: SeedConfig, base: IdBase) -> Iterator[Tuple]:
+    for n, (tweet_id, _) in enumerate(media_tweets(config, base), start=1):
+        yield tweet_id, 0, base.media + n
+
+
+def generate_likes(config: SeedConfig, base: IdBase) -> Iterator[Tuple]:
+    total = sum(tweet_counts(config))
+    if total == 0:
+        return
+    rng = random.Random(f"{config.seed}:likes")
+    popular = permutation(total)
+    for i in range(config.users):
+        wanted = min(count(rng, config.likes), total)
+        liked: Set[int] = set()
+        for _ in range(wanted * 4):
+            if len(liked) >= wanted:
+                break
+            liked.add(popular(power_law_rank(rng, total, config.like_skew)))
+        for tweet in sorted(liked):
+            yield base.user + i + 1, base.tweet + tweet + 1
+
+
+def copy_escape(value) -> str:
+    """Значение в текстовом формате COPY"""
+    if value is None:
+        return "\\N"
+    return (
+        str(value)
+        .replace("\\", "\\\\")
+        .replace("\t", "\\t")
+        .replace("\n", "\\n")
+        .replace("\r", "\\r")
+    )
+
+
+class RowStream(io.RawIOBase):
+    """Файл для copy_expert, который читает строки из генератора по мере надобности"""
+
+    def __init__(self, rows: Iterable[Tuple]):
+        self._rows = iter(rows)
+        self._buffer = b""
+        self.rows = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def read(self, size: int = -1) -> bytes:
+        while size < 0 or len(self._buffer) < size:
+            row = next(self._rows, None)
+            if row is None:
+                break
+            self.rows += 1
+            line = "\t".join(copy_escape(value) for value in row) + "\n"
+            self._buffer += line.encode()
+        if size < 0:
+            size = len(self._buffer)
+        chunk, self._buffer = self._buffer[:size], self._buffer[size:]
+        return chunk
+
+
+# Таблица, её столбцы и генератор строк — в порядке загрузки
+TABLES = (
+    ("users", "id, name, api_key", generate_users),
+    ("followers", "follower_id, followed_id", generate_followers),
+    ("tweets", "tweet_id, tweet_data, api_key, author_id", generate_tweets),
+    ("media", "id, file_path, api_key, mime_type", generate_media),
+    ("tweet_media", "tweet_id, position, media_id", generate_tweet_media),
+    ("likes", "user_id, tweet_id", generate_likes),
+)
+
+SEQUENCES = (("users", "id"), ("tweets", "tweet_id"), ("media", "id"))
+
+
+def id_base(cursor) -> IdBase:
+    values = []
+    for table, column in SEQUENCES:
+        cursor.execute(f"SELECT COALESCE(MAX({column}), 0) FROM {table}")
+        values.append(cursor.fetchone()[0])
+    return IdBase(*values)
+
+
+def load(conn, config: SeedConfig, verbose: bool = False) -> Dict[str, int]:
+    """
+    Загружает сгенерированные данные в одной транзакции (таблицы блокируются,
+    чтобы параллельные вставки не заняли те же id) и сдвигает
+    последовательности. Возвращает число строк по таблицам
+    """
+    loaded: Dict[str, int] = {}
+    with conn.cursor() as cursor:
+        cursor.execute("LOCK TABLE users, tweets, media IN SHARE ROW EXCLUSIVE MODE")
+        base = id_base(cursor)
+        for table, columns, generate in TABLES:
+            stream = RowStream(generate(config, base))
+            cursor.copy_expert(f"COPY {table} ({columns}) FROM STDIN", stream)
+            loaded[table] = stream.rows
+            if verbose:
+                print(f"{table}: {stream.rows}")
+        for table, column in SEQUENCES:
+            cursor.execute(
+                f"""
+                SELECT setval(
+                    pg_get_serial_sequence('{table}', '{column}'),
+                    GREATEST((SELECT MAX({column}) FROM {table}), 1)
+                )
+                """
+            )
+    conn.commit()
+    return loaded
+
+
+def seed_database(config: SeedConfig, verbose: bool = False) -> Dict[str, int]:
+    """Загружает данные в текущую БД и пересчитывает счётчики лайков и подписок"""
+    from database import connection, reconcile_follow_counts, reconcile_like_counts
+
+    with connection() as conn:
+        loaded = load(conn, config, verbose)
+    loaded["like_counts"] = reconcile_like_counts()
+    loaded["follow_counts"] = reconcile_follow_counts()
+    return loaded
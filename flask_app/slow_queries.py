@@ -0,0 +1,267 @@
+"""
+Журнал медленных SQL-запросов с планами выполнения.
+
+Запрос дольше SLOW_QUERY_MS (или попавший в выборку SLOW_QUERY_SAMPLE_RATE)
+записывается в журнал. Для SELECT в фоновом потоке на отдельном соединении
+снимается EXPLAIN (ANALYZE, BUFFERS) с теми же параметрами. Запросы,
+которые что-то меняют (в том числе SELECT с nextval, setval или
+pg_advisory_*), повторно не выполняются и пишутся без плана.
+Значения параметров в журнал не попадают: сохраняются только их типы,
+литералы в условиях плана заменяются на ?.
+
+Чтобы снятие планов не нагружало БД, их число ограничено
+token bucket (SLOW_QUERY_EXPLAIN_RATE в секунду, запас SLOW_QUERY_EXPLAIN_BURST)
+и очередью фонового потока. Записи пишутся JSON-строками в
+ротируемый файл SLOW_QUERY_LOG и хранятся в памяти для
+GET /api/admin/slow-queries.
+"""
+import datetime
+import json
+import logging
+import logging.handlers
+import os
+import random
+import re
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional
+
+SLOW_QUERY_MS = float(os.environ.get("SLOW_QUERY_MS", 200))
+SLOW_QUERY_SAMPLE_RATE = float(os.environ.get("SLOW_QUERY_SAMPLE_RATE", 0))
+SLOW_QUERY_EXPLAIN_RATE = float(os.environ.get("SLOW_QUERY_EXPLAIN_RATE", 1))
+SLOW_QUERY_EXPLAIN_BURST = int(os.environ.get("SLOW_QUERY_EXPLAIN_BURST", 5))
+SLOW_QUERY_LOG = os.environ.get("SLOW_QUERY_LOG", "logs/slow_queries.log")
+
+# Сколько записей хранится в памяти и сколько планов может ждать в очереди
+RECENT_SIZE = 500
+MAX_PENDING = 10
+
+# Верхняя граница на время EXPLAIN ANALYZE, миллисекунды
+EXPLAIN_TIMEOUT_MS = 30_000
+
+_CONDITION = re.compile(r"(Cond|Filter|Key|Recheck Cond|One-Time Filter):")
+_PLAN_LITERALS = re.compile(r"'(?:[^']|'')*'|(?<![\w.])-?\d+(?:\.\d+)?(?![\w.])")
+_WRITES = re.compile(r"\b(INSERT|UPDATE|DELETE|MERGE|TRUNCATE|COPY|LOCK)\b", re.I)
+# Функции с побочными эффектами: SELECT с ними повторять нельзя
+# (nextval сдвинет последовательность, pg_advisory_lock возьмёт блокировку)
+_SIDE_EFFECTS = re.compile(
+    r"\b(nextval|setval|pg_(try_)?advisory_\w+|pg_notify|pg_sleep\w*)\s*\(", re.I
+)
+
+
+class TokenBucket:
+    """rate токенов в секунду, не больше burst про запас"""
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def take(self) -> bool:
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return True
+            return False
+
+
+def explainable(sql: str) -> bool:
+    """Можно ли безопасно выполнить запрос ещё раз под EXPLAIN ANALYZE"""
+    head = sql.lstrip().split(None, 1)[0].upper() if sql.strip() else ""
+    return (
+        head in ("SELECT", "WITH")
+        and not _WRITES.search(sql)
+        and not _SIDE_EFFECTS.search(sql)
+    )
+
+
+def redact_params(params) -> object:
+    """Параметры без значений: только типы"""
+    if params is None:
+        return None
+    if isinstance(params, dict):
+        return {key: type(value).__name__ for key, value in params.items()}
+    return [type(value).__name__ for value in params]
+
+
+def redact_plan(plan: str) -> str:
+    """Заменяет литералы в условиях плана (в том числе значения параметров) на ?"""
+    lines = []
+    for line in plan.splitlines():
+        if _CONDITION.search(line):
+            head, _, condition = line.partition(":")
+            line = f"{head}:{_PLAN_LITERALS.sub('?', condition)}"
+        lines.append(line)
+    return "\n".join(lines)
+
+
+class SlowQueryLog:
+    def __init__(
+        self,
+        threshold_ms: float = SLOW_QUERY_MS,
+        sample_rate: float = SLOW_QUERY_SAMPLE_RATE,
+        explain_rate: float = SLOW_QUERY_EXPLAIN_RATE,
+        explain_burst: int = SLOW_QUERY_EXPLAIN_BURST,
+        log_path: Optional[str] = SLOW_QUERY_LOG,
+    ):
+        self.threshold_ms = threshold_ms
+        self.sample_rate = sample_rate
+        self.bucket = TokenBucket(explain_rate, explain_burst)
+        self.recent: deque = deque(maxlen=RECENT_SIZE)
+        self.connection_factory: Optional[Callable] = None
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._pending = 0
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._logger = self._make_logger(log_path)
+        self._stats = {
+            "recorded": 0,
+            "explained": 0,
+            "rate_limited": 0,
+            "queue_full": 0,
+            "explain_errors": 0,
+        }
+
+    @staticmethod
+    def _make_logger(log_path: Optional[str]) -> Optional[logging.Logger]:
+        if not log_path:
+            return None
+        logger = logging.getLogger(f"slow_queries.{log_path}")
+        if not logger.handlers:
+            try:
+                os.makedirs(os.path.dirname(log_path) or ".", exist_ok=True)
+                handler = logging.handlers.RotatingFileHandler(
+                    log_path,
+                    maxBytes=10 * 1024 * 1024,
+                    backupCount=5,
+                    encoding="utf-8",
+                    delay=True,
+                )
+            except OSError as e:
+                print(f"Журнал медленных запросов недоступен: {e}")
+                return None
+            handler.setFormatter(logging.Formatter("%(message)s"))
+            logger.addHandler(handler)
+            logger.setLevel(logging.INFO)
+            logger.propagate = False
+        return logger
+
+    def observe(
+        self,
+        sql: str,
+        params,
+        seconds: float,
+        rows: int,
+        statement: str,
+        query_id: str,
+    ) -> None:
+        """Вызывается после каждого запроса; дешёвый выход для обычных запросов"""
+        duration_ms = seconds * 1000
+        if duration_ms >= self.threshold_ms:
+            reason = "slow"
+        elif self.sample_rate > 0 and random.random() < self.sample_rate:
+            reason = "sampled"
+        else:
+            return
+        if getattr(self._local, "explaining", False):
+            return
+
+        entry = {
+            "time": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            "reason": reason,
+            "query_id": query_id,
+            "statement": statement,
+            "params": redact_params(params),
+            "duration_ms": round(duration_ms, 3),
+            "rows": rows,
+            "plan": None,
+        }
+        if not explainable(sql) or self.connection_factory is None:
+            entry["plan_skipped"] = "not_select"
+        elif not self.bucket.take():
+            entry["plan_skipped"] = "rate_limited"
+        elif not self._enqueue(entry, sql, params):
+            entry["plan_skipped"] = "queue_full"
+        else:
+            return
+        self._store(entry)
+
+    def _enqueue(self, entry: Dict, sql: str, params) -> bool:
+        with self._lock:
+            if self._pending >= MAX_PENDING:
+                return False
+            self._pending += 1
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=1, thread_name_prefix="slow-query-explain"
+                )
+        self._executor.submit(self._explain, entry, sql, params)
+        return True
+
+    def _explain(self, entry: Dict, sql: str, params) -> None:
+        self._local.explaining = True
+        timeout = int(min(EXPLAIN_TIMEOUT_MS, max(1000, entry["duration_ms"] * 2)))
+        try:
+            with self.connection_factory() as conn, conn.cursor() as cursor:
+                cursor.execute("SET LOCAL statement_timeout = %s", (timeout,))
+                cursor.execute("EXPLAIN (ANALYZE, BUFFERS) " + sql, params)
+                plan = "\n".join(row[0] for row in cursor.fetchall())
+                conn.rollback()
+            entry["plan"] = redact_plan(plan)
+        except Exception as e:
+            entry["plan_skipped"] = f"error: {type(e).__name__}"
+        finally:
+            self._local.explaining = False
+            with self._lock:
+                self._pending -= 1
+        self._store(entry)
+
+    def _store(self, entry: Dict) -> None:
+        with self._lock:
+            self.recent.append(entry)
+            self._stats["recorded"] += 1
+            if entry["plan"] is not None:
+                self._stats["explained"] += 1
+            skipped = entry.get("plan_skipped", "")
+            if skipped in ("rate_limited", "queue_full"):
+                self._stats[skipped] += 1
+            elif skipped.startswith("error"):
+                self._stats["explain_errors"] += 1
+        if self._logger is not None:
+            self._logger.info(json.dumps(entry, ensure_ascii=False))
+
+    def entries(self, limit: int = 50, query_id: Optional[str] = None) -> List[Dict]:
+        """Последние записи (новые первыми)"""
+        with self._lock:
+            entries = list(self.recent)
+        if query_id:
+            entries = [entry for entry in entries if entry["query_id"] == query_id]
+        return entries[::-1][:limit]
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            result = dict(self._stats)
+            result.update(
+                {
+                    "pending": self._pending,
+                    "threshold_ms": self.threshold_ms,
+                    "sample_rate": self.sample_rate,
+                }
+            )
+        return result
+
+    def wait(self, timeout: float = 5.0) -> None:
+        """Ждёт, пока фоновый поток снимет поставленные в очередь планы"""
+        deadline = time.monotonic() + timeout
+        while self._pending and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+
+slow_log = SlowQueryLog()
@@ -0,0 +1,207 @@
+"""
+Подготовленные запросы (PREPARE / EXECUTE) для горячих запросов database.py.
+
+Запрос в стиле psycopg2 (%s или %(name)s) переводится в текст с $1, $2...
+и готовится на соединении при первом выполнении под именем ps_<md5>;
+дальше на этом соединении выполняется EXECUTE по имени, и PostgreSQL
+не разбирает и не планирует текст заново. Какие запросы уже подготовлены,
+запоминается для каждого соединения отдельно, поэтому новое соединение
+(после переподключения пула) готовит их заново. Если подготовленный запрос
+пропал или стал несовместим со схемой, он готовится ещё раз, а запрос
+повторяется, когда это безопасно (транзакция до него была пустой).
+Иначе ошибка передаётся вызывающему, а устаревший запрос удаляется
+(DEALLOCATE) перед следующей подготовкой на этом соединении.
+
+PREPARED_STATEMENTS=0 выключает подготовку: запросы выполняются как обычно.
+"""
+import hashlib
+import os
+import re
+import threading
+import weakref
+from typing import Dict, List, Tuple
+
+import psycopg2
+import psycopg2.errors
+import psycopg2.extensions
+
+ENABLED = os.environ.get("PREPARED_STATEMENTS", "1") == "1"
+
+_PLACEHOLDER = re.compile(r"%\((\w+)\)s|%s|%%")
+
+# Ошибки, после которых подготовленный запрос нужно приготовить заново:
+# его нет на сервере или план не подходит к изменившейся схеме
+_STALE = (psycopg2.errors.InvalidSqlStatementName, psycopg2.errors.FeatureNotSupported)
+
+
+class Statement:
+    """Текст запроса с $n вместо параметров psycopg2 и порядок параметров"""
+
+    __slots__ = ("name", "sql", "text", "names", "positional")
+
+    def __init__(self, sql: str):
+        self.sql = sql
+        self.name = "ps_" + hashlib.md5(sql.encode()).hexdigest()[:16]
+        self.names: List[str] = []
+        self.positional = 0
+        numbers: Dict[str, int] = {}
+
+        def replace(match) -> str:
+            if match.group(0) == "%%":
+                return "%"
+            name = match.group(1)
+            if name is None:
+                self.positional += 1
+                return f"${self.positional}"
+            if name not in numbers:
+                self.names.append(name)
+                numbers[name] = len(self.names)
+            return f"${numbers[name]}"
+
+        self.text = _PLACEHOLDER.sub(replace, sql)
+        if self.positional and self.names:
+            raise ValueError("Нельзя смешивать %s и %(name)s в одном запросе")
+
+    def values(self, params) -> Tuple:
+        if self.names:
+            return tuple(params[name] for name in self.names)
+        return tuple(params or ())
+
+    def execute_sql(self) -> str:
+        count = len(self.names) or self.positional
+        if not count:
+            return f"EXECUTE {self.name}"
+        return f"EXECUTE {self.name} ({', '.join(['%s'] * count)})"
+
+
+def _execute_untraced(cursor, sql: str) -> None:
+    """
+    Служебный запрос реестра (PREPARE, DEALLOCATE) мимо трассировки: в метриках
+    нужен сам подготовленный запрос. Курсор может выполнить его своим методом
+    execute_untraced, например чтобы учесть обращение к БД
+    """
+    execute = getattr(cursor, "execute_untraced", None)
+    if execute is not None:
+        execute(sql)
+    else:
+        psycopg2.extensions.cursor.execute(cursor, sql)
+
+
+class StatementRegistry:
+    def __init__(self, enabled: bool = ENABLED):
+        self.enabled = enabled
+        self._statements: Dict[str, Statement] = {}
+        self._prepared: "weakref.WeakKeyDictionary" = weakref.WeakKeyDictionary()
+        # Имена, которые есть на сервере, но устарели: перед PREPARE — DEALLOCATE
+        self._stale: "weakref.WeakKeyDictionary" = weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+        self._stats = {"prepares": 0, "executions": 0, "reprepares": 0, "adhoc": 0}
+
+    def statement(self, sql: str) -> Statement:
+        statement = self._statements.get(sql)
+        if statement is None:
+            statement = Statement(sql)
+            with self._lock:
+                statement = self._statements.setdefault(sql, statement)
+        return statement
+
+    def _prepared_on(self, conn) -> set:
+        with self._lock:
+            prepared = self._prepared.get(conn)
+            if prepared is None:
+                prepared = self._prepared[conn] = set()
+            return prepared
+
+    def _stale_on(self, conn) -> set:
+        with self._lock:
+            stale = self._stale.get(conn)
+            if stale is None:
+                stale = self._stale[conn] = set()
+            return stale
+
+    def _count(self, key: str) -> None:
+        with self._lock:
+            self._stats[key] += 1
+
+    def execute(self, cursor, sql: str, params=None) -> None:
+        """
+        Выполняет sql как подготовленный запрос на соединении курсора
+        (или обычным execute, если подготовка выключена)
+        """
+        if not self.enabled:
+            self._count("adhoc")
+            cursor.execute(sql, params)
+            return
+        statement = self.statement(sql)
+        conn = cursor.connection
+        prepared = self._prepared_on(conn)
+        status = conn.get_transaction_status()
+        fresh = status == psycopg2.extensions.TRANSACTION_STATUS_IDLE
+        try:
+            self._run(cursor, statement, params, prepared)
+        except _STALE as e:
+            prepared.discard(statement.name)
+            if not fresh:
+                if isinstance(e, psycopg2.errors.FeatureNotSupported):
+                    # Запрос остался на сервере (откат его не удаляет)
+                    self._stale_on(conn).add(statement.name)
+                raise
+            # До запроса транзакция была пустой: откат ничего не теряет
+            conn.rollback()
+            self._deallocate(cursor, statement)
+            self._count("reprepares")
+            self._run(cursor, statement, params, prepared)
+
+    def _run(self, cursor, statement: Statement, params, prepared: set) -> None:
+        if statement.name not in prepared:
+            stale = self._stale_on(cursor.connection)
+            if statement.name in stale:
+                _execute_untraced(cursor, f"DEALLOCATE {statement.name}")
+                stale.discard(statement.name)
+            # PREPARE не отменяется откатом транзакции
+            _execute_untraced(cursor, f"PREPARE {statement.name} AS {statement.text}")
+            prepared.add(statement.name)
+            self._count("prepares")
+        values = statement.values(params)
+        execute_as = getattr(cursor, "execute_as", None)
+        if execute_as is not None:
+            # Трассировка и журнал медленных запросов видят исходный текст
+            execute_as(statement.execute_sql(), values, statement.sql, params)
+        else:
+            cursor.execute(statement.execute_sql(), values)
+        self._count("executions")
+
+    @staticmethod
+    def _deallocate(cursor, statement: Statement) -> None:
+        try:
+            _execute_untraced(cursor, f"DEALLOCATE {statement.name}")
+        except psycopg2.errors.InvalidSqlStatementName:
+            cursor.connection.rollback()
+
+    def forget(self, conn) -> None:
+        """Соединение потеряло подготовленные запросы (например, после DISCARD ALL)"""
+        with self._lock:
+            self._prepared.pop(conn, None)
+            self._stale.pop(conn, None)
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            result = dict(self._stats)
+            result["registered"] = len(self._statements)
+            result["connections"] = len(self._prepared)
+        result["enabled"] = int(self.enabled)
+        return result
+
+
+registry = StatementRegistry()
+
+
+
+def execute_prepared(cursor, sql: str, params=None) -> None:
+    """Выполняет горячий запрос через общий реестр подготовленных запросов"""
+    registry.execute(cursor, sql, params)
+
+
+def prepared_stats() -> Dict[str, float]:
+    """Число подготовок, выполнений по имени и повторных подготовок"""
+    return registry.stats()
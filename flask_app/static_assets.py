@@ -0,0 +1,161 @@
+"""
+Раздача собранного SPA (static/ и templates/index.html).
+
+- gzip-варианты файлов готовятся заранее (python static_assets.py при сборке
+  образа или при старте приложения) и отдаются клиентам с Accept-Encoding: gzip;
+- файлы с хешем содержимого в имени (app.7c9275be.js) кэшируются браузером
+  навсегда, остальные — с обязательной проверкой по ETag;
+- index.html собирается один раз, отдаётся со строгим ETag и 304 на повтор;
+- тело файла отдаётся через wsgi.file_wrapper (sendfile у gunicorn)
+  или X-Sendfile, если STATIC_X_SENDFILE=1 и перед приложением стоит nginx;
+- sourcemap-файлы (*.map) отдаются только в режиме отладки
+  или при STATIC_SOURCEMAPS=1.
+"""
+import gzip
+import hashlib
+import mimetypes
+import os
+import re
+import sys
+import tempfile
+from typing import Dict, Optional, Set, Tuple
+
+from flask import Flask, Response, abort, render_template, request, send_file
+from werkzeug.security import safe_join
+
+# Какие файлы имеет смысл сжимать. Sourcemap-файлы не сжимаются: без
+# STATIC_SOURCEMAPS их не отдают, а в режиме отладки размер не важен
+COMPRESSIBLE = (".js", ".css", ".html", ".svg", ".json", ".ico", ".txt")
+
+# Меньше этого размера сжатие не окупает лишний запрос к диску
+MIN_COMPRESS_SIZE = 1024
+
+# Хеш содержимого в имени файла: name.0123abcd.js, 866bb3….jpg в uploads
+HASHED_NAME = re.compile(r"(\.[0-9a-f]{8}\.|(^|/)[0-9a-f]{64}\.)[\w.]+$")
+
+IMMUTABLE = "public, max-age=31536000, immutable"
+REVALIDATE = "no-cache"
+
+
+def precompress(static_folder: str, min_size: int = MIN_COMPRESS_SIZE) -> Set[str]:
+    """
+    Создаёт рядом с файлами их gzip-варианты (file.js.gz), если их нет
+    или они старше исходника. Возвращает относительные пути файлов,
+    у которых есть актуальный gzip-вариант
+    """
+    compressed = set()
+    for root, _, files in os.walk(static_folder):
+        for name in files:
+            if not name.endswith(COMPRESSIBLE):
+                continue
+            path = os.path.join(root, name)
+            gz_path = path + ".gz"
+            relative = os.path.relpath(path, static_folder).replace(os.sep, "/")
+            stat = os.stat(path)
+            if stat.st_size < min_size:
+                continue
+            if os.path.exists(gz_path) and os.stat(gz_path).st_mtime >= stat.st_mtime:
+                compressed.add(relative)
+                continue
+            try:
+                with open(path, "rb") as f:
+                    data = gzip.compress(f.read(), compresslevel=9, mtime=0)
+                if len(data) >= stat.st_size:
+                    continue
+                fd, tmp_path = tempfile.mkstemp(dir=root, prefix=".gz-")
+                with os.fdopen(fd, "wb") as f:
+                    f.write(data)
+                # mkstemp создаёт файл с правами 0600, а gz-вариант раздаётся как статика
+                os.chmod(tmp_path, 0o644)
+                os.replace(tmp_path, gz_path)
+            except OSError as e:
+                # Например, каталог только для чтения: файл отдаётся без сжатия
+                print(f"Не удалось сжать {path}: {e}")
+                continue
+            compressed.add(relative)
+    return compressed
+
+
+def accepts_gzip() -> bool:
+    return request.accept_encodings.quality("gzip") > 0
+
+
+def cache_control(filename: str) -> str:
+    return IMMUTABLE if HASHED_NAME.search(filename) else REVALIDATE
+
+
+class StaticAssets:
+    """Заменяет стандартный обработчик /static/ и отдаёт index.html"""
+
+    def __init__(self, app: Optional[Flask] = None):
+        self.compressed: Set[str] = set()
+        self._index: Optional[Dict[str, Tuple[bytes, str]]] = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app: Flask) -> None:
+        self.app = app
+        app.config.setdefault(
+            "STATIC_SOURCEMAPS", os.environ.get("STATIC_SOURCEMAPS") == "1"
+        )
+        app.config.setdefault(
+            "USE_X_SENDFILE", os.environ.get("STATIC_X_SENDFILE") == "1"
+        )
+        if os.environ.get("STATIC_PRECOMPRESS", "1") == "1":
+            self.compressed = precompress(app.static_folder)
+        app.view_functions["static"] = self.send_static
+        app.extensions["static_assets"] = self
+
+    def sourcemaps_enabled(self) -> bool:
+        return self.app.debug or self.app.config["STATIC_SOURCEMAPS"]
+
+    def send_static(self, filename: str) -> Response:
+        if filename.endswith(".map") and not self.sourcemaps_enabled():
+            abort(404)
+        path = safe_join(self.app.static_folder, filename)
+        if path is None or not os.path.isfile(path):
+            abort(404)
+
+        gzipped = filename in self.compressed and accepts_gzip()
+        response = send_file(
+            path + ".gz" if gzipped else path,
+            mimetype=mimetypes.guess_type(filename)[0] or "application/octet-stream",
+            conditional=True,
+            etag=True,
+        )
+        if gzipped:
+            response.headers["Content-Encoding"] = "gzip"
+        if filename in self.compressed:
+            response.vary.add("Accept-Encoding")
+        response.headers["Cache-Control"] = cache_control(filename)
+        return response
+
+    def index_variants(self) -> Dict[str, Tuple[bytes, str]]:
+        """Тело index.html (обычное и сжатое) и строгий ETag для каждого"""
+        if self._index is None or self.app.debug:
+            body = render_template("index.html").encode()
+            digest = hashlib.sha256(body).hexdigest()[:32]
+            self._index = {
+                "identity": (body, digest),
+                "gzip": (gzip.compress(body, mtime=0), digest + "-gz"),
+            }
+        return self._index
+
+    def send_index(self) -> Response:
+        variants = self.index_variants()
+        encoding = "gzip" if accepts_gzip() else "identity"
+        body, etag = variants[encoding]
+        response = Response(body, mimetype="text/html")
+        if encoding == "gzip":
+            response.headers["Content-Encoding"] = "gzip"
+        response.vary.add("Accept-Encoding")
+        response.headers["Cache-Control"] = REVALIDATE
+        response.set_etag(etag)
+        return response.make_conditional(request)
+
+
+if __name__ == "__main__":
+    folder = sys.argv[1] if len(sys.argv) > 1 else os.path.join(
+        os.path.dirname(os.path.abspath(__file__)), "static"
+    )
+    print(f"Сжато файлов: {len(precompress(folder))}")
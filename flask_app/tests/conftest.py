@@ -1,61 +1,11 @@
 import pytest
-from database import main_connection, set_database, test_connection
+from database import close_pool, main_connection, set_database, test_connection
+from migrate import upgrade
 
 
 def create_tables(conn):
+    upgrade(conn)
     with conn.cursor() as cursor:
-        cursor.execute(
-            """
-        CREATE TABLE IF NOT EXISTS users
-        (id SERIAL PRIMARY KEY,
-        name TEXT NOT NULL,
-        api_key TEXT NOT NULL UNIQUE)
-        """
-        )
-
-        cursor.execute(
-            """
-        CREATE TABLE IF NOT EXISTS tweets
-        (tweet_id SERIAL PRIMARY KEY,
-        tweet_data TEXT NOT NULL,
-        tweet_media_ids INTEGER,
-        api_key TEXT NOT NULL)
-        """
-        )
-
-        cursor.execute(
-            """
-        CREATE TABLE IF NOT EXISTS likes (
-        user_id INTEGER NOT NULL,
-        tweet_id INTEGER NOT NULL,
-        PRIMARY KEY(user_id, tweet_id),
-        FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE,
-        FOREIGN KEY (tweet_id) REFERENCES tweets(tweet_id) ON DELETE CASCADE)
-        """
-        )
-
-        cursor.execute(
-            """
-        CREATE TABLE IF NOT EXISTS followers
-        (follower_id INTEGER NOT NULL,
-        followed_id INTEGER NOT NULL,
-        PRIMARY KEY(follower_id, followed_id),
-        FOREIGN KEY (follower_id) REFERENCES users(id) ON DELETE CASCADE,
-        FOREIGN KEY (followed_id) REFERENCES users(id) ON DELETE CASCADE)
-        """
-        )
-
-        cursor.execute(
-            """
-        CREATE TABLE IF NOT EXISTS media
-        (id SERIAL PRIMARY KEY,
-        file_path TEXT NOT NULL,
-        api_key TEXT NOT NULL,
-        FOREIGN KEY (api_key) REFERENCES users(api_key) ON DELETE CASCADE)
-        """
-        )
-        conn.commit()
-
         users_data = [("test", "test"), ("test2", "test2")]
         cursor.executemany(
             """
@@ -69,10 +19,10 @@ def create_tables(conn):
         cursor.execute(
             """
         INSERT INTO tweets
-        (tweet_data, api_key)
-        VALUES(%s, %s)
+        (tweet_data, api_key, author_id)
+        VALUES(%s, %s, %s)
         """,
-            ("test tweet", "test"),
+            ("test tweet", "test", 1),
         )
         conn.commit()
 
@@ -90,6 +40,7 @@ def test_db():
     create_tables(test_conn)
     yield test_conn
     test_conn.close()
+    close_pool()
     with conn.cursor() as cursor:
         cursor.execute("DROP DATABASE test_postgres")
     conn.close()
@@ -109,6 +60,18 @@ def app(test_db):
         yield flask_app
 
 
+@pytest.fixture
+def request_client(test_db):
+    """
+    Клиент без общего контекста приложения: у каждого запроса свой контекст,
+    и соединение возвращается в пул при его teardown
+    """
+    from flask_app.app import app as flask_app
+
+    set_database(test_connection)
+    return flask_app.test_client()
+
+
 @pytest.fixture
 def api_headers():
     return {"api-key": "test"}
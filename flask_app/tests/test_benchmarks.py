@@ -0,0 +1,35 @@
+from benchmarks.run import compare, prepared_savings
+
+
+def result(function, p95_ms, round_trips=2, rows=10, scale=1000):
+    return {
+        "scale": scale,
+        "function": function,
+        "p95_ms": p95_ms,
+        "round_trips": round_trips,
+        "rows": rows,
+    }
+
+
+def test_compare_reports_regressions_over_threshold():
+    baseline = {"results": [result("get_tweets", 10), result("my_profile", 5)]}
+    current = {
+        "results": [
+            result("get_tweets", 11.5),
+            result("my_profile", 5, round_trips=3),
+            result("any_profile", 100),
+        ]
+    }
+    assert compare(current, baseline, 0.2) == ["my_profile @ 1000: round_trips 2 -> 3"]
+    assert len(compare(current, baseline, 0.1)) == 2
+
+
+def test_prepared_savings():
+    results = [
+        dict(result("get_tweets", 10, scale=1000), statements=mode, mean_ms=mean, p50_ms=p50)
+        for mode, mean, p50 in (("adhoc", 4.0, 3.5), ("prepared", 3.0, 3.0))
+    ]
+    assert prepared_savings(results) == [
+        {"scale": 1000, "function": "get_tweets", "mean_ms": 1.0, "p50_ms": 0.5}
+    ]
+    assert prepared_savings(results[1:]) == []
@@ -0,0 +1,26 @@
+import time
+
+from cache import MISSING, TTLCache
+
+
+def test_ttl_cache_lru_eviction():
+    cache = TTLCache(maxsize=2, ttl=60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == (True, 1)
+    cache.set("c", 3)
+    assert cache.get("b") == (False, None)
+    assert cache.get("a") == (True, 1)
+    assert cache.stats()["evictions"] == 1
+
+
+def test_ttl_cache_expiration_and_negative_entries():
+    cache = TTLCache(maxsize=10, ttl=0.05, negative_ttl=60)
+    cache.set("user", {"id": 1})
+    cache.set("unknown", MISSING)
+    time.sleep(0.06)
+    assert cache.get("user") == (False, None)
+    assert cache.get("unknown") == (True, MISSING)
+    stats = cache.stats()
+    assert stats["expirations"] == 1
+    assert stats["negative_hits"] == 1
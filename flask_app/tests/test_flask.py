@@ -1,6 +1,12 @@
+import hashlib
+import io
 import json
 import os
+import stat
+import time
 
+import database
+from uploads import MAX_UPLOAD_SIZE
 from werkzeug.datastructures import FileStorage
 
 
@@ -133,3 +139,587 @@ def test_get_user_404(client, test_db):
     assert response.status_code == 404
     response_data = response.get_json()
     assert response_data["result"] == False
+
+
+def test_pool_stats(request_client, api_headers):
+    before = request_client.get("/api/stats/pool").get_json()["pool"]
+    database.invalidate_user()
+    assert request_client.get("/api/users/me", headers=api_headers).status_code == 200
+    response = request_client.get("/api/stats/pool")
+    assert response.status_code == 200
+    pool = response.get_json()["pool"]
+    # Соединение запроса вернулось в пул при teardown
+    assert pool["in_use"] == 0
+    assert pool["size"] <= pool["maxconn"]
+    assert pool["checkouts"] > before["checkouts"]
+
+
+def test_tweets_get_assembled(client, test_db, api_headers):
+    response = client.get("/api/tweets", headers=api_headers)
+    assert response.status_code == 200
+    tweet = response.get_json()["tweets"][0]
+    assert tweet["id"] == "2"
+    assert tweet["author"] == {"id": 1, "name": "test"}
+    assert tweet["attachments"] == []
+    assert tweet["likes"] == []
+
+
+def test_tweets_get_keyset_pages(client, test_db, api_headers):
+    for text in ("page tweet 1", "page tweet 2"):
+        client.post("/api/tweets", headers=api_headers, json={"tweet_data": text})
+
+    seen, cursor = [], None
+    while True:
+        url = "/api/tweets?limit=2" + (f"&cursor={cursor}" if cursor else "")
+        response = client.get(url, headers=api_headers)
+        assert response.status_code == 200
+        data = response.get_json()
+        assert len(data["tweets"]) <= 2
+        seen += [tweet["id"] for tweet in data["tweets"]]
+        cursor = data["next_cursor"]
+        if cursor is None:
+            break
+
+    full = client.get("/api/tweets", headers=api_headers).get_json()
+    assert "next_cursor" not in full
+    assert seen == [tweet["id"] for tweet in full["tweets"]]
+    assert len(seen) == 3
+
+
+def test_tweets_get_keyset_pages_skip_nothing(client, api_headers, monkeypatch):
+    full = client.get("/api/tweets", headers=api_headers).get_json()["tweets"]
+    missing = int(full[1]["id"])
+    authors = database.get_authors_data
+
+    def authors_without_one(tweet_ids):
+        return {k: v for k, v in authors(tweet_ids).items() if k != missing}
+
+    # Твит, выпавший при параллельной догрузке, не обрывает постраничную ленту
+    monkeypatch.setattr(database, "HYDRATION_MODE", "parallel")
+    monkeypatch.setattr(database, "get_authors_data", authors_without_one)
+    seen, cursor = [], None
+    while True:
+        url = "/api/tweets?limit=2" + (f"&cursor={cursor}" if cursor else "")
+        data = client.get(url, headers=api_headers).get_json()
+        seen += [tweet["id"] for tweet in data["tweets"]]
+        cursor = data["next_cursor"]
+        if cursor is None:
+            break
+    assert seen == [tweet["id"] for tweet in full if tweet["id"] != str(missing)]
+
+
+def test_tweets_get_unavailable(client, api_headers, monkeypatch):
+    from pool import PoolTimeout
+
+    def statement_timeout(*args):
+        with database.connection() as conn, conn.cursor() as cursor:
+            cursor.execute("SET LOCAL statement_timeout = 1")
+            cursor.execute("SELECT pg_sleep(1)")
+
+    # Таймаут запроса или пустой пул — не «пользователь не найден», а 503
+    monkeypatch.setattr(database, "get_timeline", statement_timeout)
+    response = client.get("/api/tweets", headers=api_headers)
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "1"
+
+    def pool_timeout(*args):
+        raise PoolTimeout("Нет свободных соединений")
+
+    monkeypatch.setattr(database, "get_timeline", pool_timeout)
+    response = client.get("/api/tweets?limit=2", headers=api_headers)
+    assert response.status_code == 503
+    assert client.get("/api/tweets", headers={"api-key": "nobody"}).status_code == 404
+
+
+def test_tweets_get_bad_cursor(client, test_db, api_headers):
+    response = client.get("/api/tweets?limit=2&cursor=broken", headers=api_headers)
+    assert response.status_code == 400
+    response = client.get("/api/tweets?limit=0", headers=api_headers)
+    assert response.status_code == 400
+
+
+def test_like_counter_and_reconcile(client, test_db, api_headers):
+    from database import reconcile_like_counts
+
+    client.post("/api/tweets/2/likes", headers=api_headers)
+    with test_db.cursor() as cursor:
+        cursor.execute("SELECT like_count FROM tweets WHERE tweet_id = 2")
+        assert cursor.fetchone()[0] == 1
+        cursor.execute("UPDATE tweets SET like_count = 42 WHERE tweet_id = 2")
+        test_db.commit()
+
+    assert reconcile_like_counts() == 1
+    client.delete("/api/tweets/2/likes", headers=api_headers)
+    with test_db.cursor() as cursor:
+        cursor.execute("SELECT like_count FROM tweets WHERE tweet_id = 2")
+        assert cursor.fetchone()[0] == 0
+    test_db.commit()
+
+
+def test_auth_cache(client, test_db, api_headers):
+    from database import invalidate_user
+
+    invalidate_user()
+    client.get("/api/users/me", headers=api_headers)
+    client.get("/api/users/me", headers=api_headers)
+    client.get("/api/users/me", headers={"api-key": "nobody"})
+    client.get("/api/users/me", headers={"api-key": "nobody"})
+
+    stats = client.get("/api/stats/auth-cache").get_json()["auth_cache"]
+    assert stats["hits"] >= 1
+    assert stats["negative_hits"] >= 1
+    assert stats["size"] == 2
+
+    invalidate_user("nobody")
+    stats = client.get("/api/stats/auth-cache").get_json()["auth_cache"]
+    assert stats["size"] == 1
+
+
+def test_tweet_attachments_keep_order(client, test_db, api_headers):
+    BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+    media_ids = []
+    for _ in range(2):
+        with open(os.path.join(BASE_DIR, "test_file.jpg"), "rb") as f:
+            response = client.post(
+                "/api/medias",
+                headers=api_headers,
+                content_type="multipart/form-data",
+                data={"file": FileStorage(f)},
+            )
+        media_ids.append(response.get_json()["media_id"])
+
+    tweet_media_ids = [media_ids[1], 999, media_ids[0]]
+    response = client.post(
+        "/api/tweets",
+        headers=api_headers,
+        json={"tweet_data": "two pictures", "tweet_media_ids": tweet_media_ids},
+    )
+    tweet_id = response.get_json()["tweet_id"]
+
+    with test_db.cursor() as cursor:
+        cursor.execute(
+            "SELECT media_id FROM tweet_media WHERE tweet_id = %s ORDER BY position",
+            (tweet_id,),
+        )
+        assert [row[0] for row in cursor.fetchall()] == [media_ids[1], media_ids[0]]
+    test_db.commit()
+
+    tweets = client.get("/api/tweets", headers=api_headers).get_json()["tweets"]
+    tweet = next(t for t in tweets if t["id"] == str(tweet_id))
+    assert len(tweet["attachments"]) == 2
+
+
+def upload(client, api_headers, data, filename="file.jpg"):
+    return client.post(
+        "/api/medias",
+        headers=api_headers,
+        content_type="multipart/form-data",
+        data={"file": (io.BytesIO(data), filename)},
+    )
+
+
+def test_medias_upload_content_addressed(client, test_db, api_headers):
+    BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+    with open(os.path.join(BASE_DIR, "test_file.jpg"), "rb") as f:
+        data = f.read()
+
+    first = upload(client, api_headers, data, "a.jpg").get_json()["media_id"]
+    second = upload(client, api_headers, data, "b.jpg").get_json()["media_id"]
+    assert first != second
+
+    with test_db.cursor() as cursor:
+        cursor.execute(
+            "SELECT file_path, sha256, size_bytes, mime_type FROM media WHERE id IN (%s, %s)",
+            (first, second),
+        )
+        rows = cursor.fetchall()
+    sha256 = hashlib.sha256(data).hexdigest()
+    expected = os.path.join("static/uploads", sha256[:2], sha256[2:4], f"{sha256}.jpg")
+    assert rows == [(expected, sha256, len(data), "image/jpeg")] * 2
+    assert os.path.isfile(expected)
+    assert stat.S_IMODE(os.stat(expected).st_mode) == 0o644
+    leftovers = [
+        name for name in os.listdir("upload_tmp") if name.startswith(".upload-")
+    ]
+    assert leftovers == []
+
+
+def test_medias_upload_rejects_bad_files(client, test_db, api_headers):
+    response = upload(client, api_headers, b"#!/bin/sh\necho not an image\n", "x.jpg")
+    assert response.status_code == 415
+
+    # Тип определяется по содержимому, а не по имени файла
+    response = upload(client, api_headers, b"GIF89a" + b"\0" * 10, "x.jpg")
+    assert response.status_code == 201
+
+    client.application.config["MAX_UPLOAD_SIZE"] = 1024
+    try:
+        response = upload(client, api_headers, b"\x89PNG\r\n\x1a\n" + b"\0" * 2048)
+        assert response.status_code == 413
+    finally:
+        client.application.config["MAX_UPLOAD_SIZE"] = MAX_UPLOAD_SIZE
+    leftovers = [
+        name for name in os.listdir("upload_tmp") if name.startswith(".upload-")
+    ]
+    assert leftovers == []
+
+
+def test_tweets_get_parallel_hydration(client, test_db, api_headers, monkeypatch):
+    client.post("/api/tweets/1/likes", headers=api_headers)
+    expected = client.get("/api/tweets", headers=api_headers).get_json()
+
+    monkeypatch.setattr(database, "HYDRATION_MODE", "parallel")
+    response = client.get("/api/tweets", headers=api_headers).get_json()
+    assert response == expected
+
+    def slow_likes(tweet_ids):
+        with database.connection() as conn, conn.cursor() as cursor:
+            cursor.execute("SELECT pg_sleep(5)")
+
+    monkeypatch.setattr(database, "get_likes_data", slow_likes)
+    monkeypatch.setattr(database, "HYDRATION_LIKES_TIMEOUT", 0.2)
+    started = time.monotonic()
+    response = client.get("/api/tweets", headers=api_headers).get_json()
+    assert time.monotonic() - started < 2
+    assert response["likes_degraded"] is True
+    assert [t["id"] for t in response["tweets"]] == [t["id"] for t in expected["tweets"]]
+    assert all(t["likes"] == [] for t in response["tweets"])
+
+
+def like_count(test_db, tweet_id):
+    with test_db.cursor() as cursor:
+        cursor.execute("SELECT like_count FROM tweets WHERE tweet_id = %s", (tweet_id,))
+        count = cursor.fetchone()[0]
+    test_db.commit()
+    return count
+
+
+def new_tweet(client, api_headers, text="like me"):
+    response = client.post("/api/tweets", headers=api_headers, json={"tweet_data": text})
+    return response.get_json()["tweet_id"]
+
+
+def test_like_is_idempotent(client, test_db, api_headers):
+    tweet_id = new_tweet(client, api_headers)
+    url = f"/api/tweets/{tweet_id}/likes"
+    for _ in range(2):
+        assert client.post(url, headers=api_headers).status_code == 200
+    assert like_count(test_db, tweet_id) == 1
+    for _ in range(2):
+        assert client.delete(url, headers=api_headers).status_code == 200
+    assert like_count(test_db, tweet_id) == 0
+    assert client.post("/api/tweets/999999/likes", headers=api_headers).status_code == 200
+
+
+def test_likes_batch(client, test_db, api_headers):
+    first, second = new_tweet(client, api_headers), new_tweet(client, api_headers)
+    operations = [
+        {"tweet_id": first, "action": "like"},
+        {"tweet_id": second, "action": "like"},
+        {"tweet_id": second, "action": "unlike"},
+        {"tweet_id": 999999, "action": "like"},
+    ]
+    response = client.post(
+        "/api/likes/batch", headers=api_headers, json={"operations": operations}
+    )
+    assert response.status_code == 200
+    assert response.get_json() == {"result": True, "changed": [first]}
+    assert (like_count(test_db, first), like_count(test_db, second)) == (1, 0)
+
+    response = client.post(
+        "/api/likes/batch",
+        headers=api_headers,
+        json={"operations": [{"tweet_id": first, "action": "unlike"}, {"tweet_id": 1}]},
+    )
+    assert response.status_code == 400
+    assert like_count(test_db, first) == 1
+
+    response = client.post(
+        "/api/likes/batch", headers={"api-key": "nobody"}, json={"operations": []}
+    )
+    assert response.status_code == 404
+
+
+def test_like_batch_is_one_statement(client, test_db, api_headers):
+    import tracing
+
+    tweet_id = new_tweet(client, {"api-key": "test2"})
+    before = database.profile_version(2)
+    trace = tracing.RequestTrace()
+    token = tracing.current_trace.set(trace)
+    try:
+        assert database.write_likes([(tweet_id, 1, True), (tweet_id, 2, True)]) == [tweet_id]
+    finally:
+        tracing.current_trace.reset(token)
+    assert len(trace.queries) == 1
+    assert like_count(test_db, tweet_id) == 2
+    assert database.profile_version(2) > before
+
+
+def test_tweets_bulk(client, test_db, api_headers, monkeypatch):
+    BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+    with open(os.path.join(BASE_DIR, "test_file.jpg"), "rb") as f:
+        media_id = upload(client, api_headers, f.read()).get_json()["media_id"]
+
+    monkeypatch.setattr(database, "BULK_BATCH_SIZE", 2)
+    tweets = [{"tweet_data": f"bulk {i}"} for i in range(5)]
+    tweets[3]["tweet_media_ids"] = [media_id, 999999]
+    response = client.post("/api/tweets/bulk", headers=api_headers, json={"tweets": tweets})
+    assert response.status_code == 201
+    tweet_ids = response.get_json()["tweet_ids"]
+    assert len(tweet_ids) == 5
+
+    with test_db.cursor() as cursor:
+        cursor.execute(
+            "SELECT tweet_id, tweet_data, author_id FROM tweets WHERE tweet_id = ANY(%s)",
+            (tweet_ids,),
+        )
+        rows = {row[0]: row[1:] for row in cursor.fetchall()}
+        cursor.execute(
+            "SELECT tweet_id, position, media_id FROM tweet_media WHERE tweet_id = ANY(%s)",
+            (tweet_ids,),
+        )
+        assert cursor.fetchall() == [(tweet_ids[3], 0, media_id)]
+    test_db.commit()
+    assert [rows[tweet_id] for tweet_id in tweet_ids] == [
+        (f"bulk {i}", 1) for i in range(5)
+    ]
+
+    response = client.post(
+        "/api/tweets/bulk", headers=api_headers, json={"tweets": [{"tweet_data": 1}]}
+    )
+    assert response.status_code == 400
+    response = client.post(
+        "/api/tweets/bulk", headers={"api-key": "nobody"}, json={"tweets": []}
+    )
+    assert response.status_code == 404
+    for tweet_id in tweet_ids:
+        client.delete(f"/api/tweets/{tweet_id}")
+
+
+def test_server_timing_and_metrics(client, test_db, api_headers):
+    import tracing
+
+    database.profile_cache.clear()
+    response = client.get("/api/users/me", headers=api_headers)
+    timing = response.headers["Server-Timing"]
+    assert timing.startswith("db;dur=") and "db-acquire;dur=" in timing
+    assert "total;dur=" in timing
+
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.content_type.startswith("text/plain")
+    body = response.get_data(as_text=True)
+    assert 'route="/api/users/me",status="200"' in body
+    assert "db_query_duration_seconds_bucket{query_id=" in body
+    assert "db_pool_in_use" in body
+    statements = [line for line in body.splitlines() if line.startswith("db_query_info")]
+    assert any("FROM users u WHERE u.id = ?" in line for line in statements)
+
+    assert tracing.fingerprint("SELECT 1 FROM t WHERE a = 'x' AND b = %s LIMIT 20")[1] == (
+        "SELECT ? FROM t WHERE a = ? AND b = ? LIMIT ?"
+    )
+    # Пачки execute_values любого размера — один отпечаток без значений
+    rows = ", ".join(f"({i}, 'text {i}', now())" for i in range(999))
+    cached = tracing._cached_fingerprint.cache_info().currsize
+    bulk = tracing.fingerprint(f"INSERT INTO t (a, b, c) VALUES {rows} RETURNING a")
+    single = tracing.fingerprint("INSERT INTO t (a, b, c) VALUES (1, 'x', now()) RETURNING a")
+    assert bulk == single
+    assert tracing._cached_fingerprint.cache_info().currsize == cached + 1
+    assert single[1] == "INSERT INTO t (a, b, c) VALUES (?, ?, now()) RETURNING a"
+
+
+def test_slow_query_log(client, test_db, api_headers, monkeypatch):
+    from slow_queries import TokenBucket, slow_log
+
+    monkeypatch.setitem(client.application.config, "ADMIN_TOKEN", "secret")
+    assert client.get("/api/admin/slow-queries").status_code == 403
+
+    monkeypatch.setattr(slow_log, "threshold_ms", 0)
+    monkeypatch.setattr(slow_log, "bucket", TokenBucket(rate=0, burst=2))
+    slow_log.recent.clear()
+    database.invalidate_user()
+    database.profile_cache.clear()
+    client.get("/api/users/me", headers=api_headers)
+    client.get("/api/users/2")
+    client.post("/api/tweets", headers=api_headers, json={"tweet_data": "slow"})
+    monkeypatch.setattr(slow_log, "threshold_ms", 10_000)
+    slow_log.wait()
+
+    response = client.get(
+        "/api/admin/slow-queries?limit=100", headers={"X-Admin-Token": "secret"}
+    )
+    assert response.status_code == 200
+    entries = response.get_json()["slow_queries"]
+    explained = [e for e in entries if e["plan"] is not None]
+    assert len(explained) == 2
+    assert all("Execution Time" in e["plan"] for e in explained)
+    assert all("'test'" not in e["plan"] for e in explained)
+    assert any(e["params"] == ["str"] for e in explained)
+    assert "rate_limited" in {e.get("plan_skipped") for e in entries}
+    assert "not_select" in {e.get("plan_skipped") for e in entries}
+
+
+def test_slow_query_explainable():
+    from slow_queries import explainable
+
+    assert explainable("WITH a AS (SELECT 1) SELECT * FROM a")
+    assert not explainable("UPDATE tweets SET like_count = 0")
+    assert not explainable(
+        "SELECT nextval(pg_get_serial_sequence('tweets', 'tweet_id')) "
+        "FROM generate_series(1, %s)"
+    )
+    assert not explainable("SELECT setval('change_version_seq', 1)")
+    assert not explainable("SELECT pg_advisory_xact_lock(%s)")
+    assert not explainable("select PG_TRY_ADVISORY_LOCK (1)")
+
+
+def test_request_profiler(client, test_db, api_headers, monkeypatch, tmp_path):
+    import pstats
+
+    config = client.application.config
+    monkeypatch.setitem(config, "ADMIN_TOKEN", "secret")
+    monkeypatch.setitem(config, "PROFILE_DIR", str(tmp_path))
+    admin = {"X-Admin-Token": "secret"}
+
+    response = client.get("/api/tweets", headers={**api_headers, "X-Profile": "1"})
+    assert response.status_code == 200
+    assert "X-Profile-Id" not in response.headers
+    assert list(tmp_path.iterdir()) == []
+
+    headers = {**api_headers, **admin, "X-Profile": "1", "X-Request-Id": "req-1"}
+    response = client.get("/api/tweets", headers=headers)
+    assert response.status_code == 200
+    assert response.get_json()["result"] is True
+    profile_id = response.headers["X-Profile-Id"]
+
+    assert client.get("/api/admin/profiles").status_code == 403
+    profiles = client.get("/api/admin/profiles?route=/api/tweets", headers=admin)
+    [meta] = profiles.get_json()["profiles"]
+    assert meta["id"] == profile_id
+    assert meta["request_id"] == "req-1"
+    assert meta["status"].startswith("200")
+
+    download = client.get(f"/api/admin/profiles/{profile_id}", headers=admin)
+    assert download.status_code == 200
+    path = tmp_path / "downloaded.prof"
+    path.write_bytes(download.data)
+    stats = pstats.Stats(str(path))
+    assert any(name == "get_timeline" for _, _, name in stats.stats)
+
+    text = client.get(f"/api/admin/profiles/{profile_id}?format=text", headers=admin)
+    assert "get_timeline" in text.get_data(as_text=True)
+    missing = client.get("/api/admin/profiles/../../etc", headers=admin)
+    assert missing.status_code == 404
+
+
+def test_profile_counts_and_follow_pages(client, test_db, api_headers):
+    with test_db.cursor() as cursor:
+        cursor.executemany(
+            "INSERT INTO users (name, api_key) VALUES (%s, %s)",
+            [(f"fan{i}", f"fan{i}") for i in range(3)],
+        )
+    test_db.commit()
+
+    before = client.get("/api/users/2").get_json()["user"]
+    for i in range(3):
+        client.post("/api/users/2/follow", headers={"api-key": f"fan{i}"})
+    client.post("/api/users/2/follow", headers={"api-key": "test2"})
+
+    user = client.get("/api/users/2").get_json()["user"]
+    assert user["followers_count"] == before["followers_count"] + 3
+    assert user["following_count"] == before["following_count"]
+    assert len(user["followers"]) == user["followers_count"]
+    assert "2" not in {entry["id"] for entry in user["followers"]}
+
+    response = client.get("/api/users/2/followers?limit=2")
+    page = response.get_json()
+    assert len(page["followers"]) == 2
+    response = client.get(f"/api/users/2/followers?limit=2&cursor={page['next_cursor']}")
+    rest = response.get_json()["followers"]
+    ids = [entry["id"] for entry in page["followers"] + rest]
+    assert ids == [entry["id"] for entry in user["followers"]]
+
+    fan = client.get("/api/users/me", headers={"api-key": "fan0"}).get_json()["user"]
+    assert fan["following_count"] == 1
+    assert client.get(f"/api/users/{fan['id']}/following").get_json()["following"] == [
+        {"id": "2", "name": "test2"}
+    ]
+
+    client.delete("/api/users/2/follow", headers={"api-key": "fan0"})
+    client.delete("/api/users/2/follow", headers={"api-key": "fan0"})
+    user = client.get("/api/users/2").get_json()["user"]
+    assert user["followers_count"] == before["followers_count"] + 2
+    assert database.reconcile_follow_counts() == 0
+
+    assert client.get("/api/users/2/followers?limit=0").status_code == 400
+    assert client.get("/api/users/33/following").status_code == 404
+
+
+def test_conditional_get(client, test_db, api_headers):
+    response = client.get("/api/tweets", headers=api_headers)
+    etag = response.headers["ETag"]
+    assert response.headers["Cache-Control"] == "private, no-cache"
+    cached = {**api_headers, "If-None-Match": etag}
+    response = client.get("/api/tweets", headers=cached)
+    assert response.status_code == 304 and response.data == b""
+    assert response.headers["ETag"] == etag
+    page = client.get("/api/tweets?limit=5", headers=cached)
+    assert page.status_code == 200 and page.headers["ETag"] != etag
+
+    profile = client.get("/api/users/2")
+    profile_etag = profile.headers["ETag"]
+    assert client.get("/api/users/2", headers={"If-None-Match": profile_etag}).status_code == 304
+    me = client.get("/api/users/me", headers=api_headers).headers["ETag"]
+    assert me != profile_etag
+
+    tweet_id = new_tweet(client, {"api-key": "test2"})
+    assert client.get("/api/tweets", headers=cached).status_code == 200
+    etag = client.get("/api/tweets", headers=api_headers).headers["ETag"]
+    cached["If-None-Match"] = etag
+
+    client.post(f"/api/tweets/{tweet_id}/likes", headers={"api-key": "test2"})
+    assert client.get("/api/tweets", headers=cached).status_code == 200
+    assert client.get("/api/users/2", headers={"If-None-Match": profile_etag}).status_code == 200
+    etag = client.get("/api/tweets", headers=api_headers).headers["ETag"]
+    cached["If-None-Match"] = etag
+    client.delete(f"/api/tweets/{tweet_id}/likes", headers={"api-key": "test2"})
+    client.delete(f"/api/tweets/{tweet_id}/likes", headers={"api-key": "test2"})
+    etag = client.get("/api/tweets", headers=api_headers).headers["ETag"]
+    cached["If-None-Match"] = etag
+    assert client.get("/api/tweets", headers=cached).status_code == 304
+
+    client.delete("/api/users/2/follow", headers=api_headers)
+    assert client.get("/api/tweets", headers=cached).status_code == 200
+    client.post("/api/users/2/follow", headers=api_headers)
+    client.delete(f"/api/tweets/{tweet_id}")
+    assert client.get("/api/users/me", headers={"If-None-Match": me, **api_headers}).status_code == 200
+    assert "ETag" not in client.get("/api/users/33").headers
+
+
+def test_streamed_timeline(client, test_db, api_headers, monkeypatch):
+    tweet_ids = [new_tweet(client, api_headers, f"stream {i}") for i in range(5)]
+    expected = client.get("/api/tweets", headers=api_headers).get_json()
+
+    batches = []
+    stream_timeline = database.stream_timeline
+
+    def small_batches(user_id):
+        for batch in stream_timeline(user_id, batch_size=2):
+            batches.append(len(batch))
+            yield batch
+
+    monkeypatch.setattr("flask_app.app.stream_timeline", small_batches)
+    response = client.get("/api/tweets?stream=1", headers=api_headers)
+    assert response.is_streamed
+    assert response.content_type == "application/json"
+    assert "ETag" not in response.headers
+    assert response.get_json() == expected
+    assert len(batches) > 1 and max(batches) == 2
+
+    monkeypatch.setattr(database, "HYDRATION_MODE", "parallel")
+    streamed = client.get("/api/tweets?stream=1", headers=api_headers).get_json()
+    assert [t["id"] for t in streamed["tweets"]] == [t["id"] for t in expected["tweets"]]
+    assert client.get("/api/tweets?stream=1", headers={"api-key": "nobody"}).status_code == 404
+    for tweet_id in tweet_ids:
+        client.delete(f"/api/tweets/{tweet_id}")
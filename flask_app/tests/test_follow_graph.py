@@ -0,0 +1,110 @@
+import database
+import follow_graph
+import pytest
+from follow_graph import FollowGraph
+
+EDGES = [(1, 2), (1, 3), (2, 3), (4, 1), (4, 3)]
+
+
+def make_graph(**kwargs):
+    edges = sorted(EDGES)
+    return FollowGraph([a for a, _ in edges], [b for _, b in edges], **kwargs)
+
+
+def test_csr_and_overlay():
+    graph = make_graph()
+    assert graph.following(1) == [2, 3]
+    assert graph.followers(3) == [1, 2, 4]
+    assert graph.followers(99) == []
+    assert graph.is_following(4, 1) and not graph.is_following(1, 4)
+
+    graph.follow(5, 3)
+    graph.follow(1, 1)
+    graph.unfollow(2, 3)
+    graph.unfollow(2, 3)
+    assert graph.followers(3) == [1, 4, 5]
+    assert graph.following(1) == [2, 3]
+    assert graph.page(3, "followers", 1, 1) == [4]
+    assert graph.page(1, "following", None, 10) == [2, 3]
+    assert graph.count(3, "followers") == 3
+    assert graph.stats()["edges"] == 5
+
+    graph.follow(2, 3)
+    assert graph.followers(3) == [1, 2, 4, 5]
+    assert graph.stats()["pending_changes"] == 1
+
+
+def test_compaction_keeps_edges():
+    graph = make_graph(compact_threshold=2)
+    graph.follow(6, 1)
+    graph.unfollow(1, 2)
+    graph.follow(3, 6)
+    assert graph.stats()["pending_changes"] == 0
+    assert graph.followers(1) == [4, 6]
+    assert graph.following(1) == [3]
+    assert graph.followers(6) == [3]
+    assert graph.page(3, "followers", 1, 10) == [2, 4]
+
+
+def test_compaction_does_not_block_writes(monkeypatch):
+    graph = make_graph(compact_threshold=1)
+    build_csr = follow_graph.build_csr
+    during = []
+
+    def build_with_writes(*args):
+        # Массивы строятся без блокировки: чтение и запись не ждут
+        if not during:
+            during.append(graph.following(1))
+            graph.unfollow(4, 3)
+            graph.follow(7, 1)
+            graph.unfollow(6, 1)
+        return build_csr(*args)
+
+    monkeypatch.setattr(follow_graph, "build_csr", build_with_writes)
+    graph.follow(6, 1)
+    graph.unfollow(1, 2)
+    assert during == [[3]]
+    assert graph.followers(1) == [4, 7]
+    assert graph.following(4) == [1]
+    assert graph.following(1) == [3]
+    # Изменения за время пересборки остались в наложении поверх новых массивов
+    assert graph.stats()["pending_changes"] == 3
+    assert graph.stats()["edges"] == 4
+
+
+@pytest.fixture
+def graph_enabled(app):
+    database.enable_follow_graph()
+    database.profile_cache.clear()
+    yield
+    database.enable_follow_graph(False)
+    database.profile_cache.clear()
+
+
+def timeline_ids(client, api_key):
+    response = client.get("/api/tweets", headers={"api-key": api_key})
+    return [tweet["id"] for tweet in response.get_json()["tweets"]]
+
+
+def test_graph_backed_reads(client, graph_enabled):
+    database.enable_follow_graph(False)
+    expected_timeline = timeline_ids(client, "test")
+    expected_profile = client.get("/api/users/2").get_json()["user"]
+    expected_page = client.get("/api/users/2/followers?limit=2").get_json()
+    database.enable_follow_graph()
+    database.profile_cache.clear()
+
+    assert timeline_ids(client, "test") == expected_timeline
+    assert client.get("/api/users/2").get_json()["user"] == expected_profile
+    assert client.get("/api/users/2/followers?limit=2").get_json() == expected_page
+    assert database.follow_graph_stats()["loaded"] == 1
+
+    tweet_id = client.post(
+        "/api/tweets", headers={"api-key": "test2"}, json={"tweet_data": "graph"}
+    ).get_json()["tweet_id"]
+    client.delete("/api/users/2/follow", headers={"api-key": "test"})
+    assert 2 not in database.follow_graph().following(1)
+    assert str(tweet_id) not in timeline_ids(client, "test")
+    client.post("/api/users/2/follow", headers={"api-key": "test"})
+    assert str(tweet_id) in timeline_ids(client, "test")
+    client.delete(f"/api/tweets/{tweet_id}")
@@ -0,0 +1,205 @@
+import importlib.util
+import io
+import os
+import shutil
+import stat
+import sys
+import time
+import uuid
+
+import database
+import jobs
+import pytest
+from jobs import JobWorker
+from media_processing import image_info, make_preview
+from uploads import store_upload
+from werkzeug.datastructures import FileStorage
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def read_test_file():
+    with open(os.path.join(BASE_DIR, "test_file.jpg"), "rb") as f:
+        return f.read()
+
+
+def drain(worker):
+    while worker.run_once():
+        pass
+
+
+def enqueue(kind, payload, max_attempts=None):
+    with database.connection() as conn, conn.cursor() as cursor:
+        database.enqueue_job(cursor, kind, payload, max_attempts=max_attempts)
+        conn.commit()
+
+
+def job_row(kind):
+    with database.connection() as conn, conn.cursor() as cursor:
+        cursor.execute(
+            "SELECT id, status, attempts, last_error FROM jobs WHERE kind = %s", (kind,)
+        )
+        return cursor.fetchone()
+
+
+def test_image_info_reads_headers(tmp_path):
+    assert image_info(os.path.join(BASE_DIR, "test_file.jpg"))["width"] == 591
+
+    png = tmp_path / "a.png"
+    png.write_bytes(
+        b"\x89PNG\r\n\x1a\n\x00\x00\x00\rIHDR"
+        + (300).to_bytes(4, "big")
+        + (200).to_bytes(4, "big")
+        + b"\x08\x06\x00\x00\x00"
+    )
+    assert image_info(str(png)) == {
+        "format": "png",
+        "width": 300,
+        "height": 200,
+        "bit_depth": 8,
+        "alpha": True,
+        "interlaced": False,
+    }
+
+    gif = tmp_path / "a.gif"
+    gif.write_bytes(b"GIF89a" + (16).to_bytes(2, "little") + (9).to_bytes(2, "little"))
+    assert image_info(str(gif))["height"] == 9
+
+    broken = tmp_path / "broken.jpg"
+    broken.write_bytes(b"\xff\xd8\xff\xe0\x00\x04ab")
+    with pytest.raises(ValueError):
+        image_info(str(broken))
+
+
+def test_make_preview(tmp_path, monkeypatch):
+    pytest.importorskip("PIL")
+    from PIL import Image
+
+    original = tmp_path / "photo.jpg"
+    shutil.copy(os.path.join(BASE_DIR, "test_file.jpg"), original)
+    preview = make_preview(str(original), size=100)
+    assert preview == str(tmp_path / "photo.preview.jpg")
+    with Image.open(preview) as image:
+        assert max(image.size) == 100 and image.format == "JPEG"
+    assert stat.S_IMODE(os.stat(preview).st_mode) == 0o644
+    assert sorted(os.listdir(tmp_path)) == ["photo.jpg", "photo.preview.jpg"]
+
+    broken = tmp_path / "broken.gif"
+    broken.write_bytes(b"GIF89a" + bytes(20))
+    with pytest.raises(ValueError):
+        make_preview(str(broken))
+    assert not any(name.endswith(".tmp") for name in os.listdir(tmp_path))
+
+    # Без Pillow превью не строится
+    monkeypatch.setitem(sys.modules, "PIL", None)
+    assert make_preview(str(original)) is None
+
+
+def test_media_job_fills_dimensions(client, api_headers):
+    response = client.post(
+        "/api/medias",
+        headers=api_headers,
+        content_type="multipart/form-data",
+        data={"file": (io.BytesIO(read_test_file()), "a.jpg")},
+    )
+    media_id = response.get_json()["media_id"]
+    assert database.job_stats()["queued"] >= 1
+
+    worker = JobWorker(2, poll_interval=0.05)
+    worker.start()
+    deadline = time.monotonic() + 5
+    while database.job_stats()["queued"] and time.monotonic() < deadline:
+        time.sleep(0.05)
+    worker.stop()
+    with database.connection() as conn, conn.cursor() as cursor:
+        cursor.execute(
+            """
+            SELECT width, height, metadata, preview_path, processed_at
+            FROM media WHERE id = %s
+            """,
+            (media_id,),
+        )
+        width, height, metadata, preview, processed_at = cursor.fetchone()
+    assert (width, height) == (591, 1280)
+    assert metadata["format"] == "jpeg" and metadata["progressive"]
+    assert processed_at is not None
+    assert (preview is None) == (importlib.util.find_spec("PIL") is None)
+    assert database.job_stats()["queued"] == 0
+
+
+def test_retries_and_visibility_timeout(app, monkeypatch):
+    calls = []
+
+    def flaky(payload):
+        calls.append(payload)
+        if len(calls) == 1:
+            raise RuntimeError("temporary")
+
+    monkeypatch.setitem(jobs.handlers, "test.flaky", flaky)
+    enqueue("test.flaky", {"n": 1})
+    worker = JobWorker(1, kinds=["test.flaky"], retry_delay=0)
+    assert worker.run_once() == 1
+    _, status, attempts, error = job_row("test.flaky")
+    assert (status, attempts, error) == ("queued", 1, "RuntimeError: temporary")
+    drain(worker)
+    assert job_row("test.flaky") is None and len(calls) == 2
+
+    # Задачу, которую не завершили вовремя, забирает следующий воркер
+    enqueue("test.lost", {}, max_attempts=2)
+    [(job_id, _, _, attempt)] = database.claim_jobs(1, 0, ["test.lost"])
+    [(_, _, _, retry)] = database.claim_jobs(1, 0, ["test.lost"])
+    assert (attempt, retry) == (1, 2)
+    database.complete_job(job_id, attempt)
+    assert job_row("test.lost")[1] == "running"
+    assert database.claim_jobs(1, 0, ["test.lost"]) == []
+    assert job_row("test.lost")[1] == "failed"
+
+    enqueue("test.unknown", {})
+    assert not worker.execute(*database.claim_jobs(1, 60, ["test.unknown"])[0])
+    assert job_row("test.unknown")[1] == "failed"
+    assert database.retry_failed_jobs("test.unknown") == 1
+    with database.connection() as conn, conn.cursor() as cursor:
+        cursor.execute("DELETE FROM jobs WHERE kind LIKE 'test.%'")
+        conn.commit()
+
+
+def test_deleted_tweet_files_are_removed(client, api_headers):
+    content = read_test_file() + uuid.uuid4().bytes
+    response = client.post(
+        "/api/medias",
+        headers=api_headers,
+        content_type="multipart/form-data",
+        data={"file": (io.BytesIO(content), "unique.jpg")},
+    )
+    media_id = response.get_json()["media_id"]
+    tweet_id = client.post(
+        "/api/tweets",
+        headers=api_headers,
+        json={"tweet_data": "with file", "tweet_media_ids": [media_id]},
+    ).get_json()["tweet_id"]
+    worker = JobWorker(2)
+    drain(worker)
+    path = database.get_media_file(media_id)[0]
+    assert os.path.exists(path)
+
+    assert client.delete(f"/api/tweets/{tweet_id}").status_code == 200
+    assert database.get_media_file(media_id) is None
+    assert os.path.exists(path)
+    # Файл только что загружен: пока он свежий, задача его не удаляет
+    drain(worker)
+    assert os.path.exists(path)
+
+    enqueue("files.delete", {"paths": [path]})
+    os.utime(path, (0, 0))
+    # Повторная загрузка того же содержимого освежает файл ещё до записи в media
+    folder = client.application.config["UPLOAD_FOLDER"]
+    stored = store_upload(FileStorage(io.BytesIO(content)), folder)
+    assert stored.file_path == path
+    drain(worker)
+    assert os.path.exists(path)
+
+    enqueue("files.delete", {"paths": [path]})
+    os.utime(path, (0, 0))
+    drain(worker)
+    assert not os.path.exists(path)
+    assert not os.path.exists(path + ".deleting")
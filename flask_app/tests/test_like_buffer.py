@@ -0,0 +1,102 @@
+import time
+
+import database
+import pytest
+from like_buffer import LikeBuffer
+
+
+class Recorder:
+    def __init__(self, fail=0):
+        self.batches = []
+        self.fail = fail
+
+    def __call__(self, intents):
+        if self.fail:
+            self.fail -= 1
+            raise RuntimeError("db is down")
+        self.batches.append(intents)
+
+
+def test_toggles_collapse_and_flush_per_user():
+    write = Recorder()
+    buffer = LikeBuffer(write, interval=60)
+    buffer.add(1, 10, True)
+    buffer.add(1, 10, False)
+    buffer.add(1, 10, True)
+    buffer.add(2, 10, False)
+    buffer.add(1, 5, True)
+    assert buffer.stats()["pending"] == 3
+    assert buffer.stats()["collapsed"] == 2
+
+    assert buffer.flush(2) == 1
+    assert write.batches == [[(10, 2, False)]]
+    assert not buffer.has_pending(2) and buffer.has_pending(1)
+
+    buffer.close()
+    assert write.batches[1] == [(5, 1, True), (10, 1, True)]
+    buffer.add(3, 7, True)
+    assert write.batches[2] == [(7, 3, True)]
+
+
+def test_max_ops_wakes_flusher():
+    write = Recorder()
+    buffer = LikeBuffer(write, interval=60, max_ops=2)
+    buffer.add(1, 1, True)
+    buffer.add(1, 2, True)
+    deadline = time.monotonic() + 2
+    while not write.batches and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert write.batches == [[(1, 1, True), (2, 1, True)]]
+    buffer.close()
+
+
+def test_failed_batch_is_retried_once():
+    write = Recorder(fail=1)
+    buffer = LikeBuffer(write, interval=60)
+    buffer.add(1, 1, True)
+    buffer.add(1, 2, True)
+    assert buffer.flush() == 0
+    buffer.add(1, 2, False)
+    assert buffer.flush() == 2
+    assert write.batches == [[(1, 1, True), (2, 1, False)]]
+
+    write.fail = 2
+    buffer.add(1, 3, True)
+    buffer.flush()
+    buffer.flush()
+    assert buffer.stats()["pending"] == 0
+    assert buffer.stats()["dropped"] == 1
+    buffer.close()
+
+
+@pytest.fixture
+def like_buffer(app, monkeypatch):
+    monkeypatch.setattr(database, "LIKE_BUFFER_INTERVAL_MS", 60_000)
+    database.enable_like_buffer()
+    yield
+    database.enable_like_buffer(False)
+
+
+def like_count(tweet_id):
+    with database.connection() as conn, conn.cursor() as cursor:
+        cursor.execute("SELECT like_count FROM tweets WHERE tweet_id = %s", (tweet_id,))
+        return cursor.fetchone()[0]
+
+
+def test_write_behind_likes(client, api_headers, like_buffer):
+    tweet_id = client.post(
+        "/api/tweets", headers=api_headers, json={"tweet_data": "viral"}
+    ).get_json()["tweet_id"]
+    url = f"/api/tweets/{tweet_id}/likes"
+    for method in (client.post, client.delete, client.post):
+        assert method(url, headers=api_headers).status_code == 200
+    assert client.post(url, headers={"api-key": "test2"}).status_code == 200
+    assert like_count(tweet_id) == 0
+
+    tweets = client.get("/api/tweets", headers=api_headers).get_json()["tweets"]
+    tweet = next(tweet for tweet in tweets if tweet["id"] == str(tweet_id))
+    assert [like["user_id"] for like in tweet["likes"]] == ["1"]
+    assert database.like_buffer_stats()["pending"] == 1
+
+    database.enable_like_buffer(False)
+    assert like_count(tweet_id) == 2
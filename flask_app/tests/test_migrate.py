@@ -0,0 +1,127 @@
+import threading
+import types
+
+import database
+import migrate
+import psycopg2.errors
+import pytest
+from migrate import Migration, batched_range_update, current_version, discover, upgrade
+
+
+def test_upgrade_populated_database(test_db):
+    conn = database.test_connection()
+    with conn.cursor() as cursor:
+        cursor.execute("CREATE SCHEMA migtest")
+        cursor.execute("SET search_path TO migtest")
+    conn.commit()
+    try:
+        assert upgrade(conn, target=1) == [1]
+        with conn.cursor() as cursor:
+            cursor.execute(
+                "INSERT INTO users (name, api_key) VALUES ('a', 'a'), ('b', 'b')"
+            )
+            cursor.execute(
+                "INSERT INTO tweets (tweet_data, api_key) "
+                "VALUES ('x', 'a'), ('y', 'b'), ('z', 'b')"
+            )
+            cursor.execute("INSERT INTO likes VALUES (1, 2), (2, 2), (1, 3)")
+            cursor.execute("INSERT INTO followers VALUES (1, 2), (2, 2), (1, 1)")
+        conn.commit()
+
+        latest = discover()[-1].version
+        assert upgrade(conn)[-1] == latest
+        assert upgrade(conn) == []
+        assert current_version(conn) == latest
+
+        with conn.cursor() as cursor:
+            cursor.execute(
+                "SELECT tweet_id, author_id, like_count FROM tweets ORDER BY tweet_id"
+            )
+            assert cursor.fetchall() == [(1, 1, 0), (2, 2, 2), (3, 2, 1)]
+            cursor.execute(
+                "SELECT id, followers_count, following_count FROM users ORDER BY id"
+            )
+            assert cursor.fetchall() == [(1, 0, 1), (2, 1, 0)]
+            cursor.execute("INSERT INTO tweets (tweet_data, api_key) VALUES ('n', 'a')")
+            cursor.execute("SELECT author_id FROM tweets WHERE tweet_data = 'n'")
+            assert cursor.fetchone() == (1,)
+            cursor.execute(
+                """
+                SELECT count(*) FROM pg_index
+                WHERE indexrelid IN (
+                    to_regclass('likes_tweet_id_idx'),
+                    to_regclass('followers_followed_id_idx'),
+                    to_regclass('tweets_author_id_idx'),
+                    to_regclass('tweets_rank_idx')
+                ) AND indisvalid
+                """
+            )
+            assert cursor.fetchone() == (4,)
+            cursor.execute("SELECT to_regclass('tweets_api_key_idx')")
+            assert cursor.fetchone() == (None,)
+        conn.rollback()
+
+        with conn.cursor() as cursor:
+            cursor.execute("UPDATE tweets SET like_count = 0")
+        conn.commit()
+        changed = batched_range_update(
+            conn,
+            """
+            UPDATE tweets t SET like_count = c.n
+            FROM (
+                SELECT tweet_id, COUNT(*) AS n FROM likes
+                WHERE tweet_id BETWEEN %(lo)s AND %(hi)s GROUP BY tweet_id
+            ) c
+            WHERE t.tweet_id = c.tweet_id AND t.tweet_id BETWEEN %(lo)s AND %(hi)s
+            """,
+            "tweets",
+            "tweet_id",
+            batch_size=1,
+        )
+        assert changed == 2
+    finally:
+        with conn.cursor() as cursor:
+            cursor.execute("DROP SCHEMA migtest CASCADE")
+        conn.commit()
+        conn.close()
+
+
+def test_upgrade_retries_lock_timeout(test_db, monkeypatch):
+    holder = database.test_connection()
+    conn = database.test_connection()
+    with holder.cursor() as cursor:
+        cursor.execute("CREATE TABLE lock_probe (id INTEGER)")
+    holder.commit()
+
+    def add_column(conn):
+        with conn.cursor() as cursor:
+            cursor.execute("ALTER TABLE lock_probe ADD COLUMN name TEXT")
+
+    module = types.SimpleNamespace(TRANSACTIONAL=True, upgrade=add_column)
+    monkeypatch.setattr(migrate, "discover", lambda: [Migration(9999, "probe", module)])
+    monkeypatch.setattr(migrate, "LOCK_TIMEOUT", "50ms")
+    monkeypatch.setattr(migrate, "LOCK_RETRY_DELAY", 0.1)
+    try:
+        # Таблицу держит другая транзакция, пока миграция не повторится
+        with holder.cursor() as cursor:
+            cursor.execute("LOCK TABLE lock_probe IN ACCESS EXCLUSIVE MODE")
+        threading.Timer(0.3, holder.commit).start()
+        assert upgrade(conn) == [9999]
+
+        monkeypatch.setattr(migrate, "LOCK_RETRIES", 1)
+        with holder.cursor() as cursor:
+            cursor.execute("DELETE FROM schema_migrations WHERE version = 9999")
+            cursor.execute("ALTER TABLE lock_probe DROP COLUMN name")
+        holder.commit()
+        with holder.cursor() as cursor:
+            cursor.execute("LOCK TABLE lock_probe IN ACCESS EXCLUSIVE MODE")
+        with pytest.raises(psycopg2.errors.LockNotAvailable):
+            upgrade(conn)
+        holder.rollback()
+    finally:
+        with holder.cursor() as cursor:
+            cursor.execute("DELETE FROM schema_migrations WHERE version = 9999")
+            cursor.execute("DROP TABLE lock_probe")
+        holder.commit()
+        holder.close()
+        conn.close()
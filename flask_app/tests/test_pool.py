@@ -0,0 +1,44 @@
+import threading
+
+import pytest
+import database
+from pool import ConnectionPool, PoolTimeout
+
+
+def test_pool_reuses_connections(test_db):
+    pool = ConnectionPool(database.test_connection, minconn=1, maxconn=2)
+    conn = pool.getconn()
+    pool.putconn(conn)
+    assert pool.getconn() is conn
+    pool.putconn(conn)
+    assert pool.stats()["created"] == 1
+    pool.closeall()
+
+
+def test_pool_timeout_when_exhausted(test_db):
+    pool = ConnectionPool(database.test_connection, minconn=0, maxconn=1, timeout=0.1)
+    conn = pool.getconn()
+    with pytest.raises(PoolTimeout):
+        pool.getconn()
+    assert pool.stats()["timeouts"] == 1
+
+    threading.Timer(0.05, pool.putconn, (conn,)).start()
+    pool.timeout = 2
+    assert pool.getconn() is conn
+    assert pool.stats()["waits"] == 1
+    pool.putconn(conn)
+    pool.closeall()
+
+
+def test_pool_discards_broken_connection(test_db):
+    pool = ConnectionPool(database.test_connection, minconn=0, maxconn=1, check_interval=0)
+    conn = pool.getconn()
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT 1")
+    pool.putconn(conn)
+    conn.close()
+    fresh = pool.getconn()
+    assert fresh is not conn and not fresh.closed
+    assert pool.stats()["discarded"] == 1
+    pool.putconn(fresh)
+    pool.closeall()
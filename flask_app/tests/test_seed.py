@@ -0,0 +1,63 @@
+import random
+from collections import Counter
+
+import database
+from seed import (
+    IdBase,
+    SeedConfig,
+    generate_followers,
+    generate_likes,
+    power_law_rank,
+    seed_database,
+)
+
+CONFIG = SeedConfig(users=200, follows=10, tweets=3, likes=15, media_ratio=0.2, seed=7)
+BASE = IdBase(user=1000, tweet=5000, media=100)
+
+
+def test_generators_are_deterministic_and_skewed():
+    assert list(generate_followers(CONFIG, BASE)) == list(generate_followers(CONFIG, BASE))
+    other = CONFIG._replace(seed=8)
+    assert list(generate_followers(CONFIG, BASE)) != list(generate_followers(other, BASE))
+
+    follows = list(generate_followers(CONFIG, BASE))
+    assert len(follows) == len(set(follows))
+    assert all(follower != followed for follower, followed in follows)
+    followers = Counter(followed for _, followed in follows)
+    top = sum(n for _, n in followers.most_common(CONFIG.users // 10))
+    assert top > len(follows) / 3
+
+    likes = list(generate_likes(CONFIG, BASE))
+    assert len(likes) == len(set(likes))
+
+    rng = random.Random(1)
+    ranks = [power_law_rank(rng, 1000, 1.2) for _ in range(10000)]
+    assert 0 <= min(ranks) and max(ranks) < 1000
+    assert sum(rank < 10 for rank in ranks) > sum(rank >= 500 for rank in ranks)
+
+
+def test_seed_database(test_db):
+    database.set_database(database.test_connection)
+    loaded = seed_database(CONFIG._replace(users=30))
+    assert loaded["users"] == 30 and loaded["tweets"] > 0
+
+    with test_db.cursor() as cursor:
+        cursor.execute(
+            "SELECT COUNT(*) FROM tweets t WHERE like_count <> "
+            "(SELECT COUNT(*) FROM likes l WHERE l.tweet_id = t.tweet_id)"
+        )
+        assert cursor.fetchone()[0] == 0
+        cursor.execute(
+            "SELECT COUNT(*) FROM tweet_media tm JOIN tweets t USING (tweet_id) "
+            "WHERE t.api_key LIKE 'seed7-%%'"
+        )
+        assert cursor.fetchone()[0] == loaded["tweet_media"]
+        # Последовательности сдвинуты: обычная вставка не конфликтует с загруженными id
+        cursor.execute(
+            "INSERT INTO users (name, api_key) VALUES ('after-seed', 'after-seed') RETURNING id"
+        )
+        user_id = cursor.fetchone()[0]
+        cursor.execute("DELETE FROM users WHERE id = %s", (user_id,))
+        cursor.execute("SELECT MAX(id) FROM users")
+        assert user_id > cursor.fetchone()[0]
+    test_db.commit()
@@ -0,0 +1,98 @@
+import database
+import psycopg2
+import psycopg2.extensions
+import pytest
+from statements import Statement, StatementRegistry
+
+
+def test_statement_placeholders():
+    statement = Statement("SELECT %(a)s, %(b)s, %(a)s, 'x%%' WHERE 1 = 1")
+    assert statement.text == "SELECT $1, $2, $1, 'x%' WHERE 1 = 1"
+    assert statement.values({"b": 2, "a": 1}) == (1, 2)
+    assert statement.execute_sql() == f"EXECUTE {statement.name} (%s, %s)"
+    positional = Statement("SELECT * FROM users WHERE id = ANY(%s) LIMIT %s")
+    assert positional.text.endswith("ANY($1) LIMIT $2")
+    assert positional.values(([1], 5)) == ([1], 5)
+
+
+def test_prepare_once_and_reprepare(test_db):
+    registry = StatementRegistry(enabled=True)
+    with test_db.cursor() as cursor:
+        cursor.execute("CREATE TEMP TABLE prepared_t (a INTEGER)")
+        cursor.execute("INSERT INTO prepared_t VALUES (1), (2)")
+    test_db.commit()
+
+    def run(conn, sql="SELECT * FROM prepared_t WHERE a >= %(min)s ORDER BY a"):
+        with conn.cursor() as cursor:
+            registry.execute(cursor, sql, {"min": 1})
+            rows = cursor.fetchall()
+        conn.commit()
+        return rows
+
+    assert run(test_db) == [(1,), (2,)]
+    assert run(test_db) == [(1,), (2,)]
+    stats = registry.stats()
+    assert stats["prepares"] == 1 and stats["executions"] == 2
+
+    with test_db.cursor() as cursor:
+        cursor.execute("DEALLOCATE ALL")
+    # Транзакция уже начата: повторить запрос незаметно нельзя
+    with pytest.raises(psycopg2.errors.InvalidSqlStatementName):
+        run(test_db)
+    test_db.rollback()
+    assert run(test_db) == [(1,), (2,)]
+    with test_db.cursor() as cursor:
+        cursor.execute("ALTER TABLE prepared_t ADD COLUMN b INTEGER DEFAULT 0")
+    test_db.commit()
+    assert run(test_db) == [(1, 0), (2, 0)]
+    assert registry.stats()["reprepares"] == 1
+
+    # План устарел посреди транзакции (как на соединении запроса Flask):
+    # ошибка уходит наверх, а следующий вызов готовит запрос заново
+    with test_db.cursor() as cursor:
+        cursor.execute("ALTER TABLE prepared_t ADD COLUMN c INTEGER DEFAULT 1")
+    test_db.commit()
+    with test_db.cursor() as cursor:
+        cursor.execute("SELECT 1")
+    with pytest.raises(psycopg2.errors.FeatureNotSupported):
+        run(test_db)
+    test_db.rollback()
+    with test_db.cursor() as cursor:
+        cursor.execute("SELECT 1")
+    assert run(test_db) == [(1, 0, 1), (2, 0, 1)]
+
+    other = database.test_connection()
+    try:
+        with other.cursor() as cursor:
+            registry.execute(cursor, "SELECT %s::int + 1", (1,))
+            assert cursor.fetchone() == (2,)
+    finally:
+        other.close()
+    assert registry.stats()["prepares"] == 5
+
+    registry.enabled = False
+    with test_db.cursor() as cursor:
+        registry.execute(cursor, "SELECT %s::int + 1", (2,))
+        assert cursor.fetchone() == (3,)
+    test_db.rollback()
+    assert registry.stats()["adhoc"] == 1
+
+
+def test_service_statements_use_cursor_hook(test_db):
+    class RecordingCursor(psycopg2.extensions.cursor):
+        calls = []
+
+        def execute_untraced(self, query):
+            self.calls.append(query.split()[0])
+            return super().execute(query)
+
+    registry = StatementRegistry(enabled=True)
+    with test_db.cursor(cursor_factory=RecordingCursor) as cursor:
+        registry.execute(cursor, "SELECT %s::integer", (1,))
+        assert cursor.fetchone() == (1,)
+    test_db.rollback()
+    assert RecordingCursor.calls == ["PREPARE"]
+    registry.forget(test_db)
+    with test_db.cursor() as cursor:
+        cursor.execute("DEALLOCATE ALL")
+    test_db.commit()
@@ -0,0 +1,54 @@
+import gzip
+import os
+import stat
+
+from static_assets import IMMUTABLE, REVALIDATE, precompress
+
+
+def test_hashed_bundle_gzip_and_immutable(client):
+    url = "/static/js/chunk-vendors.398321e0.js"
+    plain = client.get(url)
+    assert plain.status_code == 200
+    assert plain.headers.get("Content-Encoding") is None
+    assert plain.headers["Cache-Control"] == IMMUTABLE
+    assert "Accept-Encoding" in plain.headers["Vary"]
+
+    packed = client.get(url, headers={"Accept-Encoding": "gzip, deflate"})
+    assert packed.headers["Content-Encoding"] == "gzip"
+    assert "javascript" in packed.headers["Content-Type"]
+    assert gzip.decompress(packed.data) == plain.data
+    assert packed.headers["ETag"] != plain.headers["ETag"]
+    plain.close()
+    packed.close()
+
+
+def test_sourcemaps_hidden_outside_debug(client):
+    assert client.get("/static/js/app.7c9275be.js.map").status_code == 404
+    client.application.config["STATIC_SOURCEMAPS"] = True
+    try:
+        response = client.get("/static/js/app.7c9275be.js.map")
+        assert response.status_code == 200
+        response.close()
+    finally:
+        client.application.config["STATIC_SOURCEMAPS"] = False
+
+
+def test_index_strong_etag(client):
+    response = client.get("/", headers={"Accept-Encoding": "gzip"})
+    assert response.status_code == 200
+    assert response.headers["Cache-Control"] == REVALIDATE
+    etag = response.headers["ETag"]
+    assert not etag.startswith("W/")
+    assert b"twitter-clone" in gzip.decompress(response.data)
+
+    again = client.get("/", headers={"Accept-Encoding": "gzip", "If-None-Match": etag})
+    assert again.status_code == 304
+    assert client.get("/", headers={"If-None-Match": etag}).status_code == 200
+
+
+def test_precompress_skips_sourcemaps(tmp_path):
+    (tmp_path / "app.js").write_text("var a = 1;\n" * 200)
+    (tmp_path / "app.js.map").write_text('{"mappings": ""}' * 200)
+    assert precompress(str(tmp_path)) == {"app.js"}
+    assert sorted(os.listdir(tmp_path)) == ["app.js", "app.js.gz", "app.js.map"]
+    assert stat.S_IMODE(os.stat(tmp_path / "app.js.gz").st_mode) == 0o644
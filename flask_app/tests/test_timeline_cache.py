@@ -0,0 +1,196 @@
+import database
+import pytest
+from timeline_cache import PUSH_SCRIPT, InProcessTimelineStore, RedisTimelineStore
+
+
+class FakeRedis:
+    """Локальная замена redis-py: только команды, нужные RedisTimelineStore"""
+
+    def __init__(self):
+        self.data = {}
+        self.ttls = {}
+
+    def pipeline(self):
+        return FakePipeline(self)
+
+    def register_script(self, script):
+        assert script == PUSH_SCRIPT
+
+        def push(keys, args):
+            # То же, что PUSH_SCRIPT, одним шагом
+            length, ttl, *tweet_ids = args
+            for key in keys:
+                if self.exists(key):
+                    self.zadd(key, {str(t): t for t in tweet_ids})
+                    self.zrem(key, "0")
+                    self.zremrangebyrank(key, 0, -length - 1)
+                    self.expire(key, ttl)
+            return 0
+
+        return push
+
+    def exists(self, key):
+        return int(key in self.data)
+
+    def delete(self, key):
+        self.ttls.pop(key, None)
+        return int(self.data.pop(key, None) is not None)
+
+    def expire(self, key, ttl):
+        if key in self.data:
+            self.ttls[key] = ttl
+        return self.exists(key)
+
+    def zadd(self, key, mapping):
+        self.data.setdefault(key, {}).update(mapping)
+
+    def zrevrange(self, key, start, end):
+        members = sorted(self.data.get(key, {}).items(), key=lambda m: -m[1])
+        return [m.encode() for m, _ in members]
+
+    def zremrangebyrank(self, key, start, end):
+        members = sorted(self.data.get(key, {}).items(), key=lambda m: m[1])
+        for member, _ in members[start : max(len(members) + end + 1, 0)]:
+            del self.data[key][member]
+
+    def zrem(self, key, *members):
+        zset = self.data.get(key, {})
+        for member in members:
+            zset.pop(member, None)
+        if key in self.data and not zset:
+            del self.data[key]
+
+    def sadd(self, key, value):
+        self.data.setdefault(key, set()).add(str(value).encode())
+
+    def smembers(self, key):
+        return self.data.get(key, set())
+
+
+class FakePipeline:
+    def __init__(self, client):
+        self.client = client
+        self.calls = []
+
+    def __getattr__(self, name):
+        def command(*args):
+            self.calls.append((name, args))
+
+        return command
+
+    def execute(self):
+        return [getattr(self.client, name)(*args) for name, args in self.calls]
+
+
+@pytest.fixture(params=["memory", "redis"])
+def store(request):
+    if request.param == "memory":
+        return InProcessTimelineStore(length=3)
+    return RedisTimelineStore(FakeRedis(), length=3)
+
+
+def test_store_keeps_latest_tweets(store):
+    assert store.get(1) is None
+    store.load(1, [])
+    assert store.get(1) == []
+
+    store.push([1, 2], [5, 3, 7, 9])
+    assert store.get(1) == [9, 7, 5]
+    assert store.get(2) is None
+
+    store.remove([1], [7])
+    assert store.get(1) == [9, 5]
+    store.evict(1)
+    assert store.get(1) is None
+
+    store.add_celebrity(4)
+    assert store.celebrities() == {4}
+
+
+def test_redis_push_keeps_ttl_and_skips_missing():
+    client = FakeRedis()
+    store = RedisTimelineStore(client, length=3, ttl=60)
+    store.load(1, [])
+    client.ttls["timeline:1"] = 5
+    store.push([1, 2], [4, 5])
+    assert store.get(1) == [5, 4]
+    assert client.ttls == {"timeline:1": 60}
+    # Ленты, которой нет (истекла или вытеснена), push не создаёт
+    assert "timeline:2" not in client.data
+
+
+def test_memory_store_expires_timelines(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr("timeline_cache.time.monotonic", lambda: now[0])
+    store = InProcessTimelineStore(length=3, max_users=1, ttl=10)
+    store.load(1, [1, 2])
+    now[0] += 9
+    assert store.get(1) == [2, 1]
+    now[0] += 1
+    assert store.get(1) is None
+    store.push([1], [3])
+    assert store.get(1) is None
+
+    store.load(1, [1])
+    store.load(2, [2])
+    assert store.get(1) is None and store.get(2) == [2]
+
+
+@pytest.fixture
+def timeline_store(client):
+    # Пользователь test читает твиты test2
+    client.post("/api/users/2/follow", headers={"api-key": "test"})
+    store = InProcessTimelineStore()
+    database.set_timeline_store(store)
+    yield store
+    database.set_timeline_store(None)
+
+
+def timeline_ids(client, api_key):
+    response = client.get("/api/tweets", headers={"api-key": api_key})
+    return [tweet["id"] for tweet in response.get_json()["tweets"]]
+
+
+def test_cached_timeline_follows_writes(client, timeline_store, monkeypatch):
+    database.set_timeline_store(None)
+    expected = timeline_ids(client, "test")
+    database.set_timeline_store(timeline_store)
+    assert timeline_ids(client, "test") == expected
+    assert timeline_store.get(1) is not None
+
+    headers = {"api-key": "test2"}
+    tweet_id = client.post(
+        "/api/tweets", headers=headers, json={"tweet_data": "fan-out"}
+    ).get_json()["tweet_id"]
+    assert timeline_store.get(1)[0] == tweet_id
+    assert str(tweet_id) in timeline_ids(client, "test")
+
+    client.delete("/api/users/2/follow", headers={"api-key": "test"})
+    assert timeline_store.get(1) is None
+    assert str(tweet_id) not in timeline_ids(client, "test")
+    client.post("/api/users/2/follow", headers={"api-key": "test"})
+    assert str(tweet_id) in timeline_ids(client, "test")
+
+    client.delete(f"/api/tweets/{tweet_id}")
+    assert str(tweet_id) not in timeline_ids(client, "test")
+
+    monkeypatch.setattr(database, "FANOUT_MAX_FOLLOWERS", 0)
+    tweet_id = client.post(
+        "/api/tweets", headers=headers, json={"tweet_data": "celebrity"}
+    ).get_json()["tweet_id"]
+    assert timeline_store.celebrities() == {2}
+    assert tweet_id not in timeline_store.get(1)
+    assert str(tweet_id) in timeline_ids(client, "test")
+    client.delete(f"/api/tweets/{tweet_id}")
+
+
+def test_bulk_tweets_fan_out(client, timeline_store):
+    timeline_ids(client, "test")
+    headers = {"api-key": "test2"}
+    tweets = [{"tweet_data": "bulk fan-out"}] * 3
+    tweet_ids = client.post(
+        "/api/tweets/bulk", headers=headers, json={"tweets": tweets}
+    ).get_json()["tweet_ids"]
+    assert timeline_store.get(1)[:3] == sorted(tweet_ids, reverse=True)
+    for tweet_id in tweet_ids:
+        client.delete(f"/api/tweets/{tweet_id}")
@@ -0,0 +1,241 @@
+import os
+import threading
+import time
+from array import array
+from bisect import bisect_left, insort
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Set
+
+# Сколько последних твитов хранится в подготовленной ленте пользователя
+TIMELINE_LENGTH = 800
+# Сколько секунд живёт лента в памяти процесса (TIMELINE_STORE=memory)
+TIMELINE_MEMORY_TTL = float(os.environ.get("TIMELINE_MEMORY_TTL", 60))
+
+
+class TimelineStore:
+    """
+    Хранилище подготовленных лент: для каждого пользователя — id твитов,
+    которые он должен видеть (свои и подписок). Ранжирование по лайкам
+    выполняется при чтении, хранилище отвечает только за набор кандидатов.
+
+    Отдельно хранится множество «знаменитостей» — авторов, чьи твиты
+    не раскладываются по лентам подписчиков, а подмешиваются при чтении.
+    """
+
+    def get(self, user_id: int) -> Optional[List[int]]:
+        """Лента пользователя (новые твиты первыми) или None, если её нет"""
+        raise NotImplementedError
+
+    def load(self, user_id: int, tweet_ids: Iterable[int]) -> None:
+        """Записывает ленту пользователя целиком"""
+        raise NotImplementedError
+
+    def push(self, user_ids: Iterable[int], tweet_ids: Iterable[int]) -> None:
+        """Добавляет твиты в уже подготовленные ленты пользователей"""
+        raise NotImplementedError
+
+    def remove(self, user_ids: Iterable[int], tweet_ids: Iterable[int]) -> None:
+        """Убирает твиты из лент пользователей"""
+        raise NotImplementedError
+
+    def evict(self, user_id: int) -> None:
+        """Удаляет ленту пользователя, она будет собрана заново при чтении"""
+        raise NotImplementedError
+
+    def add_celebrity(self, user_id: int) -> None:
+        raise NotImplementedError
+
+    def celebrities(self) -> Set[int]:
+        raise NotImplementedError
+
+
+class InProcessTimelineStore(TimelineStore):
+    """
+    Ленты в памяти процесса: по массиву int64 на пользователя,
+    не больше max_users лент (вытесняются давно читавшиеся).
+    Согласовано только в пределах одного процесса-воркера: твиты, подписки
+    и «знаменитости» из других воркеров видны, когда лента старше ttl секунд
+    и собирается из БД заново. При нескольких воркерах gunicorn нужен
+    RedisTimelineStore.
+    """
+
+    def __init__(
+        self,
+        length: int = TIMELINE_LENGTH,
+        max_users: int = 100_000,
+        ttl: float = TIMELINE_MEMORY_TTL,
+    ):
+        self.length = length
+        self.max_users = max_users
+        self.ttl = ttl
+        self._timelines: "OrderedDict[int, array]" = OrderedDict()
+        self._expires: Dict[int, float] = {}
+        self._celebrities: Set[int] = set()
+        self._lock = threading.Lock()
+
+    def get(self, user_id: int) -> Optional[List[int]]:
+        with self._lock:
+            timeline = self._timelines.get(user_id)
+            if timeline is None:
+                return None
+            if self._expires[user_id] <= time.monotonic():
+                del self._timelines[user_id], self._expires[user_id]
+                return None
+            self._timelines.move_to_end(user_id)
+            return timeline[::-1].tolist()
+
+    def load(self, user_id: int, tweet_ids: Iterable[int]) -> None:
+        timeline = array("q", sorted(set(tweet_ids))[-self.length :])
+        with self._lock:
+            self._timelines[user_id] = timeline
+            self._expires[user_id] = time.monotonic() + self.ttl
+            self._timelines.move_to_end(user_id)
+            while len(self._timelines) > self.max_users:
+                oldest, _ = self._timelines.popitem(last=False)
+                del self._expires[oldest]
+
+    def push(self, user_ids: Iterable[int], tweet_ids: Iterable[int]) -> None:
+        tweet_ids = list(tweet_ids)
+        with self._lock:
+            for user_id in user_ids:
+                timeline = self._timelines.get(user_id)
+                if timeline is None:
+                    continue
+                for tweet_id in tweet_ids:
+                    i = bisect_left(timeline, tweet_id)
+                    if i == len(timeline) or timeline[i] != tweet_id:
+                        insort(timeline, tweet_id)
+                if len(timeline) > self.length:
+                    del timeline[: len(timeline) - self.length]
+
+    def remove(self, user_ids: Iterable[int], tweet_ids: Iterable[int]) -> None:
+        tweet_ids = list(tweet_ids)
+        with self._lock:
+            for user_id in user_ids:
+                timeline = self._timelines.get(user_id)
+                if timeline is None:
+                    continue
+                for tweet_id in tweet_ids:
+                    i = bisect_left(timeline, tweet_id)
+                    if i < len(timeline) and timeline[i] == tweet_id:
+                        del timeline[i]
+
+    def evict(self, user_id: int) -> None:
+        with self._lock:
+            self._timelines.pop(user_id, None)
+            self._expires.pop(user_id, None)
+
+    def add_celebrity(self, user_id: int) -> None:
+        with self._lock:
+            self._celebrities.add(user_id)
+
+    def celebrities(self) -> Set[int]:
+        with self._lock:
+            return set(self._celebrities)
+
+
+# Добавление твитов в ленты одной командой: проверка, что лента есть,
+# и запись не разделены, поэтому лента, истёкшая между ними, не появится
+# снова частичной и без TTL. Служебный элемент пустой ленты убирается
+PUSH_SCRIPT = """
+local length, ttl = tonumber(ARGV[1]), tonumber(ARGV[2])
+for _, key in ipairs(KEYS) do
+    if redis.call('EXISTS', key) == 1 then
+        for i = 3, #ARGV do
+            redis.call('ZADD', key, ARGV[i], ARGV[i])
+        end
+        redis.call('ZREM', key, '0')
+        redis.call('ZREMRANGEBYRANK', key, 0, -length - 1)
+        redis.call('EXPIRE', key, ttl)
+    end
+end
+return 0
+"""
+
+
+class RedisTimelineStore(TimelineStore):
+    """
+    Ленты во внешнем хранилище с интерфейсом redis-py: sorted set
+    на пользователя (score = tweet_id), общий для всех воркеров.
+    Клиент передаётся снаружи, поэтому в тестах его можно подменить.
+    """
+
+    def __init__(
+        self,
+        client,
+        length: int = TIMELINE_LENGTH,
+        ttl: int = 7 * 24 * 3600,
+        prefix: str = "timeline:",
+    ):
+        self.client = client
+        self.length = length
+        self.ttl = ttl
+        self.prefix = prefix
+        self._push = client.register_script(PUSH_SCRIPT)
+
+    @classmethod
+    def from_url(cls, url: str, **kwargs) -> "RedisTimelineStore":
+        import redis
+
+        return cls(redis.Redis.from_url(url), **kwargs)
+
+    def _key(self, user_id: int) -> str:
+        return f"{self.prefix}{user_id}"
+
+    def get(self, user_id: int) -> Optional[List[int]]:
+        key = self._key(user_id)
+        pipe = self.client.pipeline()
+        pipe.exists(key)
+        pipe.zrevrange(key, 0, -1)
+        exists, tweet_ids = pipe.execute()
+        if not exists:
+            return None
+        return [int(tweet_id) for tweet_id in tweet_ids if int(tweet_id)]
+
+    def load(self, user_id: int, tweet_ids: Iterable[int]) -> None:
+        key = self._key(user_id)
+        tweet_ids = sorted(set(tweet_ids))[-self.length :]
+        pipe = self.client.pipeline()
+        pipe.delete(key)
+        # Пустая лента хранится как один служебный элемент, чтобы отличать её от отсутствующей
+        pipe.zadd(key, {str(t): t for t in tweet_ids} or {"0": 0})
+        pipe.expire(key, self.ttl)
+        pipe.execute()
+
+    def push(self, user_ids: Iterable[int], tweet_ids: Iterable[int]) -> None:
+        keys = [self._key(user_id) for user_id in user_ids]
+        tweet_ids = list(tweet_ids)
+        if keys and tweet_ids:
+            self._push(keys=keys, args=[self.length, self.ttl, *tweet_ids])
+
+    def remove(self, user_ids: Iterable[int], tweet_ids: Iterable[int]) -> None:
+        members = [str(t) for t in tweet_ids]
+        pipe = self.client.pipeline()
+        for user_id in user_ids:
+            pipe.zrem(self._key(user_id), *members)
+        pipe.execute()
+
+    def evict(self, user_id: int) -> None:
+        self.client.delete(self._key(user_id))
+
+    def add_celebrity(self, user_id: int) -> None:
+        self.client.sadd(f"{self.prefix}celebrities", user_id)
+
+    def celebrities(self) -> Set[int]:
+        return {int(u) for u in self.client.smembers(f"{self.prefix}celebrities")}
+
+
+def create_store(backend: Optional[str]) -> Optional[TimelineStore]:
+    """
+    Хранилище лент по имени бэкенда: "memory", "redis" (адрес в REDIS_URL)
+    или None/"" — лента собирается из БД при каждом запросе
+    """
+    if not backend:
+        return None
+    if backend == "memory":
+        return InProcessTimelineStore()
+    if backend == "redis":
+        return RedisTimelineStore.from_url(
+            os.environ.get("REDIS_URL", "redis://localhost:6379/0")
+        )
+    raise ValueError(f"Неизвестное хранилище лент: {backend}")
@@ -0,0 +1,304 @@
+"""
+Трассировка SQL-запросов и метрики для Prometheus.
+
+TracingCursor замеряет каждый запрос: отпечаток (текст без литералов
+и параметров), длительность и число строк. Замеры складываются в трассу
+текущего HTTP-запроса (для заголовка Server-Timing) и в общие гистограммы
+процесса, которые отдаёт /metrics. На запрос приходится несколько вызовов
+perf_counter и одна короткая блокировка, поэтому трассировку можно держать
+включённой в продакшене; SQL_TRACING=0 выключает её совсем.
+"""
+import hashlib
+import os
+import re
+import threading
+import time
+from contextvars import ContextVar
+from functools import lru_cache
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import psycopg2.extensions
+from slow_queries import slow_log
+
+ENABLED = os.environ.get("SQL_TRACING", "1") == "1"
+
+# Границы корзин гистограмм, секунды
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+# Больше разных отпечатков не заводится, остальные попадают в "other"
+MAX_FINGERPRINTS = 500
+
+# Запросы длиннее не кэшируются: это execute_values с подставленными
+# значениями, кэш держал бы в памяти текст пользователей
+MAX_CACHED_SQL = 4096
+
+_LITERALS = re.compile(r"'(?:[^']|'')*'|\$\d+|%\(\w+\)s|%s|\b\d+(?:\.\d+)?\b")
+_SPACES = re.compile(r"\s+")
+# Группа значений строки VALUES (с одним уровнем вложенных скобок)
+_ROW = r"\((?:[^()]|\([^()]*\))*\)"
+_VALUES_ROWS = re.compile(rf"\b(VALUES\s*{_ROW})(?:\s*,\s*{_ROW})+", re.I)
+
+
+def fingerprint(sql: str) -> Tuple[str, str]:
+    """
+    Нормализованный текст запроса (литералы и параметры заменены на ?,
+    многострочный VALUES сведён к одной строке) и его короткий
+    идентификатор для метки в метриках
+    """
+    if len(sql) > MAX_CACHED_SQL:
+        return _fingerprint(sql)
+    return _cached_fingerprint(sql)
+
+
+def _fingerprint(sql: str) -> Tuple[str, str]:
+    normalized = _VALUES_ROWS.sub(r"\1", _LITERALS.sub("?", sql))
+    normalized = _SPACES.sub(" ", normalized).strip()
+    return hashlib.md5(normalized.encode()).hexdigest()[:12], normalized
+
+
+_cached_fingerprint = lru_cache(maxsize=2048)(_fingerprint)
+
+
+class Histogram:
+    """Гистограмма в формате Prometheus: корзины, сумма и число наблюдений"""
+
+    __slots__ = ("counts", "sum", "count")
+
+    def __init__(self):
+        self.counts = [0] * len(BUCKETS)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        for i, bound in enumerate(BUCKETS):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        self.sum += value
+        self.count += 1
+
+
+class Metrics:
+    """Гистограммы по маршрутам и по запросам к БД (общие для процесса)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._clear()
+
+    def _clear(self) -> None:
+        self.routes: Dict[Tuple[str, str, str], Histogram] = {}
+        self.queries: Dict[str, Histogram] = {}
+        self.query_rows: Dict[str, int] = {}
+        self.statements: Dict[str, str] = {}
+        self.acquire = Histogram()
+
+    def observe_query(self, query_id: str, statement: str, seconds: float, rows: int) -> None:
+        with self._lock:
+            histogram = self.queries.get(query_id)
+            if histogram is None:
+                if len(self.queries) >= MAX_FINGERPRINTS:
+                    query_id, statement = "other", "other"
+                    histogram = self.queries.setdefault(query_id, Histogram())
+                else:
+                    histogram = self.queries[query_id] = Histogram()
+                self.statements[query_id] = statement
+            histogram.observe(seconds)
+            self.query_rows[query_id] = self.query_rows.get(query_id, 0) + rows
+
+    def observe_acquire(self, seconds: float) -> None:
+        with self._lock:
+            self.acquire.observe(seconds)
+
+    def observe_route(self, method: str, route: str, status: str, seconds: float) -> None:
+        key = (method, route, status)
+        with self._lock:
+            histogram = self.routes.get(key)
+            if histogram is None:
+                histogram = self.routes[key] = Histogram()
+            histogram.observe(seconds)
+
+    def reset(self) -> None:
+        with self._lock:
+            self._clear()
+
+
+metrics = Metrics()
+
+
+class RequestTrace:
+    """Запросы к БД в рамках одного HTTP-запроса"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries: List[Tuple[str, float, int]] = []
+        self.acquire = 0.0
+
+    @property
+    def db_time(self) -> float:
+        return sum(seconds for _, seconds, _ in self.queries)
+
+    @property
+    def rows(self) -> int:
+        return sum(rows for _, _, rows in self.queries)
+
+
+current_trace: ContextVar[Optional[RequestTrace]] = ContextVar("current_trace", default=None)
+
+
+def record_query(sql, seconds: float, rows: int, params=None) -> None:
+    if isinstance(sql, bytes):
+        sql = sql.decode()
+    elif not isinstance(sql, str):
+        sql = str(sql)
+    query_id, statement = fingerprint(sql)
+    rows = max(rows, 0)
+    metrics.observe_query(query_id, statement, seconds, rows)
+    slow_log.observe(sql, params, seconds, rows, statement, query_id)
+    trace = current_trace.get()
+    if trace is not None:
+        # list.append атомарен, трасса пополняется и из потоков догрузки ленты
+        trace.queries.append((query_id, seconds, rows))
+
+
+def record_acquire(seconds: float) -> None:
+    """Время ожидания соединения из пула"""
+    if not ENABLED:
+        return
+    metrics.observe_acquire(seconds)
+    trace = current_trace.get()
+    if trace is not None:
+        trace.acquire += seconds
+
+
+class TracingCursor(psycopg2.extensions.cursor):
+    def execute(self, query, vars=None):
+        started = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        finally:
+            rows = self.rowcount if self.description is not None else 0
+            record_query(query, time.perf_counter() - started, rows, vars)
+
+    def execute_as(self, query, vars, traced_query, traced_vars=None):
+        """
+        Выполняет query, а в метрики и журнал медленных запросов записывает
+        traced_query (для EXECUTE подготовленного запроса — его исходный текст)
+        """
+        started = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        finally:
+            rows = self.rowcount if self.description is not None else 0
+            record_query(traced_query, time.perf_counter() - started, rows, traced_vars)
+
+    def executemany(self, query, vars_list):
+        started = time.perf_counter()
+        try:
+            return super().executemany(query, vars_list)
+        finally:
+            record_query(query, time.perf_counter() - started, 0)
+
+    def copy_expert(self, sql, file, size=8192):
+        started = time.perf_counter()
+        try:
+            return super().copy_expert(sql, file, size)
+        finally:
+            record_query(sql, time.perf_counter() - started, 0)
+
+
+def traced(conn_func):
+    """
+    Обёртка над функцией подключения: курсоры соединения трассируются.
+    Соединения с собственным cursor_factory не трогаются
+    """
+    if not ENABLED:
+        return conn_func
+
+    def connect():
+        conn = conn_func()
+        if conn.cursor_factory is None:
+            conn.cursor_factory = TracingCursor
+        return conn
+
+    return connect
+
+
+def server_timing(trace: RequestTrace) -> str:
+    """Значение заголовка Server-Timing (длительности в миллисекундах)"""
+    total = time.perf_counter() - trace.started
+    return ", ".join(
+        [
+            f'db;dur={trace.db_time * 1000:.2f};desc="{len(trace.queries)} queries, {trace.rows} rows"',
+            f"db-acquire;dur={trace.acquire * 1000:.2f}",
+            f"total;dur={total * 1000:.2f}",
+        ]
+    )
+
+
+def escape_label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def histogram_lines(name: str, labels: str, histogram: Histogram) -> Iterable[str]:
+    cumulative = 0
+    prefix = f"{labels}," if labels else ""
+    for bound, count in zip(BUCKETS, histogram.counts):
+        cumulative += count
+        yield f'{name}_bucket{{{prefix}le="{bound}"}} {cumulative}'
+    yield f'{name}_bucket{{{prefix}le="+Inf"}} {histogram.count}'
+    suffix = f"{{{labels}}}" if labels else ""
+    yield f"{name}_sum{suffix} {histogram.sum:.6f}"
+    yield f"{name}_count{suffix} {histogram.count}"
+
+
+def render_metrics(gauges: Dict[str, Dict[str, float]]) -> str:
+    """
+    Метрики в текстовом формате Prometheus. gauges — дополнительные
+    числовые показатели по группам (например, статистика пула)
+    """
+    lines = [
+        "# HELP http_request_duration_seconds Длительность обработки HTTP-запроса",
+        "# TYPE http_request_duration_seconds histogram",
+    ]
+    with metrics._lock:
+        for (method, route, status), histogram in sorted(metrics.routes.items()):
+            labels = (
+                f'method="{method}",route="{escape_label(route)}",status="{status}"'
+            )
+            lines.extend(histogram_lines("http_request_duration_seconds", labels, histogram))
+
+        lines += [
+            "# HELP db_query_duration_seconds Длительность SQL-запроса по отпечатку",
+            "# TYPE db_query_duration_seconds histogram",
+        ]
+        for query_id, histogram in sorted(metrics.queries.items()):
+            lines.extend(
+                histogram_lines("db_query_duration_seconds", f'query_id="{query_id}"', histogram)
+            )
+        lines += [
+            "# HELP db_query_rows_total Строк получено или изменено запросом",
+            "# TYPE db_query_rows_total counter",
+        ]
+        for query_id, rows in sorted(metrics.query_rows.items()):
+            lines.append(f'db_query_rows_total{{query_id="{query_id}"}} {rows}')
+        lines += [
+            "# HELP db_query_info Текст запроса для query_id",
+            "# TYPE db_query_info gauge",
+        ]
+        for query_id, statement in sorted(metrics.statements.items()):
+            lines.append(
+                f'db_query_info{{query_id="{query_id}",statement="{escape_label(statement)}"}} 1'
+            )
+
+        lines += [
+            "# HELP db_connection_acquire_seconds Ожидание соединения из пула",
+            "# TYPE db_connection_acquire_seconds histogram",
+        ]
+        lines.extend(histogram_lines("db_connection_acquire_seconds", "", metrics.acquire))
+
+    for group, values in gauges.items():
+        for key, value in sorted(values.items()):
+            name = f"{group}_{key}"
+            lines.append(f"# TYPE {name} gauge")
+            lines.append(f"{name} {float(value)}")
+    return "\n".join(lines) + "\n"
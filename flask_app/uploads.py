@@ -0,0 +1,171 @@
+"""
+Потоковая загрузка медиафайлов с адресацией по содержимому.
+
+Тело multipart-запроса пишется во временный файл кусками по мере разбора,
+одновременно считается SHA-256 и проверяются размер и тип (по сигнатуре
+первых байт). Временные файлы лежат в UPLOAD_TEMP_FOLDER — вне раздаваемой
+статики, но на той же файловой системе, что и хранилище, чтобы перенос был
+атомарным os.replace. Готовый файл кладётся в
+UPLOAD_FOLDER/ab/cd/<sha256>.<ext>, одинаковое содержимое хранится один раз.
+"""
+import hashlib
+import os
+import tempfile
+from typing import NamedTuple, Optional
+
+from flask import Request, current_app
+from werkzeug.datastructures import FileStorage
+from werkzeug.exceptions import RequestEntityTooLarge, UnsupportedMediaType
+
+MAX_UPLOAD_SIZE = int(os.environ.get("MAX_UPLOAD_SIZE", 10 * 1024 * 1024))
+UPLOAD_TEMP_FOLDER = os.environ.get("UPLOAD_TEMP_FOLDER", "upload_tmp")
+
+# Разрешённые типы: MIME -> расширение файла в хранилище
+ALLOWED_TYPES = {
+    "image/jpeg": "jpg",
+    "image/png": "png",
+    "image/gif": "gif",
+    "image/webp": "webp",
+}
+
+CHUNK_SIZE = 64 * 1024
+
+
+class StoredFile(NamedTuple):
+    file_path: str
+    sha256: str
+    size: int
+    mime_type: str
+
+
+def sniff_mime_type(head: bytes) -> Optional[str]:
+    """MIME-тип изображения по сигнатуре первых байт"""
+    if head.startswith(b"\xff\xd8\xff"):
+        return "image/jpeg"
+    if head.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "image/png"
+    if head[:6] in (b"GIF87a", b"GIF89a"):
+        return "image/gif"
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "image/webp"
+    return None
+
+
+class HashingUpload:
+    """
+    Поток, в который парсер multipart пишет файл: данные уходят во временный
+    файл в directory, по пути считается хеш и проверяются ограничения
+    """
+
+    HEAD_SIZE = 16
+
+    def __init__(self, directory: str, max_size: int):
+        os.makedirs(directory, exist_ok=True)
+        self.max_size = max_size
+        self.size = 0
+        self.mime_type: Optional[str] = None
+        self._hash = hashlib.sha256()
+        self._head = b""
+        self._file = tempfile.NamedTemporaryFile(
+            dir=directory, prefix=".upload-", delete=False
+        )
+        self.name = self._file.name
+
+    def write(self, data: bytes) -> int:
+        self.size += len(data)
+        if self.size > self.max_size:
+            self.discard()
+            raise RequestEntityTooLarge(f"Файл больше {self.max_size} байт")
+        if self.mime_type is None and len(self._head) < self.HEAD_SIZE:
+            self._head += data[: self.HEAD_SIZE - len(self._head)]
+            if len(self._head) >= self.HEAD_SIZE:
+                self._check_type()
+        self._hash.update(data)
+        return self._file.write(data)
+
+    def _check_type(self) -> None:
+        self.mime_type = sniff_mime_type(self._head)
+        if self.mime_type not in ALLOWED_TYPES:
+            self.discard()
+            raise UnsupportedMediaType("Неподдерживаемый тип файла")
+
+    def seek(self, *args) -> int:
+        return self._file.seek(*args)
+
+    def tell(self) -> int:
+        return self._file.tell()
+
+    def read(self, *args) -> bytes:
+        return self._file.read(*args)
+
+    def flush(self) -> None:
+        self._file.flush()
+
+    def close(self) -> None:
+        self._file.close()
+
+    def discard(self) -> None:
+        self._file.close()
+        if os.path.exists(self.name):
+            os.unlink(self.name)
+
+    @property
+    def hexdigest(self) -> str:
+        return self._hash.hexdigest()
+
+    def finish(self) -> None:
+        """Проверка типа для файлов короче HEAD_SIZE байт"""
+        if self.mime_type is None:
+            self._check_type()
+        self._file.flush()
+
+
+class UploadRequest(Request):
+    """Запрос, который пишет загружаемые файлы сразу в HashingUpload"""
+
+    def _get_file_stream(
+        self, total_content_length, content_type, filename=None, content_length=None
+    ):
+        declared = (content_type or "").split(";")[0].strip().lower()
+        if declared and declared != "application/octet-stream" and declared not in ALLOWED_TYPES:
+            raise UnsupportedMediaType("Неподдерживаемый тип файла")
+        return HashingUpload(
+            current_app.config.get("UPLOAD_TEMP_FOLDER", UPLOAD_TEMP_FOLDER),
+            current_app.config.get("MAX_UPLOAD_SIZE", MAX_UPLOAD_SIZE),
+        )
+
+
+def blob_path(upload_folder: str, sha256: str, mime_type: str) -> str:
+    """Путь к файлу в хранилище: два уровня каталогов по префиксу хеша"""
+    filename = f"{sha256}.{ALLOWED_TYPES[mime_type]}"
+    return os.path.join(upload_folder, sha256[:2], sha256[2:4], filename)
+
+
+def store_upload(
+    file: FileStorage, upload_folder: str, temp_folder: str = UPLOAD_TEMP_FOLDER
+) -> StoredFile:
+    """
+    Переносит принятый файл в хранилище. Если файл с таким содержимым
+    уже есть, новая копия удаляется
+    """
+    upload = file.stream
+    if not isinstance(upload, HashingUpload):
+        # Файл разобран не UploadRequest: перекачиваем его через HashingUpload
+        upload = HashingUpload(temp_folder, MAX_UPLOAD_SIZE)
+        for chunk in iter(lambda: file.stream.read(CHUNK_SIZE), b""):
+            upload.write(chunk)
+    upload.finish()
+    upload.close()
+
+    path = blob_path(upload_folder, upload.hexdigest, upload.mime_type)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    try:
+        # Файл с таким содержимым уже есть: свежий mtime не даёт задаче
+        # files.delete удалить его, пока строка media ещё не записана
+        os.utime(path)
+        upload.discard()
+    except FileNotFoundError:
+        # NamedTemporaryFile создаёт файл с правами 0600, статику раздаёт не владелец
+        os.chmod(upload.name, 0o644)
+        os.replace(upload.name, path)
+    return StoredFile(path, upload.hexdigest, upload.size, upload.mime_type)